@@ -29,7 +29,7 @@ setup(name='Deft',
       platforms=['any'],
       
       provides=['deft'],
-      packages=['deft', 'deft.storage', 'deft.history', 'deft.systests', 'deft.web'],
+      packages=['deft', 'deft.storage', 'deft.history', 'deft.systests', 'deft.web', 'deft.benchmarks'],
       package_dir = {'': 'src'},
       scripts=['bin/deft', 'bin/deft-cfd', 'bin/deft-web'],
       
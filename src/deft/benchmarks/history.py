@@ -0,0 +1,307 @@
+"""
+Times walking the history of synthetic Git repositories with many merges, and
+analysing the history of a synthetic tracker as a cumulative flow diagram.
+
+Run with: PYTHONPATH=src python -m deft.benchmarks.history [--sizes N ...] [--output FILE]
+
+The results are printed as a table and written to a JSON file, so that runs
+can be compared to spot performance regressions.
+"""
+
+import sys
+import os
+import json
+import platform
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from random import Random
+from timeit import default_timer as now
+from dulwich.repo import Repo
+from dulwich.objects import Blob, Tree, Commit
+from deft.storage.git import GitStorageHistory
+from deft.storage.filesystem import FileStorage
+from deft.tracker import load_with_storage, CacheDir
+from deft.history import History
+from deft.history.cfd import cumulative_flow, SummaryCacheFile
+from deft.history.cache import SummaryCache
+from deft.warn import IgnoreWarnings
+from deft.benchmarks.tracker import generate_tracker, Statuses
+
+
+DefaultSizes = [1000, 10000]
+DefaultRepeats = 3
+
+Branches = 8
+MergeProbability = 0.3
+CommitInterval = 3*3600
+SinceDays = 30
+
+DefaultTrackerFeatures = 1000
+DefaultTrackerDays = 100
+ChangesPerDay = 5
+Day = 24*3600
+
+
+def generate_repo(repodir, size, rng):
+    """
+    Commits size commits to a new repository.  The commits are made on several
+    branches, which are frequently merged into each other.
+    """
+    repo = Repo.init(repodir)
+
+    blob = Blob.from_string("content\n")
+    tree = Tree()
+    tree.add("file", 0100644, blob.id)
+    repo.object_store.add_objects([(blob, None), (tree, None)])
+
+    commit_time = 1300000000
+    heads = []
+    commits = []
+    for i in range(size):
+        branch = rng.randrange(Branches)
+        parents = [heads[branch]] if branch < len(heads) else heads[-1:]
+        if len(heads) > 1 and rng.random() < MergeProbability:
+            parents.append(rng.choice([h for h in heads if h not in parents]))
+
+        commit = Commit()
+        commit.tree = tree.id
+        commit.parents = parents
+        commit.author = commit.committer = "Benchmark <benchmark@example.com>"
+        commit.author_time = commit.commit_time = commit_time
+        commit.author_timezone = commit.commit_timezone = 0
+        commit.message = "commit %i" % i
+        commits.append((commit, None))
+
+        if branch < len(heads):
+            heads[branch] = commit.id
+        else:
+            heads.append(commit.id)
+        commit_time += CommitInterval
+
+    repo.object_store.add_objects(commits)
+    repo.refs["refs/heads/master"] = commits[-1][0].id
+
+
+def commit_directory(repo, dirpath, parents, commit_time):
+    def write_tree(dirpath):
+        tree = Tree()
+        for name in os.listdir(dirpath):
+            path = os.path.join(dirpath, name)
+            if os.path.isdir(path):
+                if os.path.relpath(path, root) != CacheDir:
+                    tree.add(name, 040000, write_tree(path).id)
+            else:
+                with open(path) as input:
+                    blob = Blob.from_string(input.read())
+                repo.object_store.add_object(blob)
+                tree.add(name, 0100644, blob.id)
+        repo.object_store.add_object(tree)
+        return tree
+
+    root = dirpath
+    commit = Commit()
+    commit.tree = write_tree(dirpath).id
+    commit.parents = parents
+    commit.author = commit.committer = "Benchmark <benchmark@example.com>"
+    commit.author_time = commit.commit_time = commit_time
+    commit.author_timezone = commit.commit_timezone = 0
+    commit.message = "tracker changes"
+    repo.object_store.add_object(commit)
+    return commit.id
+
+
+def generate_tracker_history(repodir, workdir, features, days, rng):
+    """
+    Commits a tracker to a new repository once a day, changing the status of a
+    few of its features each day
+    """
+    repo = Repo.init(repodir)
+    storage = FileStorage(workdir)
+    generate_tracker(storage, features, rng)
+
+    statuses = [status for (status, weight) in Statuses]
+    commit_time = 1300000000
+    parents = []
+    for day in range(days):
+        if day > 0:
+            tracker = load_with_storage(storage, IgnoreWarnings())
+            tracker.buffer_writes()
+            for i in range(ChangesPerDay):
+                tracker.feature_named("feature-%i" % rng.randrange(features)).status = rng.choice(statuses)
+            tracker.save()
+
+        parents = [commit_directory(repo, workdir, parents, commit_time)]
+        commit_time += Day
+
+    repo.refs["refs/heads/master"] = parents[0]
+
+
+def cfd_buckets():
+    return [[status] for (status, weight) in Statuses]
+
+
+def cumulative_flow_replayed(repodir):
+    history = History(GitStorageHistory(repodir), IgnoreWarnings())
+    return cumulative_flow(history, history.latest_revision, cfd_buckets(), IgnoreWarnings())
+
+
+def cumulative_flow_cached(repodir):
+    """
+    Timed from after the status counts have been cached by an earlier run
+    """
+    storage_history = GitStorageHistory(repodir)
+    history = History(storage_history, IgnoreWarnings())
+    cache = SummaryCache(storage_history.control_path(SummaryCacheFile))
+    return cumulative_flow(history, history.latest_revision, cfd_buckets(), IgnoreWarnings(), cache=cache)
+
+
+def cumulative_flow_with_full_loads(repodir):
+    """
+    Counts features as deft-cfd did before replaying history, by loading a
+    tracker for every day
+    """
+    history = History(GitStorageHistory(repodir), IgnoreWarnings())
+    summaries = []
+    for date, commit_sha in sorted(history.eod_revisions().iteritems()):
+        tracker = history[commit_sha]
+        summaries.append([sum(tracker.count_features_with_status(s) for s in bucket) for bucket in cfd_buckets()])
+    return summaries
+
+
+def eod_revisions(repodir, latest_date):
+    return GitStorageHistory(repodir).eod_revisions()
+
+
+def eod_revisions_since(repodir, latest_date):
+    return GitStorageHistory(repodir).eod_revisions(since=latest_date - timedelta(days=SinceDays))
+
+
+def remove_commit_index(repodir):
+    history = GitStorageHistory(repodir)
+    if os.path.exists(history.commits.path):
+        os.remove(history.commits.path)
+
+
+# Operations timed without a saved commit index
+Operations = [eod_revisions, eod_revisions_since]
+
+
+def time_operations(repodir, repeats, record):
+    latest_date = max(GitStorageHistory(repodir).eod_revisions())
+    remove_commit_index(repodir)
+
+    for operation in Operations:
+        times = []
+        for r in range(repeats):
+            times.append(timed(lambda: operation(repodir, latest_date)))
+            remove_commit_index(repodir)
+        record(operation.__name__, min(times))
+
+    # Timed from after the commit index has been saved by an earlier walk
+    GitStorageHistory(repodir).eod_revisions()
+    record("eod_revisions_with_commit_index",
+           min(timed(lambda: eod_revisions(repodir, latest_date)) for r in range(repeats)))
+
+
+def timed(operation):
+    start = now()
+    operation()
+    return now() - start
+
+
+def time_cumulative_flow(features, days, repeats, record):
+    tempdir = tempfile.mkdtemp(prefix="deft-benchmark-")
+    try:
+        repodir = os.path.join(tempdir, "repo")
+        workdir = os.path.join(tempdir, "work")
+        os.makedirs(repodir)
+        os.makedirs(workdir)
+        generate_tracker_history(repodir, workdir, features, days, Random(features))
+
+        cumulative_flow_cached(repodir)
+        
+        for operation in [cumulative_flow_cached, cumulative_flow_replayed, cumulative_flow_with_full_loads]:
+            record(operation.__name__, min(timed(lambda: operation(repodir)) for r in range(repeats)))
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+
+def run(sizes, repeats, output, tracker_features=DefaultTrackerFeatures, tracker_days=DefaultTrackerDays):
+    results = []
+
+    print "%8s  %-36s %12s" % ("commits", "operation", "time (ms)")
+
+    for size in sizes:
+        repodir = tempfile.mkdtemp(prefix="deft-benchmark-")
+        try:
+            generate_repo(repodir, size, Random(size))
+
+            def record(operation, seconds):
+                results.append({"commits": size, "operation": operation, "seconds": seconds})
+                print "%8d  %-36s %12.2f" % (size, operation, seconds*1e3)
+                sys.stdout.flush()
+
+            time_operations(repodir, repeats, record)
+        finally:
+            shutil.rmtree(repodir, ignore_errors=True)
+
+    def record_cfd(operation, seconds):
+        results.append({"commits": tracker_days, "features": tracker_features,
+                        "operation": operation, "seconds": seconds})
+        print "%8d  %-36s %12.2f" % (tracker_days, operation, seconds*1e3)
+        sys.stdout.flush()
+
+    time_cumulative_flow(tracker_features, tracker_days, repeats, record_cfd)
+
+    report = {
+        "date": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": repeats,
+        "tracker_features": tracker_features,
+        "changes_per_day": ChangesPerDay,
+        "results": results}
+
+    output_dir = os.path.dirname(output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def main(argv):
+    parser = ArgumentParser(
+        prog="deft.benchmarks.history",
+        description="Times walking the history of synthetic Git repositories")
+    parser.add_argument("-n", "--sizes",
+                        help="the numbers of commits in the generated repositories",
+                        metavar="N",
+                        type=int,
+                        nargs="+",
+                        default=DefaultSizes)
+    parser.add_argument("--tracker-features",
+                        help="the number of features in the tracker whose history is analysed",
+                        metavar="N",
+                        type=int,
+                        default=DefaultTrackerFeatures)
+    parser.add_argument("--tracker-days",
+                        help="the number of days of tracker history to analyse",
+                        metavar="N",
+                        type=int,
+                        default=DefaultTrackerDays)
+    parser.add_argument("-r", "--repeats",
+                        help="the number of times each operation is timed (the fastest time is reported)",
+                        type=int,
+                        default=DefaultRepeats)
+    parser.add_argument("-o", "--output",
+                        help="the file to which results are written in JSON format",
+                        default=os.path.join("output", "benchmarks", "history.json"))
+
+    args = parser.parse_args(argv)
+    run(args.sizes, args.repeats, args.output, args.tracker_features, args.tracker_days)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
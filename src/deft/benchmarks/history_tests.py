@@ -0,0 +1,23 @@
+import os
+import json
+from deft.benchmarks.history import run
+from deft.fileops import ensure_empty_dir_exists
+from hamcrest import *
+from nose.plugins.attrib import attr
+
+
+@attr("fileio")
+def test_writes_a_timing_for_each_operation_to_results_file():
+    outdir = os.path.join("output", "testing", "benchmarks")
+    ensure_empty_dir_exists(outdir)
+    output = os.path.join(outdir, "history-results.json")
+    
+    run(sizes=[50], repeats=1, output=output, tracker_features=20, tracker_days=3)
+    
+    with open(output) as input:
+        results = json.load(input)["results"]
+    
+    assert_that(set(r["operation"] for r in results), equal_to(set([
+        "eod_revisions", "eod_revisions_since", "eod_revisions_with_commit_index",
+        "cumulative_flow_cached", "cumulative_flow_replayed", "cumulative_flow_with_full_loads"])))
+    assert_that(all(r["seconds"] >= 0 for r in results))
@@ -0,0 +1,51 @@
+"""
+Compares the list-based and tree-based priority indices.
+
+Run with: PYTHONPATH=src python -m deft.benchmarks.priority_index [size ...]
+"""
+
+import sys
+from random import Random
+from timeit import default_timer as now
+from deft.indexing import PriorityIndex, TreePriorityIndex
+
+
+DefaultSizes = [100, 1000, 10000, 100000]
+Operations = 1000
+
+
+def run(index_type, size, rng):
+    names = ["feature-" + str(i) for i in range(size)]
+    
+    start = now()
+    index = index_type(names)
+    build_time = now() - start
+    
+    moves = [(rng.choice(names), rng.randint(1, size)) for i in range(Operations)]
+    start = now()
+    for name, priority in moves:
+        index.change_priority(name, priority)
+    change_time = now() - start
+    
+    probes = [rng.choice(names) for i in range(Operations)]
+    start = now()
+    for name in probes:
+        index.priority_of_feature(name)
+    lookup_time = now() - start
+    
+    return build_time, change_time/Operations, lookup_time/Operations
+
+
+def main(args):
+    sizes = map(int, args) or DefaultSizes
+    
+    print "%-18s %8s %12s %14s %14s" % ("index", "size", "build (ms)", "change (us)", "lookup (us)")
+    for size in sizes:
+        for index_type in (PriorityIndex, TreePriorityIndex):
+            build_time, change_time, lookup_time = run(index_type, size, Random(size))
+            print "%-18s %8d %12.2f %14.2f %14.2f" % (
+                index_type.__name__, size, build_time*1e3, change_time*1e6, lookup_time*1e6)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,287 @@
+"""
+Times common tracker operations on synthetic trackers of different sizes, held
+in different kinds of storage.
+
+Run with: PYTHONPATH=src python -m deft.benchmarks.tracker [--sizes N ...] [--output FILE]
+
+The results are printed as a table and written to a JSON file, so that runs
+can be compared to spot performance regressions.
+"""
+
+import sys
+import os
+import json
+import platform
+import shutil
+import tempfile
+from copy import deepcopy
+from argparse import ArgumentParser
+from datetime import datetime
+from random import Random
+from timeit import default_timer as now
+from deft.tracker import init_with_storage, load_with_storage, LoadCacheFile
+from deft.cli import features_to_table
+from deft.warn import IgnoreWarnings
+from deft.storage.filesystem import FileStorage
+from deft.storage.memory import MemStorage
+from deft.storage.overlay import OverlayStorage
+from deft.storage.pack import PackStorage
+
+
+DefaultSizes = [1000, 10000, 100000]
+DefaultRepeats = 3
+ChangesPerOperation = 20
+
+Statuses = [("new", 40), ("analysis", 5), ("in-progress", 5), ("review", 5), ("done", 45)]
+Components = ["ui", "web", "storage", "history", "cli", "reports", "packaging"]
+Milestones = ["0.1", "0.2", "0.3", "1.0", "1.1", "2.0"]
+Estimates = ["XS", "S", "M", "L", "XL"]
+Owners = ["alice", "bob", "carol", "dave", "eve", "mallory", "trent", "victor"]
+Tags = ["bug", "feature", "chore", "security", "performance", "usability", "docs", "tests"]
+Words = ("the tracker should let a user see which features are blocked and why when "
+         "listing them so that the team can decide what to do next without opening "
+         "each description in an editor").split()
+
+ListedProperties = ["component", "milestone", "estimate", "owner"]
+
+
+def synthetic_properties(rng, i):
+    return {
+        "component": rng.choice(Components),
+        "milestone": rng.choice(Milestones),
+        "estimate": rng.choice(Estimates),
+        "owner": rng.choice(Owners),
+        "tags": rng.sample(Tags, rng.randint(0, 3)),
+        "created": "2011-%02d-%02d" % (rng.randint(1, 12), rng.randint(1, 28)),
+        "depends-on": ["feature-%d" % rng.randrange(i)] if i > 0 and rng.random() < 0.2 else []}
+
+
+def synthetic_description(rng):
+    lines = [" ".join(rng.choice(Words) for w in range(rng.randint(6, 14))) for l in range(rng.randint(1, 6))]
+    return "\n".join(lines) + "\n"
+
+
+def synthetic_status(rng):
+    n = rng.randrange(sum(weight for (status, weight) in Statuses))
+    for status, weight in Statuses:
+        if n < weight:
+            return status
+        n -= weight
+
+
+def generate_tracker(storage, size, rng):
+    tracker = init_with_storage(storage, IgnoreWarnings(), {})
+    tracker.buffer_writes()
+    for i in range(size):
+        tracker.create(name="feature-%d" % i,
+                       status=synthetic_status(rng),
+                       description=synthetic_description(rng),
+                       properties=synthetic_properties(rng, i))
+    tracker.save()
+
+
+class Storages(object):
+    """
+    Creates the storage for each benchmark, and cleans up after them
+    """
+
+    def __init__(self):
+        self._tempdirs = []
+
+    def file(self, basedir=None):
+        return FileStorage(basedir or self._tempdir())
+
+    def memory(self):
+        return MemStorage()
+
+    def pack(self, basedir=None):
+        return PackStorage(basedir or self._tempdir())
+
+    kinds = ["file", "memory", "overlay", "pack"]
+
+    def create(self, kind):
+        """
+        Returns the storage in which to generate a tracker and the storage
+        through which to use it
+        """
+        if kind == "overlay":
+            # As used to load trackers from historical snapshots
+            underlay = self.file()
+            return underlay, OverlayStorage(underlay)
+        else:
+            storage = getattr(self, kind)()
+            return storage, storage
+
+    def copy(self, kind, generated_storage):
+        """
+        Returns a storage through which to use a copy of the tracker generated
+        in a storage returned by create, so that changes made to the copy do
+        not affect later benchmarks
+        """
+        if kind == "memory":
+            return deepcopy(generated_storage)
+
+        copied_dir = os.path.join(self._tempdir(), "copy")
+        shutil.copytree(generated_storage.basedir, copied_dir)
+        if kind == "overlay":
+            return OverlayStorage(self.file(copied_dir))
+        else:
+            return getattr(self, kind)(copied_dir)
+
+    def _tempdir(self):
+        self._tempdirs.append(tempfile.mkdtemp(prefix="deft-benchmark-"))
+        return self._tempdirs[-1]
+
+    def cleanup(self):
+        for d in self._tempdirs:
+            shutil.rmtree(d, ignore_errors=True)
+        self._tempdirs = []
+
+
+def load(storage, rng):
+    return load_with_storage(storage, IgnoreWarnings())
+
+
+def load_uncached(storage, rng):
+    storage.remove(LoadCacheFile)
+    return load_with_storage(storage, IgnoreWarnings())
+
+
+def all_features(tracker, rng):
+    return list(tracker.all_features())
+
+
+def features_to_table_with_properties(tracker, rng):
+    return features_to_table(tracker.all_features(), ListedProperties)
+
+
+def change_priority(tracker, rng):
+    statuses = tracker.statuses()
+    for i in range(ChangesPerOperation):
+        features = tracker.features_with_status(rng.choice(statuses))
+        rng.choice(features).priority = rng.randint(1, len(features))
+
+
+def bulk_change_status(tracker, rng):
+    from_status, to_status = rng.sample(tracker.statuses(), 2)
+    tracker.bulk_change_status(from_status, to_status)
+
+
+def purge(tracker, rng):
+    for feature in some_features(tracker, rng):
+        tracker.purge(feature.name)
+
+
+def rename(tracker, rng):
+    for feature in some_features(tracker, rng):
+        feature.name = feature.name + "-renamed"
+
+
+def some_features(tracker, rng):
+    features = list(tracker.all_features())
+    return rng.sample(features, min(ChangesPerOperation, len(features)))
+
+
+# Operations on storage, timed from the start of loading a tracker
+LoadOperations = [load, load_uncached]
+
+# Operations on a tracker, timed from after it has loaded
+QueryOperations = [all_features, features_to_table_with_properties]
+
+# Operations that change a tracker, timed from after it has loaded to after it has saved its changes
+ChangeOperations = [change_priority, bulk_change_status, purge, rename]
+
+
+def time_operations(storage, copy_storage, repeats, rng, record):
+    for operation in LoadOperations:
+        record(operation.__name__, min(timed(operation, storage, rng) for r in range(repeats)))
+
+    # Each repetition loads a new tracker, so that it does not benefit from the caches of the last
+    for operation in QueryOperations:
+        record(operation.__name__, min(timed_after_load(operation, storage, rng) for r in range(repeats)))
+
+    # Each repetition changes a fresh copy of the generated tracker, so that all are timed on a
+    # tracker of the same size and shape
+    for operation in ChangeOperations:
+        record(operation.__name__, min(timed_after_load(operation, copy_storage(), rng) for r in range(repeats)))
+
+
+def timed_after_load(operation, storage, rng):
+    tracker = load_with_storage(storage, IgnoreWarnings())
+    tracker.buffer_writes()
+    return timed(lambda tracker, rng: (operation(tracker, rng), tracker.save()), tracker, rng)
+
+
+def timed(operation, subject, rng):
+    start = now()
+    operation(subject, rng)
+    return now() - start
+
+
+def run(sizes, storage_kinds, repeats, output):
+    results = []
+
+    print "%-10s %8s  %-36s %12s" % ("storage", "features", "operation", "time (ms)")
+
+    for size in sizes:
+        for kind in storage_kinds:
+            storages = Storages()
+            try:
+                generated_storage, storage = storages.create(kind)
+                generate_tracker(generated_storage, size, Random(size))
+
+                def record(operation, seconds):
+                    results.append({"storage": kind, "features": size, "operation": operation, "seconds": seconds})
+                    print "%-10s %8d  %-36s %12.2f" % (kind, size, operation, seconds*1e3)
+                    sys.stdout.flush()
+
+                copy_storage = lambda: storages.copy(kind, generated_storage)
+                time_operations(storage, copy_storage, repeats, Random(size), record)
+            finally:
+                storages.cleanup()
+
+    report = {
+        "date": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": repeats,
+        "changes_per_operation": ChangesPerOperation,
+        "results": results}
+
+    output_dir = os.path.dirname(output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def main(argv):
+    parser = ArgumentParser(
+        prog="deft.benchmarks.tracker",
+        description="Times tracker operations on synthetic trackers")
+    parser.add_argument("-n", "--sizes",
+                        help="the numbers of features in the generated trackers",
+                        metavar="N",
+                        type=int,
+                        nargs="+",
+                        default=DefaultSizes)
+    parser.add_argument("-s", "--storage",
+                        help="the kinds of storage to benchmark",
+                        dest="storage_kinds",
+                        choices=Storages.kinds,
+                        nargs="+",
+                        default=Storages.kinds)
+    parser.add_argument("-r", "--repeats",
+                        help="the number of times each operation is timed (the fastest time is reported)",
+                        type=int,
+                        default=DefaultRepeats)
+    parser.add_argument("-o", "--output",
+                        help="the file to which results are written in JSON format",
+                        default=os.path.join("output", "benchmarks", "tracker.json"))
+
+    args = parser.parse_args(argv)
+    run(args.sizes, args.storage_kinds, args.repeats, args.output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,44 @@
+import os
+import json
+from random import Random
+from deft.benchmarks.tracker import run, generate_tracker, Storages
+from deft.tracker import load_with_storage
+from deft.warn import IgnoreWarnings
+from deft.fileops import ensure_empty_dir_exists
+from hamcrest import *
+from nose.plugins.attrib import attr
+
+
+@attr("fileio")
+def test_writes_a_timing_for_each_operation_on_each_storage_to_results_file():
+    outdir = os.path.join("output", "testing", "benchmarks")
+    ensure_empty_dir_exists(outdir)
+    output = os.path.join(outdir, "results.json")
+    
+    run(sizes=[30], storage_kinds=["memory", "overlay"], repeats=1, output=output)
+    
+    with open(output) as input:
+        results = json.load(input)["results"]
+    
+    assert_that(len(results), equal_to(2*8))
+    assert_that(set(r["operation"] for r in results), has_items("load", "change_priority", "rename"))
+    assert_that(all(r["seconds"] >= 0 for r in results))
+
+
+@attr("fileio")
+def test_changes_made_to_a_copy_of_a_generated_tracker_do_not_affect_the_original():
+    for kind in Storages.kinds:
+        storages = Storages()
+        try:
+            generated_storage, storage = storages.create(kind)
+            generate_tracker(generated_storage, 10, Random(10))
+            
+            copied_tracker = load_with_storage(storages.copy(kind, generated_storage), IgnoreWarnings())
+            copied_tracker.purge("feature-0")
+            copied_tracker.save()
+            
+            tracker = load_with_storage(storage, IgnoreWarnings())
+            assert_that(len(list(tracker.all_features())), equal_to(10), kind)
+            assert_that(len(list(copied_tracker.all_features())), equal_to(9), kind)
+        finally:
+            storages.cleanup()
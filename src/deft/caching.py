@@ -0,0 +1,43 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A dictionary of bounded size that evicts the least recently used entries
+    and counts cache hits and misses.
+    """
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, key):
+        return key in self._entries
+    
+    def get(self, key, load):
+        if key in self._entries:
+            self.hits += 1
+            value = self._entries.pop(key)
+        else:
+            self.misses += 1
+            value = load()
+            if len(self._entries) >= self.max_size:
+                self._entries.popitem(last=False)
+        
+        self._entries[key] = value
+        return value
+    
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def __repr__(self):
+        return "%s(max_size=%i, size=%i, hits=%i, misses=%i)" % (
+            self.__class__.__name__, self.max_size, len(self), self.hits, self.misses)
@@ -0,0 +1,69 @@
+
+from deft.caching import LRUCache
+from hamcrest import *
+
+
+def loader(value):
+    def load():
+        return value
+    return load
+
+def failing_loader():
+    raise AssertionError("should not have loaded value")
+
+
+class LRUCache_Tests:
+    def test_loads_value_on_first_access_and_remembers_it(self):
+        cache = LRUCache(max_size=10)
+        
+        assert_that(cache.get("a", loader(1)), equal_to(1))
+        assert_that(cache.get("a", failing_loader), equal_to(1))
+        
+    def test_counts_hits_and_misses(self):
+        cache = LRUCache(max_size=10)
+        
+        cache.get("a", loader(1))
+        cache.get("a", loader(1))
+        cache.get("b", loader(2))
+        cache.get("a", loader(1))
+        
+        assert_that(cache.hits, equal_to(2))
+        assert_that(cache.misses, equal_to(2))
+    
+    def test_evicts_least_recently_used_entry_when_full(self):
+        cache = LRUCache(max_size=2)
+        
+        cache.get("a", loader(1))
+        cache.get("b", loader(2))
+        cache.get("a", loader(1))
+        cache.get("c", loader(3))
+        
+        assert_that(len(cache), equal_to(2))
+        assert_that("a" in cache)
+        assert_that("b" not in cache)
+        assert_that("c" in cache)
+    
+    def test_reloads_invalidated_entries(self):
+        cache = LRUCache(max_size=10)
+        
+        cache.get("a", loader(1))
+        cache.invalidate("a")
+        
+        assert_that(cache.get("a", loader(2)), equal_to(2))
+    
+    def test_ignores_invalidation_of_entries_not_in_cache(self):
+        cache = LRUCache(max_size=10)
+        
+        cache.invalidate("a")
+        
+        assert_that(len(cache), equal_to(0))
+    
+    def test_does_not_remember_value_if_load_fails(self):
+        cache = LRUCache(max_size=10)
+        
+        try:
+            cache.get("a", failing_loader)
+        except AssertionError:
+            pass
+        
+        assert_that("a" not in cache)
@@ -9,8 +9,11 @@ import subprocess
 from argparse import ArgumentParser, Action
 import deft.tracker
 from deft.warn import PrintWarnings
-from deft.tracker import UserError, FormatVersion
+from deft.tracker import UserError, FormatVersion, PackFile
+from deft.storage.filesystem import Durabilities
+from deft.storage.instrumented import InstrumentedStorage, IOStats
 from deft.upgrade import create_upgrader
+from deft.query import parse_query, select_features
 from deft.formats import *
 
 
@@ -34,12 +37,32 @@ def run_editor_process(path):
 def with_tracker(function):
     def wrapper(self, args):
         tracker = self.backend.load_tracker(self.warning_listener)
+        tracker.buffer_writes()
         function(self, tracker, args)
         tracker.save()
     
     return wrapper
 
 
+class InstrumentedBackend(object):
+    """
+    Records the operations that commands perform on the tracker's storage
+    """
+    
+    def __init__(self, backend, stats):
+        self.backend = backend
+        self.stats = stats
+    
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+    
+    def tracker_storage(self):
+        return InstrumentedStorage(self.backend.tracker_storage(), self.stats)
+    
+    def load_tracker(self, warning_listener):
+        return deft.tracker.load_with_storage(self.tracker_storage(), warning_listener)
+
+
 def _ignore_output(s):
     pass
     
@@ -75,6 +98,12 @@ _UnindexedFeatureMessage = \
 
 _UnknownFeatureMessage = \
     "nonexistent feature {name} found in index for status {status}: removed from index"
+
+_InconsistentJournalRecordMessage = \
+    "journal of status {status} contains a change that does not apply to its index: ignored {record}"
+
+_InterruptedMoveMessage = \
+    "file {path} was being renamed when deft was interrupted: completed the rename"
                                
 
 class CommandLineInterface(object):
@@ -82,10 +111,13 @@ class CommandLineInterface(object):
         self.backend = backend
         self.editor = editor
         self.out = out
+        self.err = err
         self.warning_listener = PrintWarnings(err, "WARNING: ",
             duplicate_entries=_DuplicateEntriesMessage,
             unindexed_feature=_UnindexedFeatureMessage,
-            unknown_feature=_UnknownFeatureMessage)
+            unknown_feature=_UnknownFeatureMessage,
+            inconsistent_journal_record=_InconsistentJournalRecordMessage,
+            interrupted_move=_InterruptedMoveMessage)
         
     def run(self, argv):
         command = argv[0]
@@ -106,12 +138,39 @@ class CommandLineInterface(object):
                             dest="info_output",
                             const=_ignore_output,
                             default=self.println)
+        parser.add_argument("--io-stats",
+                            help="report the operations performed on the tracker's files, "
+                                 "and the time they took, to standard error",
+                            dest="io_stats",
+                            action="store_true",
+                            default=False)
         
         tracker_configuration = ArgumentParser(add_help=False)
         tracker_configuration.add_argument("-i", "--initial-status",
                                            help="the default initial status for new features",
                                            dest="initial_status",
                                            default=None)
+        tracker_configuration.add_argument("-j", "--journal",
+                                           help="append changes to status indices to journals, "
+                                                "instead of rewriting the indices, until the journals "
+                                                "are compacted",
+                                           dest="journal",
+                                           action="store_const",
+                                           const=True,
+                                           default=None)
+        tracker_configuration.add_argument("--no-journal",
+                                           help="rewrite status indices when they change, "
+                                                "compacting any existing journals",
+                                           dest="journal",
+                                           action="store_const",
+                                           const=False)
+        tracker_configuration.add_argument("--durability",
+                                           help="when changes are forced to disk: when the operating system "
+                                                "chooses (none), at the end of each command (command), "
+                                                "or as each file is written (file)",
+                                           dest="durability",
+                                           choices=Durabilities,
+                                           default=None)
         
         subparsers = parser.add_subparsers(title="subcommands", 
                                            dest="subcommand")
@@ -162,6 +221,12 @@ class CommandLineInterface(object):
                                  dest="properties",
                                  default=[],
                                  nargs="+")
+        list_parser.add_argument("-w", "--where",
+                                 help="only list features that match a query, for example: "
+                                      "\"component = ui and priority <= 3\"",
+                                 metavar="QUERY",
+                                 dest="where",
+                                 default=None)
         list_parser.add_argument("-c", "--csv",
                                  help="output in CSV format (default is human-readable text)",
                                  dest="format",
@@ -183,6 +248,13 @@ class CommandLineInterface(object):
                                    action="store_const",
                                    const=True,
                                    default=False)
+        status_parser.add_argument("-p", "--at-priority",
+                                   help="the priority at which to insert the feature(s) into the new status "
+                                        "(by default they are added after the features already in that status)",
+                                   dest="at_priority",
+                                   metavar="N",
+                                   type=int,
+                                   default=None)
                                    
         status_parser.add_argument("status",
                                    help="the new status of the feature, if changing the status",
@@ -273,13 +345,41 @@ class CommandLineInterface(object):
                                   metavar="name",
                                   nargs="+")
         
+        compact_parser = subparsers.add_parser("compact",
+                                               help="write the changes recorded in the journals of the "
+                                                    "status indices to the indices and delete the journals")
+        
+        pack_parser = subparsers.add_parser("pack",
+                                            help="store the tracker database in a single pack file")
+        
+        unpack_parser = subparsers.add_parser("unpack",
+                                              help="store the tracker database as plain text files, "
+                                                   "one or more per feature")
+        
         upgrade_parser = subparsers.add_parser("upgrade-format",
                                                help="upgrade the tracker database to the format "
                                                     "supported by this version of the software")
         
         args = parser.parse_args(argv[1:])
+        
+        if args.io_stats:
+            self._run_instrumented(args)
+        else:
+            self._run_subcommand(args)
+    
+    def _run_subcommand(self, args):
         getattr(self, "run_" + args.subcommand.replace("-", "_"))(args)
     
+    def _run_instrumented(self, args):
+        stats = IOStats()
+        backend = self.backend
+        self.backend = InstrumentedBackend(backend, stats)
+        try:
+            self._run_subcommand(args)
+        finally:
+            self.backend = backend
+            stats.write_summary(self.err)
+    
     
     def run_init(self, args):
         config = {}
@@ -288,6 +388,10 @@ class CommandLineInterface(object):
             config['datadir'] = args.datadir
         if args.initial_status is not None:
             config['initial_status'] = args.initial_status
+        if args.journal is not None:
+            config['journal_status_indices'] = args.journal
+        if args.durability is not None:
+            config['durability'] = args.durability
         
         self.backend.init_tracker(self.warning_listener, **config)
         args.info_output("initialised Deft tracker")
@@ -299,6 +403,10 @@ class CommandLineInterface(object):
         
         if args.initial_status is not None:
             config['initial_status'] = args.initial_status
+        if args.journal is not None:
+            config['journal_status_indices'] = args.journal
+        if args.durability is not None:
+            config['durability'] = args.durability
         
         tracker.configure(**config)
     
@@ -314,7 +422,7 @@ class CommandLineInterface(object):
             feature.priority = args.priority
         
         if args.description is None:
-            self.editor(feature.description_file)
+            self.edit(tracker, feature, feature.description_file)
             
     
     @with_tracker
@@ -329,6 +437,13 @@ class CommandLineInterface(object):
         else:
             features = tracker.all_features()
         
+        if args.where is not None:
+            selected = select_features(tracker, parse_query(args.where))
+            features = (f for f in features if f.name in selected)
+        
+        if args.properties:
+            features = tracker.prefetching(features, properties=True)
+        
         table = features_to_table(features, args.properties)
         
         args.format(table, self.out)
@@ -339,13 +454,16 @@ class CommandLineInterface(object):
             if args.status is None:
                 raise UserError("new status not specified")
             else:
-                tracker.bulk_change_status(from_status=args.name, to_status=args.status)
+                tracker.bulk_change_status(from_status=args.name, to_status=args.status, 
+                                           priority=args.at_priority)
         else:
             feature = tracker.feature_named(args.name)
             if args.status is None:
                 self.println(feature.status)
             else:
                 feature.status = args.status
+                if args.at_priority is not None:
+                    feature.priority = args.at_priority
 
     
     @with_tracker
@@ -364,7 +482,7 @@ class CommandLineInterface(object):
             feature.description = args.description
         
         if args.edit:
-            self.editor(feature.description_file)
+            self.edit(tracker, feature, feature.description_file)
         elif args.file:
             self.println(feature.description_file)
         elif args.description is None:
@@ -375,7 +493,7 @@ class CommandLineInterface(object):
         feature = tracker.feature_named(args.feature)
         
         if args.edit:
-            self.editor(feature.properties_file)
+            self.edit(tracker, feature, feature.properties_file)
         elif args.file:
             self.println(feature.properties_file)
         else:
@@ -404,6 +522,18 @@ class CommandLineInterface(object):
         for name in args.features:
             tracker.purge(name)
     
+    @with_tracker
+    def run_compact(self, tracker, args):
+        tracker.compact_status_indices()
+    
+    def run_pack(self, args):
+        self.backend.pack_tracker()
+        args.info_output("packed tracker into " + PackFile)
+    
+    def run_unpack(self, args):
+        self.backend.unpack_tracker()
+        args.info_output("unpacked tracker")
+    
     def run_upgrade_format(self, args):
         upgrader = create_upgrader()
         storage = self.backend.tracker_storage()
@@ -412,6 +542,10 @@ class CommandLineInterface(object):
         else:
             args.info_output("already at format version " + FormatVersion)
     
+    def edit(self, tracker, feature, filename):
+        self.editor(filename)
+        tracker.feature_files_changed(feature)
+    
     def println(self, text):
         self.out.write(text)
         self.out.write(os.linesep)
@@ -2,6 +2,7 @@
 from deft.tracker import UserError, load_with_storage
 from deft.upgrade import create_upgrader
 from deft.storage.overlay import OverlayStorage
+from deft.history.replay import StatusCounts
 
 
 class HistoricalBackend(object):
@@ -21,13 +22,29 @@ class History(object):
     def __init__(self, storage_history, warning_listener):
         self.storage_history = storage_history
         self.warning_listener = warning_listener
+        self._status_counts = None
     
     def __getitem__(self, revision_id):
-        return HistoricalBackend(self.storage_history[revision_id]).load_tracker(self.warning_listener)
+        return self.load(revision_id, self.warning_listener)
+    
+    def load(self, revision_id, warning_listener):
+        return HistoricalBackend(self.storage_history[revision_id]).load_tracker(warning_listener)
+    
+    def status_counts(self, revision_id, warning_listener=None):
+        """
+        Returns a dict that maps the statuses of the tracker at a revision to the
+        number of features with that status.  Problems found in the tracker are
+        reported to warning_listener, if given, instead of the history's.
+        """
+        if self._status_counts is None:
+            self._status_counts = StatusCounts(self)
+        if warning_listener is None:
+            warning_listener = self.warning_listener
+        return self._status_counts.counts(revision_id, warning_listener)
     
     @property
     def latest_revision(self):
         return self.storage_history.latest_revision
     
-    def eod_revisions(self, max_revision=None):
-        return self.storage_history.eod_revisions(max_revision)
+    def eod_revisions(self, max_revision=None, since=None):
+        return self.storage_history.eod_revisions(max_revision, since)
@@ -0,0 +1,135 @@
+"""
+A persistent cache of the status counts of historical revisions.
+
+History does not change, so the number of features with each status at a
+commit only needs to be counted once.  The cache maps commit SHA-1s to the
+counts of all the statuses at that commit, so that summarising a revision
+with different buckets, or with different statuses, does not miss the cache.
+
+The cache file starts with a line that identifies its format, followed by a
+line per commit: the commit's SHA-1 and its status counts, encoded as a JSON
+object.  New entries are appended.  When the cache holds more than its
+maximum number of entries, it is rewritten without the entries that have been
+used least recently.  A partly written last line is ignored.
+"""
+
+import os
+import json
+from collections import OrderedDict
+from deft.tracker import FormatVersion
+
+
+SummaryCacheFormatVersion = "deft-cfd-cache/1 tracker-format/" + FormatVersion
+
+DefaultSummaryCacheSize = 100000
+
+
+class SummaryCache(object):
+    def __init__(self, path, max_entries=DefaultSummaryCacheSize):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = None
+        self._is_readable = True
+        self._used = []
+        self._unsaved = []
+
+    def __len__(self):
+        return len(self._load())
+
+    def get(self, commit_sha):
+        """
+        Returns the status counts of a commit, or None if they are not cached
+        """
+        counts = self._load().get(commit_sha)
+        if counts is not None:
+            self._used.append(commit_sha)
+        return counts
+
+    def put(self, commit_sha, counts):
+        self._load()[commit_sha] = counts
+        self._used.append(commit_sha)
+        self._unsaved.append(commit_sha)
+
+    def save(self):
+        entries = self._load()
+        try:
+            if len(entries) > self.max_entries or not self._is_readable:
+                self._rewrite()
+            elif self._unsaved:
+                self._append()
+        except (IOError, OSError):
+            # The cache only saves time, so a read-only repository can do without it
+            pass
+
+        self._used = []
+        self._unsaved = []
+
+    def _append(self):
+        with open(self.path, "a+") as output:
+            output.seek(0, os.SEEK_END)
+            if output.tell() == 0:
+                output.write(SummaryCacheFormatVersion + "\n")
+            else:
+                # Finish off a partly written last line, so that it does not spoil the next entry
+                output.seek(-1, os.SEEK_END)
+                if output.read(1) != "\n":
+                    output.write("\n")
+            for commit_sha in self._unsaved:
+                output.write(encode_entry(commit_sha, self._entries[commit_sha]))
+
+    def _rewrite(self):
+        # Most recently used last, so that the least recently used are evicted first
+        used = set(self._used)
+        ordered = [sha for sha in self._entries if sha not in used] + unique(reversed(self._used))[::-1]
+        kept = ordered[len(ordered)-self.max_entries:]
+        self._entries = OrderedDict((sha, self._entries[sha]) for sha in kept)
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as output:
+            output.write(SummaryCacheFormatVersion + "\n")
+            for commit_sha in kept:
+                output.write(encode_entry(commit_sha, self._entries[commit_sha]))
+        os.rename(temp_path, self.path)
+        self._is_readable = True
+
+    def _load(self):
+        if self._entries is None:
+            self._entries, self._is_readable = read_entries(self.path)
+        return self._entries
+
+
+def encode_entry(commit_sha, counts):
+    return commit_sha + " " + json.dumps(counts, sort_keys=True, separators=(",", ":")) + "\n"
+
+
+def read_entries(path):
+    """
+    Returns the entries of a cache file in the order in which they were
+    written, and whether the file can be read: a missing file can, a file in a
+    different format cannot.
+    """
+    entries = OrderedDict()
+    try:
+        with open(path) as input:
+            if input.readline() != SummaryCacheFormatVersion + "\n":
+                return entries, False
+
+            for line in input:
+                commit_sha, _, encoded_counts = line.partition(" ")
+                if line.endswith("\n") and encoded_counts:
+                    try:
+                        counts = json.loads(encoded_counts)
+                    except ValueError:
+                        continue
+                    entries.pop(commit_sha, None)
+                    entries[commit_sha] = dict((status.encode("utf-8"), count) for (status, count) in counts.items())
+    except IOError:
+        pass
+
+    return entries, True
+
+
+def unique(items):
+    seen = set()
+    return [i for i in items if not (i in seen or seen.add(i))]
+
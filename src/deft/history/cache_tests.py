@@ -0,0 +1,85 @@
+
+import os
+from deft.fileops import *
+from deft.history.cache import SummaryCache, SummaryCacheFormatVersion
+from hamcrest import *
+from nose.plugins.attrib import attr
+
+
+@attr("fileio")
+class SummaryCache_Tests:
+    def setup(self):
+        self.testdir = os.path.join("output", "testing", self.__class__.__name__.lower(), str(id(self)))
+        ensure_empty_dir_exists(self.testdir)
+        self.path = os.path.join(self.testdir, "cache")
+    
+    def test_returns_none_for_commits_not_in_cache(self):
+        assert_that(SummaryCache(self.path).get("a"*40), equal_to(None))
+    
+    def test_saves_counts_for_later_runs(self):
+        cache = SummaryCache(self.path)
+        cache.put("a"*40, {"new": 2, "done": 1})
+        cache.save()
+        
+        cache = SummaryCache(self.path)
+        cache.put("b"*40, {"new": 3})
+        cache.save()
+        
+        reloaded = SummaryCache(self.path)
+        assert_that(reloaded.get("a"*40), equal_to({"new": 2, "done": 1}))
+        assert_that(reloaded.get("b"*40), equal_to({"new": 3}))
+        assert_that(len(reloaded), equal_to(2))
+    
+    def test_evicts_least_recently_used_counts_when_full(self):
+        cache = SummaryCache(self.path, max_entries=2)
+        cache.put("a"*40, {"new": 1})
+        cache.put("b"*40, {"new": 2})
+        cache.save()
+        
+        cache = SummaryCache(self.path, max_entries=2)
+        cache.get("a"*40)
+        cache.put("c"*40, {"new": 3})
+        cache.save()
+        
+        reloaded = SummaryCache(self.path, max_entries=2)
+        assert_that(len(reloaded), equal_to(2))
+        assert_that(reloaded.get("a"*40), equal_to({"new": 1}))
+        assert_that(reloaded.get("b"*40), equal_to(None))
+        assert_that(reloaded.get("c"*40), equal_to({"new": 3}))
+    
+    def test_keeps_no_counts_if_it_can_hold_none(self):
+        cache = SummaryCache(self.path, max_entries=0)
+        cache.put("a"*40, {"new": 1})
+        cache.put("b"*40, {"new": 2})
+        cache.save()
+        
+        assert_that(len(SummaryCache(self.path, max_entries=0)), equal_to(0))
+    
+    def test_replaces_cache_in_a_different_format(self):
+        with open(self.path, "w") as output:
+            output.write("deft-cfd-cache/0\n" + "a"*40 + " {\"new\":1}\n")
+        
+        cache = SummaryCache(self.path)
+        assert_that(cache.get("a"*40), equal_to(None))
+        cache.put("b"*40, {"new": 2})
+        cache.save()
+        
+        with open(self.path) as input:
+            assert_that(input.readline(), equal_to(SummaryCacheFormatVersion + "\n"))
+        assert_that(SummaryCache(self.path).get("b"*40), equal_to({"new": 2}))
+    
+    def test_ignores_partly_written_last_entry(self):
+        cache = SummaryCache(self.path)
+        cache.put("a"*40, {"new": 1})
+        cache.save()
+        with open(self.path, "a") as output:
+            output.write("b"*40 + " {\"ne")
+        
+        cache = SummaryCache(self.path)
+        assert_that(cache.get("b"*40), equal_to(None))
+        cache.put("c"*40, {"new": 3})
+        cache.save()
+        
+        reloaded = SummaryCache(self.path)
+        assert_that(reloaded.get("a"*40), equal_to({"new": 1}))
+        assert_that(reloaded.get("c"*40), equal_to({"new": 3}))
@@ -4,12 +4,16 @@ from operator import add
 from colorsys import hsv_to_rgb
 import datetime
 import os
+import math
+from functools import partial
+from multiprocessing import Pool, cpu_count
 from functional import scanl1
-from argparse import ArgumentParser, Action
+from argparse import ArgumentParser, ArgumentTypeError, Action
 from deft.tracker import UserError
 from deft.storage.git import GitStorageHistory
 from deft.history import HistoricalBackend, History
-from deft.warn import PrintWarnings    
+from deft.history.cache import SummaryCache, DefaultSummaryCacheSize
+from deft.warn import PrintWarnings, IgnoreWarnings, WarningRecorder, portable_warnings, report_warnings
 from deft.formats import write_table_as_text, write_table_as_csv, write_repr
 
 
@@ -94,6 +98,12 @@ class AppendSingletonLists(Action):
     def __call__(self, parser, namespace, values, option_string=None):
         getattr(namespace, self.dest).extend([[v] for v in values])
 
+def parse_date(text):
+    try:
+        return datetime.datetime.strptime(text, "%Y-%m-%d").date()
+    except ValueError:
+        raise ArgumentTypeError("invalid date " + repr(text) + ", should be YYYY-MM-DD")
+
 parser = ArgumentParser(
     prog="deft-cfd",
     description="Deft CFD: visualise tracker history as a cumulative flow diagram")
@@ -114,6 +124,32 @@ parser.add_argument("-d", "--tracker-directory",
                     dest="directory",
                     nargs=1,
                     default=".")
+parser.add_argument("-s", "--since",
+                    help="only analyse history from this date (YYYY-MM-DD) onwards",
+                    dest="since",
+                    metavar="DATE",
+                    type=parse_date,
+                    default=None)
+parser.add_argument("-j", "--jobs",
+                    help="the number of processes that analyse history in parallel (defaults to 1, "
+                         "0 for one per CPU)",
+                    dest="jobs",
+                    metavar="N",
+                    type=int,
+                    default=1)
+parser.add_argument("--no-cache",
+                    help="count the features in every revision, without reading or writing the cache of "
+                         "counts from earlier runs",
+                    dest="no_cache",
+                    action="store_true",
+                    default=False)
+parser.add_argument("--cache-size",
+                    help="the maximum number of revisions whose counts are cached, 0 for no caching (defaults to %d)" % 
+                         DefaultSummaryCacheSize,
+                    dest="cache_size",
+                    metavar="N",
+                    type=int,
+                    default=DefaultSummaryCacheSize)
 parser.add_argument("-f", "--format",
                     help="output format (%s)"%(format_help(),),
                     dest="format",
@@ -121,41 +157,112 @@ parser.add_argument("-f", "--format",
 
 
 
+# The number of chunks of revisions to count per process when running in parallel
+ChunksPerJob = 4
+
+# The file, in the repository's control directory, in which status counts are cached
+SummaryCacheFile = "deft-cfd-cache"
+
+
 def cumulative(counts):
     return list(scanl1(add, counts))
 
 def all_zero(counts):
     return all(count == 0 for count in counts)
 
-def count_features(tracker, bucket):
-    return sum(len(list(tracker.features_with_status(s))) for s in bucket)
-
-def bucket_counts(tracker, buckets):
-    return [count_features(tracker, b) for b in buckets]
-
-def summarise(history, commit_sha, date, buckets, warning_listener):
+def count_statuses(history, commit_sha, date):
+    """
+    Returns the status counts of a revision, or None if it cannot be loaded,
+    and the warnings reported while counting them
+    """
+    warnings = WarningRecorder()
     try:
-        tracker = history[commit_sha]
-        return bucket_counts(tracker, buckets)
+        counts = history.status_counts(commit_sha, warnings)
     except UserError as e:
-        warning_listener.failed_to_load_historical_data(date=date, error=str(e))
+        warnings.failed_to_load_historical_data(date=date, error=str(e))
+        counts = None
+    
+    return counts, list(warnings)
+
+def summarise(status_counts, buckets):
+    if status_counts is None:
         return [0 for b in buckets]
+    else:
+        return [sum(status_counts.get(s, 0) for s in bucket) for bucket in buckets]
 
 def as_headers(buckets):
     return [", ".join(statuses) for statuses in buckets]
 
 
-def cumulative_flow(history, max_revision, buckets, warning_listener):
+def count_all(history, revisions):
+    return [count_statuses(history, commit_sha, date) for (date, commit_sha) in revisions]
+
+def count_in_parallel(history, revisions, jobs):
+    """
+    Counts the statuses of revisions in a pool of processes, each of which
+    opens the repository itself
+    """
+    # Contiguous runs of revisions share most of their files, so each process can reuse what it has read
+    chunk_size = max(1, int(math.ceil(len(revisions) / float(jobs*ChunksPerJob))))
+    chunks = [revisions[i:i+chunk_size] for i in range(0, len(revisions), chunk_size)]
+    
+    pool = Pool(jobs, _start_worker, (history.storage_history,))
+    try:
+        results = pool.map(_count_chunk, chunks, chunksize=1)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    
+    return [result for chunk_results in results for result in chunk_results]
+
+_worker_history = None
+
+def _start_worker(storage_history):
+    global _worker_history
+    _worker_history = History(storage_history, IgnoreWarnings())
+
+def _count_chunk(revisions):
+    return [(counts, portable_warnings(warnings)) 
+            for (counts, warnings) in count_all(_worker_history, revisions)]
+
+
+def cumulative_flow(history, max_revision, buckets, warning_listener, since=None, jobs=1, cache=None):
+    """
+    The warnings reported while counting the statuses of each revision are
+    reported in the order of the revisions, however they were counted.  Status
+    counts are only cached if no warnings were reported, so that the warnings
+    are reported again by later runs.
+    """
     bucket_stack = list(reversed(buckets))
+    revisions = sorted(history.eod_revisions(max_revision, since).iteritems())
+    
+    status_counts = {}
+    if cache is not None:
+        for date, commit_sha in revisions:
+            counts = cache.get(commit_sha)
+            if counts is not None:
+                status_counts[commit_sha] = counts
+    
+    uncounted = [(date, commit_sha) for (date, commit_sha) in revisions if commit_sha not in status_counts]
+    if jobs > 1 and len(uncounted) > 1:
+        results = count_in_parallel(history, uncounted, jobs)
+    else:
+        results = count_all(history, uncounted)
     
-    summaries = [(date, summarise(history, commit_sha, date, bucket_stack, warning_listener))
-                 for (date, commit_sha)
-                 in sorted(history.eod_revisions(max_revision).iteritems())]
+    for (date, commit_sha), (counts, warnings) in zip(uncounted, results):
+        report_warnings(warnings, warning_listener)
+        status_counts[commit_sha] = counts
+        if cache is not None and counts is not None and not warnings:
+            cache.put(commit_sha, counts)
+    
+    if cache is not None:
+        cache.save()
     
     header_row = [["date"] + as_headers(bucket_stack)]
     data_rows = [[date] + cumulative(summary)
                  for (date, summary)
-                 in summaries
+                 in ((date, summarise(status_counts[commit_sha], bucket_stack)) for (date, commit_sha) in revisions)
                  if not all_zero(summary)]
         
     return header_row + data_rows
@@ -174,8 +281,20 @@ def main():
                     format=args.format,
                     known_formats=format_help()))
         
-        history = History(GitStorageHistory(args.directory), warning_listener)
-        table = cumulative_flow(history, history.latest_revision, args.buckets, warning_listener)
+        if args.jobs < 0:
+            raise UserError("the number of jobs cannot be negative")
+        
+        if args.cache_size < 0:
+            raise UserError("the cache size cannot be negative")
+        
+        storage_history = GitStorageHistory(args.directory)
+        history = History(storage_history, warning_listener)
+        if args.no_cache or args.cache_size == 0:
+            cache = None
+        else:
+            cache = SummaryCache(storage_history.control_path(SummaryCacheFile), args.cache_size)
+        table = cumulative_flow(history, history.latest_revision, args.buckets, warning_listener, args.since,
+                                jobs=args.jobs or cpu_count(), cache=cache)
         Formats[args.format](table, args, sys.stdout)
         
     except UserError as e:
@@ -1,11 +1,14 @@
 
+import os
 from StringIO import StringIO
 from datetime import date
 from argparse import Namespace
 from deft.history.cfd import write_table_as_chart, cumulative_flow
 from deft.storage.git import GitStorageHistory
 from deft.history import History
-from deft.warn import IgnoreWarnings
+from deft.history.cache import SummaryCache
+from deft.history.replay_tests import TrackerHistoryFixture
+from deft.warn import IgnoreWarnings, WarningRecorder
 from hamcrest import *
 from nose.plugins.attrib import attr
 
@@ -30,6 +33,86 @@ def test_can_analyse_history_as_cumulative_flow():
              [date(2011,6,6),0,3,3,3,13],
              [date(2011,6,7),0,3,3,3,14]]))
 
+
+@attr("fileio")
+class CumulativeFlowInParallel_Tests(TrackerHistoryFixture):
+    def test_gives_same_results_and_warnings_in_same_order_as_serial_analysis(self):
+        # A snapshot without a tracker, which cannot be loaded
+        self.commit()
+        
+        self.given_history()
+        
+        # A snapshot with an unindexed feature, which is reported when loaded
+        with open(os.path.join(self.workdir, ".deft", "data", "features", "e.description"), "w") as output:
+            output.write("not indexed")
+        self.commit()
+        
+        buckets = [["new"], ["started", "lost+found"]]
+        
+        serial_warnings = WarningRecorder()
+        serial_history = History(GitStorageHistory(self.repodir), serial_warnings)
+        serial_flow = cumulative_flow(serial_history, self.commits[-1], buckets, serial_warnings)
+        
+        parallel_warnings = WarningRecorder()
+        parallel_history = History(GitStorageHistory(self.repodir), parallel_warnings)
+        parallel_flow = cumulative_flow(parallel_history, self.commits[-1], buckets, parallel_warnings, jobs=3)
+        
+        assert_that(parallel_flow, equal_to(serial_flow))
+        assert_that([name for (name, args) in serial_warnings], 
+                    equal_to(["failed_to_load_historical_data", "unindexed_feature"]))
+        assert_that(list(parallel_warnings), equal_to(list(serial_warnings)))
+    
+
+class CountingHistory(History):
+    def __init__(self, *args):
+        super(CountingHistory, self).__init__(*args)
+        self.counted = []
+    
+    def status_counts(self, revision_id, warning_listener=None):
+        self.counted.append(revision_id)
+        return super(CountingHistory, self).status_counts(revision_id, warning_listener)
+
+
+@attr("fileio")
+class CumulativeFlowCache_Tests(TrackerHistoryFixture):
+    def setup(self):
+        super(CumulativeFlowCache_Tests, self).setup()
+        self.cache_path = os.path.join(self.repodir, ".git", "deft-cfd-cache")
+    
+    def cumulative_flow(self, buckets, warning_listener=IgnoreWarnings()):
+        history = CountingHistory(GitStorageHistory(self.repodir), warning_listener)
+        flow = cumulative_flow(history, self.commits[-1], buckets, warning_listener, 
+                               cache=SummaryCache(self.cache_path))
+        return flow, history.counted
+    
+    def test_only_counts_statuses_of_commits_not_counted_by_earlier_runs(self):
+        self.given_history()
+        
+        first_flow, first_counted = self.cumulative_flow([["new"], ["started"]])
+        
+        self.change_tracker(lambda tracker: tracker.create(name="e", status="new", description="e description"))
+        
+        second_flow, second_counted = self.cumulative_flow([["new", "started"]])
+        
+        assert_that(first_counted, equal_to(self.commits[:-1]))
+        assert_that(second_counted, equal_to(self.commits[-1:]))
+        uncached_history = History(GitStorageHistory(self.repodir), IgnoreWarnings())
+        assert_that(second_flow, equal_to(cumulative_flow(uncached_history, self.commits[-1], [["new", "started"]],
+                                                          IgnoreWarnings())))
+    
+    def test_reports_warnings_of_revisions_on_every_run(self):
+        self.commit()
+        self.given_history()
+        
+        for run in range(2):
+            warnings = WarningRecorder()
+            flow, counted = self.cumulative_flow([["new"]], warnings)
+            
+            assert_that([name for (name, args) in warnings], equal_to(["failed_to_load_historical_data"]))
+            assert_that(counted, has_item(self.commits[0]))
+        
+        assert_that(counted, equal_to(self.commits[:1]))
+    
     
 def test_can_write_as_graphical_chart():
     table = [['date', 'released', 'implemented', 'in-progress, blocked', 'new'], 
@@ -0,0 +1,227 @@
+"""
+Counting the features with each status in historical snapshots of a tracker.
+
+Loading a whole tracker for every snapshot of a long history is slow, and
+mostly repeats work: from one day to the next only a few status indices
+change.  StatusCounts identifies the files and directories of a snapshot by
+the IDs of their Git objects, and remembers the counts of each pair of status
+and features directories that it has seen.  When it meets a new pair, it reads
+only the status indices whose objects it has not seen before, and updates what
+it knows of the previous snapshot it counted by the differences between that
+snapshot's status indices and features and those of the new one.  Reading a
+changed status index and listing a changed features directory still take time
+in proportion to their size, but the counts and the checks for snapshots that
+a tracker would repair are updated feature by feature only for the features
+that were added, removed or changed status.
+
+The counts are those that a tracker loaded from the snapshot would report.
+A snapshot that is not in the current format, or that a tracker would have to
+repair when loading it, is loaded as a whole tracker instead, so that it is
+upgraded, repaired and reports warnings just as before.
+"""
+
+import os
+from deft.tracker import (FormatVersion, ConfigFile, StatusIndexSuffix, DescriptionSuffix, PropertiesSuffix,
+                          rootname)
+from deft.formats import YamlFormat
+from deft.indexing import priority_index
+from deft.journal import JournalSuffix, replay
+
+
+class StatusCounts(object):
+    def __init__(self, history):
+        self.history = history
+        self._configs = {}
+        self._feature_names = {}
+        self._statuses = {}
+        self._counts = {}
+        self._indexed = IndexedFeatures()
+
+    def __getitem__(self, revision_id):
+        return self.counts(revision_id, self.history.warning_listener)
+
+    def counts(self, revision_id, warning_listener):
+        """
+        Returns a dict that maps the statuses of the tracker at a revision to the
+        number of features with that status
+        """
+        counts = self._replayed_counts(self.history.storage_history[revision_id])
+        if counts is None:
+            tracker = self.history.load(revision_id, warning_listener)
+            counts = dict((s, tracker.count_features_with_status(s)) for s in tracker.statuses(include_empty=True))
+
+        return counts
+
+    def _replayed_counts(self, storage):
+        """
+        Returns the status counts of a snapshot, or None if they can only be
+        found by loading a tracker from the snapshot
+        """
+        if not hasattr(storage, "object_id"):
+            return None
+
+        config = self._config(storage)
+        if config is None or config.get("format") != FormatVersion:
+            return None
+
+        status_dir = os.path.join(config["datadir"], "status")
+        features_dir = os.path.join(config["datadir"], "features")
+
+        key = (storage.object_id(status_dir), storage.object_id(features_dir))
+        if key not in self._counts:
+            self._counts[key] = self._count(storage, status_dir, features_dir)
+
+        return self._counts[key]
+
+    def _config(self, storage):
+        config_id = storage.object_id(ConfigFile)
+        if config_id is None:
+            return None
+
+        if config_id not in self._configs:
+            with storage.open(ConfigFile) as input:
+                self._configs[config_id] = YamlFormat.load(input)
+
+        return self._configs[config_id]
+
+    def _count(self, storage, status_dir, features_dir):
+        described_features, existing_features = self._features(storage, features_dir)
+
+        status_files = [os.path.basename(f) for f in storage.list(os.path.join(status_dir, "*"))]
+        statuses = set(rootname(f, StatusIndexSuffix) for f in status_files if f.endswith(StatusIndexSuffix))
+        statuses.update(rootname(f, JournalSuffix) for f in status_files if f.endswith(JournalSuffix))
+
+        self._indexed.change_features(described_features, existing_features)
+        self._indexed.change_statuses(dict((status, self._status(storage, os.path.join(status_dir, status)))
+                                           for status in statuses))
+
+        return self._indexed.counts()
+
+    def _features(self, storage, features_dir):
+        features_id = storage.object_id(features_dir)
+        if features_id not in self._feature_names:
+            feature_files = [os.path.basename(f) for f in storage.list(os.path.join(features_dir, "*"))]
+            described = frozenset(rootname(f, DescriptionSuffix) for f in feature_files if f.endswith(DescriptionSuffix))
+            existing = described.union(rootname(f, PropertiesSuffix) for f in feature_files if f.endswith(PropertiesSuffix))
+            self._feature_names[features_id] = (described, existing)
+
+        return self._feature_names[features_id]
+
+    def _status(self, storage, status_path):
+        """
+        Returns the IndexedStatus of the features with a status
+        """
+        index_path = status_path + StatusIndexSuffix
+        journal_path = status_path + JournalSuffix
+        key = (storage.object_id(index_path), storage.object_id(journal_path))
+
+        if key not in self._statuses:
+            if storage.exists(index_path):
+                with storage.open(index_path) as input:
+                    names = input.read().splitlines()
+            else:
+                names = []
+
+            if storage.exists(journal_path):
+                index = priority_index(names)
+                with storage.open(journal_path) as input:
+                    length, failures = replay(index, input.read())
+                names = None if failures else list(index)
+
+            self._statuses[key] = IndexedStatus(names)
+
+        return self._statuses[key]
+
+
+class IndexedStatus(object):
+    """
+    The names of the features in a status index, after replaying its journal
+    """
+
+    def __init__(self, names):
+        self.names = frozenset(names or [])
+        self.count = len(names or [])
+        # The tracker repairs a journal that cannot be replayed cleanly and removes duplicate entries from an index
+        self.is_clean = names is not None and self.count == len(self.names)
+
+
+class IndexedFeatures(object):
+    """
+    Tracks how many status indices each feature is in, and which features the
+    tracker would repair, as the snapshot being counted changes from one to
+    another
+    """
+
+    def __init__(self):
+        self.statuses = {}
+        self.described = frozenset()
+        self.existing = frozenset()
+        # The number of status indices that each indexed feature is in
+        self.index_counts = {}
+        # The features that the tracker would repair
+        self.duplicated = set()
+        self.unknown = set()
+        self.unindexed = set()
+
+    def change_features(self, described, existing):
+        if existing is not self.existing:
+            for name in self.existing - existing:
+                if name in self.index_counts:
+                    self.unknown.add(name)
+            self.unknown.difference_update(existing - self.existing)
+            self.existing = existing
+
+        if described is not self.described:
+            self.unindexed.difference_update(self.described - described)
+            for name in described - self.described:
+                if name not in self.index_counts:
+                    self.unindexed.add(name)
+            self.described = described
+
+    def change_statuses(self, statuses):
+        for status in set(self.statuses) | set(statuses):
+            old = self.statuses.get(status)
+            new = statuses.get(status)
+            if new is old:
+                continue
+
+            old_names = old.names if old is not None else frozenset()
+            new_names = new.names if new is not None else frozenset()
+            for name in old_names - new_names:
+                self._unindexed(name)
+            for name in new_names - old_names:
+                self._indexed(name)
+
+        self.statuses = statuses
+
+    def counts(self):
+        """
+        Returns the number of features with each status, or None if the tracker
+        would have to repair the snapshot
+        """
+        if self.duplicated or self.unknown or self.unindexed or \
+                not all(status.is_clean for status in self.statuses.itervalues()):
+            return None
+
+        return dict((name, status.count) for (name, status) in self.statuses.items())
+
+    def _indexed(self, name):
+        count = self.index_counts.get(name, 0) + 1
+        self.index_counts[name] = count
+        if count == 1:
+            if name not in self.existing:
+                self.unknown.add(name)
+            self.unindexed.discard(name)
+        elif count == 2:
+            self.duplicated.add(name)
+
+    def _unindexed(self, name):
+        count = self.index_counts.pop(name) - 1
+        if count == 0:
+            self.unknown.discard(name)
+            if name in self.described:
+                self.unindexed.add(name)
+        else:
+            self.index_counts[name] = count
+            if count == 1:
+                self.duplicated.discard(name)
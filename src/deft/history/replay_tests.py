@@ -0,0 +1,156 @@
+
+import os
+from dulwich.repo import Repo
+from deft.fileops import *
+from deft.history import History
+from deft.history.replay import IndexedFeatures, IndexedStatus
+from deft.storage.filesystem import FileStorage
+from deft.storage.git import GitStorageHistory
+from deft.storage.git_tests import commit_files
+from deft.tracker import init_with_storage, load_with_storage
+from deft.warn import IgnoreWarnings, WarningRecorder
+from hamcrest import *
+from nose.plugins.attrib import attr
+
+
+Day = 24*3600
+
+
+def files_in(dirpath):
+    files = {}
+    for parent, subdirs, names in os.walk(dirpath):
+        for name in names:
+            path = os.path.join(parent, name)
+            relpath = os.path.relpath(path, dirpath)
+            if not relpath.startswith(os.path.join(".deft", "cache")):
+                with open(path) as input:
+                    files[relpath.replace(os.sep, "/")] = input.read()
+    return files
+
+def nonzero(counts):
+    return dict((status, count) for (status, count) in counts.items() if count != 0)
+
+
+class TrackerHistoryFixture(object):
+    """
+    Builds the history of a tracker in a Git repository, a commit a day
+    """
+    
+    def setup(self):
+        testdir = os.path.join("output", "testing", self.__class__.__name__.lower(), str(id(self)))
+        self.workdir = os.path.join(testdir, "work")
+        self.repodir = os.path.join(testdir, "repo")
+        ensure_empty_dir_exists(self.workdir)
+        ensure_empty_dir_exists(self.repodir)
+        self.repo = Repo.init(self.repodir)
+        self.commits = []
+        self.commit_time = 1300000000
+    
+    def change_tracker(self, change):
+        tracker = load_with_storage(FileStorage(self.workdir), IgnoreWarnings())
+        change(tracker)
+        tracker.save()
+        self.commit()
+    
+    def commit(self):
+        parents = self.commits[-1:]
+        self.commits.append(commit_files(self.repo, files_in(self.workdir), parents, self.commit_time))
+        self.commit_time += Day
+    
+    def given_history(self):
+        init_with_storage(FileStorage(self.workdir), IgnoreWarnings(), {})
+        
+        def create_features(tracker):
+            for name in ["a", "b", "c"]:
+                tracker.create(name=name, status="new", description=name + " description")
+        self.change_tracker(create_features)
+        
+        def start_a_and_create_d(tracker):
+            tracker.feature_named("a").status = "started"
+            tracker.create(name="d", status="new", description="d description")
+        self.change_tracker(start_a_and_create_d)
+        
+        def edit_description_of_b(tracker):
+            tracker.feature_named("b").description = "changed description"
+        self.change_tracker(edit_description_of_b)
+        
+        def journal_and_reprioritise(tracker):
+            tracker.configure(journal_status_indices=True)
+            tracker.feature_named("d").priority = 1
+            tracker.feature_named("b").status = "started"
+        self.change_tracker(journal_and_reprioritise)
+        
+        def purge_c(tracker):
+            tracker.purge("c")
+        self.change_tracker(purge_c)
+    
+
+
+@attr("fileio")
+class StatusCounts_Tests(TrackerHistoryFixture):
+    def loaded_counts(self, revision_id):
+        tracker = History(GitStorageHistory(self.repodir), IgnoreWarnings())[revision_id]
+        return nonzero(dict((s, tracker.count_features_with_status(s)) for s in tracker.statuses()))
+    
+    def test_counts_features_with_each_status_as_loaded_tracker_would(self):
+        self.given_history()
+        history = History(GitStorageHistory(self.repodir), IgnoreWarnings())
+        
+        for revision_id in self.commits:
+            assert_that(nonzero(history.status_counts(revision_id)), equal_to(self.loaded_counts(revision_id)))
+        
+        assert_that(nonzero(history.status_counts(self.commits[-1])), equal_to({"new": 1, "started": 2}))
+    
+    def test_loads_snapshots_that_tracker_would_repair_and_reports_warnings(self):
+        self.given_history()
+        with open(os.path.join(self.workdir, ".deft", "data", "features", "e.description"), "w") as output:
+            output.write("not indexed")
+        self.commit()
+        
+        warnings = WarningRecorder()
+        history = History(GitStorageHistory(self.repodir), warnings)
+        
+        assert_that(nonzero(history.status_counts(self.commits[-2])), equal_to({"new": 1, "started": 2}))
+        assert_that(len(warnings), equal_to(0))
+        
+        assert_that(nonzero(history.status_counts(self.commits[-1])), 
+                    equal_to({"new": 1, "started": 2, "lost+found": 1}))
+        assert_that(len(warnings), equal_to(1))
+
+
+class IndexedFeatures_Tests:
+    def setup(self):
+        self.indexed = IndexedFeatures()
+    
+    def given_snapshot(self, described, statuses, existing=()):
+        described = frozenset(described)
+        self.indexed.change_features(described, described.union(existing))
+        self.indexed.change_statuses(dict((status, IndexedStatus(names)) for (status, names) in statuses.items()))
+        return self.indexed.counts()
+    
+    def test_counts_features_with_each_status(self):
+        assert_that(self.given_snapshot("abc", {"new": ["a", "b"], "done": ["c"], "empty": []}),
+                    equal_to({"new": 2, "done": 1, "empty": 0}))
+    
+    def test_follows_features_from_one_snapshot_to_the_next(self):
+        self.given_snapshot("abc", {"new": ["a", "b"], "done": ["c"]})
+        
+        assert_that(self.given_snapshot("abcd", {"new": ["b", "d"], "done": ["c", "a"]}),
+                    equal_to({"new": 2, "done": 2}))
+        assert_that(self.given_snapshot("bd", {"new": ["b", "d"], "done": []}),
+                    equal_to({"new": 2, "done": 0}))
+    
+    def test_cannot_count_snapshots_that_the_tracker_would_repair(self):
+        self.given_snapshot("abc", {"new": ["a", "b"], "done": ["c"]})
+        
+        assert_that(self.given_snapshot("abc", {"new": ["a", "b"], "done": ["c", "a"]}), none())
+        assert_that(self.given_snapshot("abc", {"new": ["a", "b", "b"], "done": ["c"]}), none())
+        assert_that(self.given_snapshot("abc", {"new": ["a", "b"], "done": []}), none())
+        assert_that(self.given_snapshot("ab", {"new": ["a", "b"], "done": ["c"]}), none())
+        assert_that(self.given_snapshot("abc", {"new": ["a", "b"], "done": None}), none())
+        
+        assert_that(self.given_snapshot("abc", {"new": ["a", "b"], "done": ["c"]}), equal_to({"new": 2, "done": 1}))
+    
+    def test_features_with_only_properties_may_be_indexed(self):
+        assert_that(self.given_snapshot("ab", {"new": ["a", "b", "c"]}, existing="c"), equal_to({"new": 3}))
+        assert_that(self.given_snapshot("ab", {"new": ["a", "b", "c"]}), none())
@@ -1,7 +1,6 @@
 
-import os
-import mmap
 from itertools import count
+from random import random
 
 
 class PriorityIndex:
@@ -9,6 +8,13 @@ class PriorityIndex:
         self._features_by_priority = list(feature_names_in_priority_order)
         self._priorities_by_feature = None
     
+    @classmethod
+    def _adopting(cls, names):
+        # Takes ownership of a list that no one else refers to, rather than copying it
+        index = cls([])
+        index._features_by_priority = names
+        return index
+    
     @property
     def is_empty(self):
         return len(self) == 0
@@ -37,10 +43,25 @@ class PriorityIndex:
         self._features_by_priority.insert(max(0, priority-1), new_feature_name)
         self._priorities_changed()
     
+    def insert_all(self, new_feature_names, priority=None):
+        if priority is None:
+            for name in new_feature_names:
+                self.append(name)
+        else:
+            i = max(0, priority-1)
+            self._features_by_priority[i:i] = new_feature_names
+            self._priorities_changed()
+    
     def remove(self, feature_name):
         del self._features_by_priority[self._index_of(feature_name)]
         self._priorities_changed()
     
+    def remove_all(self):
+        removed = self._features_by_priority
+        self._features_by_priority = []
+        self._priorities_changed()
+        return removed
+    
     def rename(self, old_name, new_name):
         self._features_by_priority[self._index_of(old_name)] = new_name
         if self._priorities_by_feature is not None:
@@ -67,3 +88,266 @@ class PriorityIndex:
         return self.__class__.__name__ + "([" + ", ".join(map(repr, self._features_by_priority)) + "])"
 
 
+
+
+class _Node(object):
+    __slots__ = ("name", "weight", "left", "right", "parent", "size")
+    
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        self.left = None
+        self.right = None
+        self.parent = None
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    if node.left is not None:
+        node.left.parent = node
+    if node.right is not None:
+        node.right.parent = node
+
+def _split(node, n):
+    """Splits a tree into the first n nodes and the rest"""
+    if node is None:
+        return None, None
+    elif _size(node.left) >= n:
+        left, node.left = _split(node.left, n)
+        _update(node)
+        return left, node
+    else:
+        node.right, right = _split(node.right, n - _size(node.left) - 1)
+        _update(node)
+        return node, right
+
+def _merge(left, right):
+    if left is None:
+        return right
+    elif right is None:
+        return left
+    elif left.weight > right.weight:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    else:
+        right.left = _merge(left, right.left)
+        _update(right)
+        return right
+
+def _rank(node):
+    rank = _size(node.left)
+    while node.parent is not None:
+        if node is node.parent.right:
+            rank += _size(node.parent.left) + 1
+        node = node.parent
+    return rank
+
+def _select(node, i):
+    while node is not None:
+        left_size = _size(node.left)
+        if i < left_size:
+            node = node.left
+        elif i == left_size:
+            return node
+        else:
+            i -= left_size + 1
+            node = node.right
+    raise IndexError("priority out of range")
+
+def _in_order(node):
+    stack = []
+    while stack or node is not None:
+        if node is not None:
+            stack.append(node)
+            node = node.left
+        else:
+            node = stack.pop()
+            yield node
+            node = node.right
+
+def _build(nodes):
+    """
+    Builds a treap from nodes in priority order in linear time, by constructing
+    the Cartesian tree of their random weights
+    """
+    spine = []
+    for node in nodes:
+        last_popped = None
+        while spine and spine[-1].weight < node.weight:
+            last_popped = spine.pop()
+        node.left = last_popped
+        if spine:
+            spine[-1].right = node
+        spine.append(node)
+    
+    if not spine:
+        return None
+    
+    root = spine[0]
+    root.parent = None
+    
+    # Sizes must be calculated bottom-up, so visit the nodes in reverse pre-order
+    preorder = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        preorder.append(node)
+        stack.extend(child for child in (node.left, node.right) if child is not None)
+    for node in reversed(preorder):
+        _update(node)
+    
+    return root
+
+
+class TreePriorityIndex:
+    """
+    A PriorityIndex held in an implicit treap: a randomly balanced binary tree
+    ordered by priority in which each node records the size of its subtree.
+    Inserting, removing, and looking up features by priority or priorities by
+    feature take O(log n) time, rather than the O(n) of PriorityIndex.
+    """
+    
+    def __init__(self, feature_names_in_priority_order):
+        self._nodes = {}
+        self._root = _build(self._new_nodes(feature_names_in_priority_order))
+    
+    @property
+    def is_empty(self):
+        return len(self) == 0
+    
+    def __len__(self):
+        return _size(self._root)
+    
+    def __iter__(self):
+        return (node.name for node in _in_order(self._root))
+    
+    def feature_with_priority(self, n):
+        if n < 1:
+            raise IndexError("priority out of range")
+        return _select(self._root, n-1).name
+    
+    def priority_of_feature(self, feature_name):
+        return _rank(self._nodes[feature_name]) + 1
+    
+    def append(self, new_feature_name):
+        self.insert(new_feature_name, len(self) + 1)
+    
+    def insert(self, new_feature_name, priority):
+        self.insert_all([new_feature_name], priority)
+    
+    def insert_all(self, new_feature_names, priority=None):
+        i = len(self) if priority is None else max(0, priority-1)
+        block = _build(self._new_nodes(new_feature_names))
+        left, right = _split(self._root, i)
+        self._set_root(_merge(_merge(left, block), right))
+    
+    def remove(self, feature_name):
+        node = self._nodes.pop(feature_name)
+        left, rest = _split(self._root, _rank(node))
+        removed, right = _split(rest, 1)
+        self._set_root(_merge(left, right))
+    
+    def remove_all(self):
+        removed = list(self)
+        self._nodes = {}
+        self._root = None
+        return removed
+    
+    def rename(self, old_name, new_name):
+        node = self._nodes.pop(old_name)
+        node.name = new_name
+        self._nodes[new_name] = node
+    
+    def change_priority(self, feature_name, new_priority):
+        self.remove(feature_name)
+        self.insert(feature_name, new_priority)
+    
+    def _new_nodes(self, names):
+        nodes = [_Node(name, random()) for name in names]
+        self._nodes.update((node.name, node) for node in nodes)
+        return nodes
+    
+    def _set_root(self, root):
+        self._root = root
+        if root is not None:
+            root.parent = None
+    
+    def __str__(self):
+        return repr(self)
+    
+    def __repr__(self):
+        return self.__class__.__name__ + "([" + ", ".join(map(repr, self)) + "])"
+
+
+# Below this size the list-based PriorityIndex is faster to build and to change,
+# as measured by deft.benchmarks.priority_index
+LargeIndexThreshold = 20000
+
+def priority_index(feature_names_in_priority_order):
+    """
+    Creates the implementation of PriorityIndex best suited to the number of features
+    """
+    names = list(feature_names_in_priority_order)
+    if len(names) >= LargeIndexThreshold:
+        return TreePriorityIndex(names)
+    else:
+        return PriorityIndex._adopting(names)
+
+
+def index_keys(value):
+    if value is None or isinstance(value, dict):
+        return []
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return [k for v in value for k in index_keys(v)]
+    elif isinstance(value, bool):
+        return ["true" if value else "false"]
+    elif isinstance(value, basestring):
+        return [value]
+    else:
+        return [str(value)]
+
+
+class PropertyIndex:
+    def __init__(self):
+        self._features_by_value = {}
+        self._values_by_feature = {}
+    
+    def __len__(self):
+        return len(self._values_by_feature)
+    
+    def values(self):
+        return self._features_by_value.keys()
+    
+    def features_with_value(self, value):
+        return self._features_by_value.get(value, frozenset())
+    
+    def values_of_feature(self, feature_name):
+        return self._values_by_feature.get(feature_name, [])
+    
+    def update(self, feature_name, values):
+        self.remove(feature_name)
+        
+        values = list(values)
+        if values:
+            self._values_by_feature[feature_name] = values
+            for value in values:
+                self._features_by_value.setdefault(value, set()).add(feature_name)
+    
+    def remove(self, feature_name):
+        for value in self._values_by_feature.pop(feature_name, []):
+            features = self._features_by_value[value]
+            features.discard(feature_name)
+            if not features:
+                del self._features_by_value[value]
+    
+    def rename(self, old_name, new_name):
+        self.update(new_name, self.values_of_feature(old_name))
+        self.remove(old_name)
+    
+    def __repr__(self):
+        return self.__class__.__name__ + "(" + repr(self._values_by_feature) + ")"
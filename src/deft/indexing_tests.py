@@ -3,7 +3,8 @@ from itertools import count
 import inspect
 import os
 import shutil
-from deft.indexing import PriorityIndex
+from random import Random
+from deft.indexing import PriorityIndex, TreePriorityIndex, priority_index, LargeIndexThreshold
 from deft.tracker import Feature
 from deft.fake_tracker import make_features, fake_feature
 from hamcrest import *
@@ -21,9 +22,9 @@ def assert_feature_priorities(index, *feature_names):
     assert_that(list(index), equal_to(list(feature_names)))
 
 
-class PriorityIndex_Test:
+class PriorityIndexContract:
     def test_indexes_features_by_priority(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave", "eve"])
+        index = self.new_index(["alice", "bob", "carol", "dave", "eve"])
         
         assert_that(index.feature_with_priority(1), equal_to("alice"))
         assert_that(index.feature_with_priority(2), equal_to("bob"))
@@ -32,7 +33,7 @@ class PriorityIndex_Test:
         assert_that(index.feature_with_priority(5), equal_to("eve"))
     
     def test_indexes_priorities_by_feature(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave", "eve"])
+        index = self.new_index(["alice", "bob", "carol", "dave", "eve"])
         
         assert_that(index.priority_of_feature("alice"), equal_to(1))
         assert_that(index.priority_of_feature("bob"), equal_to(2))
@@ -41,12 +42,12 @@ class PriorityIndex_Test:
         assert_that(index.priority_of_feature("eve"), equal_to(5))
     
     def test_can_iterate_over_feature_names_in_priority_order(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave", "eve"])
+        index = self.new_index(["alice", "bob", "carol", "dave", "eve"])
 
         assert_that(list(index), equal_to(["alice", "bob", "carol", "dave", "eve"]))
     
     def test_can_append_features(self):
-        index = PriorityIndex(["alice", "bob"])
+        index = self.new_index(["alice", "bob"])
         
         index.append("carol")
         assert_feature_priorities(index, "alice", "bob", "carol")
@@ -55,25 +56,25 @@ class PriorityIndex_Test:
         assert_feature_priorities(index, "alice", "bob", "carol", "dave")
         
     def test_can_remove_first_feature(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         index.remove("alice")
         
         assert_feature_priorities(index, "bob", "carol", "dave")
         
     def test_can_remove_middle_feature(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         index.remove("bob")
         
         assert_feature_priorities(index, "alice", "carol", "dave")
         
     def test_can_remove_last_feature(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         index.remove("dave")
         
         assert_feature_priorities(index, "alice", "bob", "carol")
 
     def test_can_append_after_removing(self):
-        index = PriorityIndex(["alice", "bob", "carol"])
+        index = self.new_index(["alice", "bob", "carol"])
         
         index.remove("bob")
         index.append("dave")
@@ -81,100 +82,174 @@ class PriorityIndex_Test:
         assert_feature_priorities(index, "alice", "carol", "dave")
         
     def test_can_insert_features_at_front(self):
-        index = PriorityIndex(["alice", "bob", "carol"])
+        index = self.new_index(["alice", "bob", "carol"])
         
         index.insert("eve", 1)
         
         assert_feature_priorities(index, "eve", "alice", "bob", "carol")
         
     def test_can_insert_features_in_middle(self):
-        index = PriorityIndex(["alice", "bob", "carol"])
+        index = self.new_index(["alice", "bob", "carol"])
         
         index.insert("eve", 3)
         
         assert_feature_priorities(index, "alice", "bob", "eve", "carol")
         
     def test_can_insert_features_in_middle(self):
-        index = PriorityIndex(["alice", "bob", "carol"])
+        index = self.new_index(["alice", "bob", "carol"])
         
         index.insert("eve", 4)
         
         assert_feature_priorities(index, "alice", "bob", "carol", "eve")
         
     def test_limits_priorities_to_priority_one_on_insert(self):
-        index = PriorityIndex(["alice", "bob", "carol"])
+        index = self.new_index(["alice", "bob", "carol"])
         
         index.insert("eve", 0)
         
         assert_feature_priorities(index, "eve", "alice", "bob", "carol")
 
     def test_limits_priorities_to_lowest_priority_on_insert(self):
-        index = PriorityIndex(["alice", "bob", "carol"])
+        index = self.new_index(["alice", "bob", "carol"])
         
         index.insert("eve", 5)
         
         assert_feature_priorities(index, "alice", "bob", "carol", "eve")
     
     def test_can_move_feature_from_bottom_to_top(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         
         index.change_priority("dave", 1)
         
         assert_feature_priorities(index, "dave", "alice", "bob", "carol")
 
     def test_can_move_feature_from_top_to_bottom(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         
         index.change_priority("alice", 4)
         
         assert_feature_priorities(index, "bob", "carol", "dave", "alice")
     
     def test_can_move_feature_from_middle_to_top(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         
         index.change_priority("bob", 1)
         
         assert_feature_priorities(index, "bob", "alice", "carol", "dave")
     
     def test_can_move_feature_from_middle_to_bottom(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         
         index.change_priority("bob", 4)
         
         assert_feature_priorities(index, "alice", "carol", "dave", "bob")
         
     def test_can_move_feature_up_in_the_middle(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         
         index.change_priority("carol", 2)
         
         assert_feature_priorities(index, "alice", "carol", "bob", "dave")
         
     def test_can_move_feature_down_in_the_middle(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         
         index.change_priority("bob", 3)
         
         assert_feature_priorities(index, "alice", "carol", "bob", "dave")
         
     def test_moving_feature_to_same_priority_has_no_effect(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         
         index.change_priority("bob", 2)
         
         assert_feature_priorities(index, "alice", "bob", "carol", "dave")
     
+    def test_can_insert_many_features_at_once(self):
+        index = self.new_index(["alice", "bob", "carol"])
+        
+        index.insert_all(["dave", "eve"], 2)
+        
+        assert_feature_priorities(index, "alice", "dave", "eve", "bob", "carol")
+    
+    def test_appends_many_features_if_priority_not_specified(self):
+        index = self.new_index(["alice", "bob"])
+        index.priority_of_feature("alice")
+        
+        index.insert_all(["carol", "dave"])
+        
+        assert_feature_priorities(index, "alice", "bob", "carol", "dave")
+    
+    def test_limits_priorities_when_inserting_many_features(self):
+        index = self.new_index(["alice", "bob"])
+        
+        index.insert_all(["carol", "dave"], 10)
+        index.insert_all(["eve"], 0)
+        
+        assert_feature_priorities(index, "eve", "alice", "bob", "carol", "dave")
+    
+    def test_can_remove_all_features(self):
+        index = self.new_index(["alice", "bob", "carol"])
+        
+        assert_that(index.remove_all(), equal_to(["alice", "bob", "carol"]))
+        assert_that(index.is_empty)
+    
     def test_can_rename_feature(self):
-        index = PriorityIndex(["alice", "bob", "carol", "dave"])
+        index = self.new_index(["alice", "bob", "carol", "dave"])
         
         index.rename("bob", "robert")
         
         assert_feature_priorities(index, "alice", "robert", "carol", "dave")
 
     def test_has_useful_repr(self):
-        assert_that(repr(PriorityIndex(['alice', 'bob', 'carol'])), 
-                    equal_to("PriorityIndex(['alice', 'bob', 'carol'])"))
+        assert_that(repr(self.new_index(['alice', 'bob', 'carol'])), 
+                    equal_to(self.new_index.__name__ + "(['alice', 'bob', 'carol'])"))
 
     def test_reports_if_empty(self):
-        assert_that(not PriorityIndex(['alice', 'bob', 'carol']).is_empty)
-        assert_that(PriorityIndex([]).is_empty)
+        assert_that(not self.new_index(['alice', 'bob', 'carol']).is_empty)
+        assert_that(self.new_index([]).is_empty)
+    
+    def test_gives_same_results_as_a_list_for_random_changes(self):
+        rng = Random(0)
+        names = ["f" + str(i) for i in range(50)]
+        index = self.new_index(names)
+        expected = list(names)
+        
+        for i in range(500):
+            name = rng.choice(expected)
+            new_priority = rng.randint(0, len(expected)+1)
+            
+            index.change_priority(name, new_priority)
+            expected.remove(name)
+            expected.insert(max(0, new_priority-1), name)
+            
+            probe = rng.choice(expected)
+            assert_that(index.priority_of_feature(probe), equal_to(expected.index(probe)+1))
+        
+        assert_feature_priorities(index, *expected)
+
+
+class PriorityIndex_Test(PriorityIndexContract):
+    new_index = PriorityIndex
+
+
+class TreePriorityIndex_Test(PriorityIndexContract):
+    new_index = TreePriorityIndex
+    
+    def test_can_be_built_from_many_features(self):
+        names = ["f" + str(i) for i in range(5000)]
+        
+        index = self.new_index(names)
+        
+        assert_that(list(index), equal_to(names))
+        assert_that(index.priority_of_feature("f1234"), equal_to(1235))
+        assert_that(index.feature_with_priority(4321), equal_to("f4320"))
+
+
+class PriorityIndexFactory_Test:
+    def test_uses_list_based_index_for_small_indices(self):
+        assert_that(priority_index(["a", "b"]), instance_of(PriorityIndex))
+    
+    def test_uses_tree_based_index_for_large_indices(self):
+        names = ["f" + str(i) for i in range(LargeIndexThreshold)]
+        assert_that(priority_index(names), instance_of(TreePriorityIndex))
@@ -0,0 +1,101 @@
+"""
+Journals of changes to status indices.
+
+A tracker that journals its status indices does not rewrite a whole status
+index when the priorities of its features change.  Instead, it appends a record
+of each change to a journal that sits next to the index and replays the journal
+over the index when it is loaded.  Compacting a journal writes the result of the
+replay back to the status index, in the usual one-name-per-line format, and
+deletes the journal.
+
+A record is the name of a PriorityIndex operation and its arguments, encoded as
+a JSON list on a line of its own.  A partly written last line, left behind if the
+tracker was interrupted while appending to the journal, is ignored.
+"""
+
+import re
+import json
+
+
+JournalSuffix = ".journal"
+
+# Journals are counted in chunks of this many bytes
+CountChunkSize = 1024*1024
+
+_EmptyLine = re.compile("\n(?=\n)")
+
+Operations = frozenset(["append", "insert", "insert_all", "remove", "remove_all", "rename", "change_priority"])
+
+
+def encode_record(record):
+    return json.dumps(record, separators=(",", ":"))
+
+
+def complete_lines(text):
+    # The last element is empty unless the last record was not completely written
+    return [line for line in text.split("\n")[:-1] if line]
+
+
+def count_records(input):
+    """
+    Counts the records in a journal file, as replay() would, without decoding
+    them or creating a string for each
+    """
+    count = 0
+    at_line_start = True
+    while True:
+        chunk = input.read(CountChunkSize)
+        if not chunk:
+            return count
+        
+        # Complete lines, less the empty lines that complete_lines() skips
+        count += chunk.count("\n") - len(_EmptyLine.findall(chunk))
+        if at_line_start and chunk[0] == "\n":
+            count -= 1
+        at_line_start = chunk[-1] == "\n"
+
+
+def replay(index, text):
+    """
+    Applies the records of a journal to a PriorityIndex.  Returns the number of
+    records in the journal and the lines of those that could not be applied.
+    """
+    lines = complete_lines(text)
+    failures = []
+    for line in lines:
+        try:
+            apply_record(index, decode_record(line))
+        except ValueError:
+            failures.append(line)
+    
+    return len(lines), failures
+
+
+def decode_record(line):
+    record = _to_str(json.loads(line))
+    if not isinstance(record, list) or not record or record[0] not in Operations:
+        raise ValueError("invalid journal record: " + line)
+    return record
+
+
+def apply_record(index, record):
+    """
+    Applies a journal record to a PriorityIndex.  Raises ValueError if the
+    record cannot be applied to the index.
+    """
+    operation = record[0]
+    args = record[1:]
+    try:
+        getattr(index, operation)(*args)
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise ValueError("cannot apply journal record " + encode_record(record))
+
+
+def _to_str(value):
+    # Feature names are byte strings everywhere else in the tracker
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, list):
+        return [_to_str(v) for v in value]
+    else:
+        return value
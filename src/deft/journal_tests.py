@@ -0,0 +1,72 @@
+from deft.indexing import PriorityIndex
+from StringIO import StringIO
+import deft.journal
+from deft.journal import encode_record, decode_record, replay, count_records
+from hamcrest import *
+from nose.tools import raises
+
+
+def journal_of(*records):
+    return "".join(encode_record(r) + "\n" for r in records)
+
+
+class Journal_Tests:
+    def test_decodes_encoded_records(self):
+        record = ["insert_all", ["alice", "bob"], None]
+        
+        assert_that(decode_record(encode_record(record)), equal_to(record))
+    
+    def test_decodes_names_as_byte_strings(self):
+        name = decode_record(encode_record(["append", "caf\xc3\xa9"]))[1]
+        
+        assert_that(name, equal_to("caf\xc3\xa9"))
+        assert_that(name, instance_of(str))
+    
+    @raises(ValueError)
+    def test_rejects_records_that_are_not_priority_index_operations(self):
+        decode_record(encode_record(["__init__", []]))
+    
+    def test_replays_records_over_index(self):
+        index = PriorityIndex(["alice", "bob", "carol"])
+        
+        length, failures = replay(index, journal_of(
+            ["append", "dave"],
+            ["change_priority", "dave", 1],
+            ["remove", "bob"],
+            ["rename", "carol", "caroline"]))
+        
+        assert_that(list(index), equal_to(["dave", "alice", "caroline"]))
+        assert_that(length, equal_to(4))
+        assert_that(failures, equal_to([]))
+    
+    def test_ignores_partly_written_last_record(self):
+        index = PriorityIndex(["alice", "bob"])
+        
+        length, failures = replay(index, journal_of(["remove", "alice"]) + '["remove","b')
+        
+        assert_that(list(index), equal_to(["bob"]))
+        assert_that(length, equal_to(1))
+    
+    def test_reports_records_that_cannot_be_applied_and_applies_the_rest(self):
+        index = PriorityIndex(["alice", "bob"])
+        
+        length, failures = replay(index, journal_of(["remove", "eve"], ["remove", "alice"]) + "garbage\n")
+        
+        assert_that(list(index), equal_to(["bob"]))
+        assert_that(length, equal_to(3))
+        assert_that(failures, equal_to([encode_record(["remove", "eve"]), "garbage"]))
+    
+    def test_counts_records_as_replay_does(self):
+        for text in ["", journal_of(["remove", "alice"], ["append", "bob"]),
+                     journal_of(["remove", "alice"]) + '["remove","b',
+                     "\n" + journal_of(["remove", "alice"]) + "\n\n\n" + journal_of(["append", "bob"]) + "\n"]:
+            assert_that(count_records(StringIO(text)), equal_to(replay(PriorityIndex(["alice"]), text)[0]))
+    
+    def test_counts_records_across_chunks(self):
+        original_chunk_size = deft.journal.CountChunkSize
+        deft.journal.CountChunkSize = 3
+        try:
+            text = "ab\n\n\nc\nde\n\nfgh\n\nij"
+            assert_that(count_records(StringIO(text)), equal_to(replay(PriorityIndex([]), text)[0]))
+        finally:
+            deft.journal.CountChunkSize = original_chunk_size
@@ -0,0 +1,249 @@
+"""
+Persistent caches of a tracker's state.
+
+Loading a tracker reads every status index, checks that every indexed feature
+exists and looks for features that are not indexed.  The LoadCache records the
+outcome of that work along with a fingerprint of the files it was derived from
+(the modification time and size of the status index files and of the features
+directory), so that the next load can rebuild the indices with a single read if
+nothing has changed in the meantime.
+
+The PropertyValuesCache records the indexable values of each feature's
+properties along with the modification time and size of its properties file,
+so that queries over properties need not parse every properties file.
+
+The caches are only used with storage that can report file modification times.
+"""
+
+import json
+from deft.storage import stat_many
+
+
+CacheFormatVersion = "deft-load-cache/1"
+PropertyValuesCacheFormatVersion = "deft-property-values-cache/1"
+
+
+class LoadCache(object):
+    def __init__(self, storage, path, watched_pattern, watched_dirs):
+        self.storage = storage
+        self.path = path
+        self.watched_pattern = watched_pattern
+        self.watched_dirs = watched_dirs
+        self._fingerprint_at_load = None
+        self._is_current = False
+        self._touched = set()
+
+    @property
+    def is_supported(self):
+        return hasattr(self.storage, "stat")
+
+    def load(self):
+        """
+        Returns the cached status indices as a list of (status, feature-names)
+        pairs, or None if the cache is missing or out of date.
+        """
+        self._is_current = False
+        self._touched = set()
+
+        if not self.is_supported:
+            return None
+
+        fingerprint = self._fingerprint()
+        self._fingerprint_at_load = fingerprint
+
+        try:
+            with self.storage.open(self.path) as input:
+                lines = input.read().splitlines()
+            cache_mtime = self.storage.stat(self.path)[0]
+        except IOError:
+            return None
+
+        if lines[:2] != [CacheFormatVersion, encode_fingerprint(fingerprint)]:
+            return None
+
+        if is_racy(fingerprint, cache_mtime):
+            return None
+
+        try:
+            entries = decode_entries(lines[2:])
+        except ValueError:
+            return None
+
+        self._is_current = True
+        return entries
+
+    def has_changed(self):
+        """
+        Reports whether the watched files or directories have been changed, by
+        this tracker or anything else, since the cache was loaded.
+        """
+        return not self.is_supported or self._fingerprint() != self._fingerprint_at_load
+
+    def touched(self, path):
+        """
+        Records that the tracker itself has changed a watched file or directory,
+        so that the change does not prevent the cache being brought up to date.
+        """
+        self._touched.add(path)
+
+    def save(self, entries):
+        """
+        Brings the cache up to date with the given status indices, unless files
+        have been changed by something other than this tracker since it was loaded.
+        """
+        if not self.is_supported:
+            return
+
+        fingerprint = self._fingerprint()
+        changed_paths = changed_entries(self._fingerprint_at_load, fingerprint)
+
+        if self._is_current and not changed_paths:
+            return
+
+        if not changed_paths.issubset(self._touched):
+            return
+
+        try:
+            with self.storage.open(self.path, "w") as output:
+                output.write(CacheFormatVersion + "\n")
+                output.write(encode_fingerprint(fingerprint) + "\n")
+                for line in encode_entries(entries):
+                    output.write(line + "\n")
+        except IOError:
+            # The cache is only an optimisation: the tracker can always be rebuilt from its files
+            return
+
+        self._fingerprint_at_load = fingerprint
+        self._is_current = True
+        self._touched = set()
+
+    def _fingerprint(self):
+        paths = sorted(self.storage.list(self.watched_pattern)) + self.watched_dirs
+        stats = stat_many(self.storage, paths)
+        return [[path] + list(stats.get(path, ())) for path in paths]
+
+
+class PropertyValuesCache(object):
+    def __init__(self, storage, path):
+        self.storage = storage
+        self.path = path
+        self._entries = None
+        self._is_dirty = False
+
+    @property
+    def is_supported(self):
+        return hasattr(self.storage, "stat")
+
+    def get_many(self, features, load):
+        """
+        Returns a dict that maps the names of features to their property values.
+        features is a list of (feature name, properties path) pairs.  The cached
+        values of a feature are used if its properties file has not changed,
+        otherwise load(feature_name) is called to obtain them.  The properties
+        files are stat-ed together, in as few round trips as the storage allows.
+        """
+        if not self.is_supported:
+            return dict((name, load(name)) for (name, path) in features)
+
+        entries = self._load_entries()
+        stats = stat_many(self.storage, [path for (name, path) in features])
+
+        values = {}
+        for name, path in features:
+            stamp = list(stats.get(path, ()))
+            entry = entries.get(name)
+
+            if stamp and entry is not None and entry[:2] == stamp:
+                values[name] = entry[2]
+            else:
+                values[name] = load(name)
+                if stamp:
+                    entries[name] = stamp + [values[name]]
+                    self._is_dirty = True
+
+        return values
+
+    def invalidate(self, feature_name):
+        if self._entries is not None and feature_name in self._entries:
+            del self._entries[feature_name]
+            self._is_dirty = True
+
+    def clear(self):
+        """
+        Forgets the cached values, so that they are read again from storage,
+        discarding any that have not been saved
+        """
+        self._entries = None
+        self._is_dirty = False
+
+    def save(self):
+        if not self._is_dirty:
+            return
+
+        try:
+            with self.storage.open(self.path, "w") as output:
+                output.write(PropertyValuesCacheFormatVersion + "\n")
+                json.dump(self._entries, output, separators=(",", ":"))
+        except IOError:
+            return
+
+        self._is_dirty = False
+
+    def _load_entries(self):
+        if self._entries is None:
+            self._entries = self._read_entries()
+        return self._entries
+
+    def _read_entries(self):
+        try:
+            with self.storage.open(self.path) as input:
+                header = input.readline().rstrip("\n")
+                entries = json.load(input) if header == PropertyValuesCacheFormatVersion else {}
+            cache_mtime = self.storage.stat(self.path)[0]
+        except (IOError, ValueError):
+            return {}
+
+        if not isinstance(entries, dict):
+            return {}
+
+        # As for the load cache, files modified in the same clock tick as the cache was written are not trusted
+        return dict((name, entry) for (name, entry) in entries.items()
+                    if isinstance(entry, list) and len(entry) == 3 and entry[0] < cache_mtime)
+
+
+def encode_fingerprint(fingerprint):
+    return json.dumps(fingerprint, separators=(",", ":"))
+
+
+def changed_entries(old_fingerprint, new_fingerprint):
+    old = dict((e[0], e) for e in old_fingerprint or [])
+    new = dict((e[0], e) for e in new_fingerprint)
+    return set(path for path in set(old) | set(new) if old.get(path) != new.get(path))
+
+
+def is_racy(fingerprint, cache_mtime):
+    # A file modified in the same clock tick as the cache was written may have changed
+    # without changing its fingerprint, so the cache cannot be trusted to describe it
+    return any(len(entry) > 1 and entry[1] >= cache_mtime for entry in fingerprint)
+
+
+def encode_entries(entries):
+    for (status, names) in entries:
+        names = list(names)
+        yield str(len(names)) + " " + status
+        for name in names:
+            yield name
+
+
+def decode_entries(lines):
+    entries = []
+    i = 0
+    while i < len(lines):
+        count, status = lines[i].split(" ", 1)
+        start = i + 1
+        i = start + int(count)
+        if i > len(lines):
+            raise ValueError("truncated load cache")
+        entries.append((status, lines[start:i]))
+
+    return entries
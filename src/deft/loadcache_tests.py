@@ -0,0 +1,34 @@
+
+from deft.loadcache import encode_entries, decode_entries, is_racy, changed_entries
+from hamcrest import *
+from nose.tools import raises
+
+
+class LoadCacheEncoding_Tests:
+    def test_decodes_encoded_entries(self):
+        entries = [("S", ["alice", "bob"]), ("lost+found", []), ("T T", ["carol"])]
+        
+        assert_that(decode_entries(list(encode_entries(entries))), equal_to(entries))
+    
+    @raises(ValueError)
+    def test_rejects_truncated_entries(self):
+        decode_entries(["3 S", "alice", "bob"])
+    
+    @raises(ValueError)
+    def test_rejects_malformed_entries(self):
+        decode_entries(["alice"])
+
+
+class LoadCacheFingerprint_Tests:
+    def test_reports_paths_that_have_been_added_removed_or_changed(self):
+        old = [["a", 1, 10], ["b", 1, 10], ["c", 1, 10]]
+        new = [["a", 1, 10], ["b", 2, 10], ["d", 1, 10]]
+        
+        assert_that(changed_entries(old, new), equal_to(set(["b", "c", "d"])))
+    
+    def test_is_racy_if_any_file_was_modified_no_earlier_than_the_cache(self):
+        assert_that(not is_racy([["a", 1, 10], ["b", 2, 10]], 3))
+        assert_that(is_racy([["a", 1, 10], ["b", 3, 10]], 3))
+    
+    def test_ignores_nonexistent_files_when_checking_for_raciness(self):
+        assert_that(not is_racy([["a"]], 3))
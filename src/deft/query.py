@@ -0,0 +1,284 @@
+"""
+Queries that select features by their status, priority and properties.
+
+A query compares fields of a feature with values.  The fields "status" and
+"priority" refer to the status and priority of the feature, any other field
+refers to a property.  For example:
+
+    component = ui and priority <= 3
+    milestone in (1.0, 1.1) and not status = released
+    estimated-effort != XL or (category = bug and status in (new, blocked))
+
+Values that look like numbers are compared as numbers, other values are
+compared as text.  Values that contain spaces or punctuation must be quoted.
+A feature that does not have a property never matches a comparison with that
+property, except for !=, which is the negation of =.
+"""
+
+import re
+from deft.tracker import UserError
+
+
+TokenPattern = re.compile(r"""
+    \s*(?:
+      (?P<op>==|!=|<=|>=|=|<|>|\(|\)|,) |
+      '(?P<single_quoted>[^']*)' |
+      "(?P<double_quoted>[^"]*)" |
+      (?P<word>[^\s=!<>(),'"]+) |
+      (?P<error>\S)
+    )""", re.VERBOSE)
+
+Keywords = frozenset(["and", "or", "not", "in"])
+
+
+def tokenize(text):
+    tokens = []
+    for match in TokenPattern.finditer(text):
+        if match.group("op") is not None:
+            tokens.append(("op", match.group("op")))
+        elif match.group("word") is not None:
+            word = match.group("word")
+            if word.lower() in Keywords:
+                tokens.append(("keyword", word.lower()))
+            else:
+                tokens.append(("value", word))
+        elif match.group("error") is not None:
+            raise UserError("invalid query: unexpected character " + repr(match.group("error")) +
+                            " in " + repr(text))
+        else:
+            quoted = match.group("single_quoted")
+            tokens.append(("value", quoted if quoted is not None else match.group("double_quoted")))
+
+    return tokens
+
+
+def numeric(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def compare(a, b):
+    a_number = numeric(a)
+    b_number = numeric(b)
+
+    if a_number is not None and b_number is not None:
+        return cmp(a_number, b_number)
+    else:
+        return cmp(a, b)
+
+
+Comparisons = {
+    "=": lambda c: c == 0,
+    "==": lambda c: c == 0,
+    "<": lambda c: c < 0,
+    "<=": lambda c: c <= 0,
+    ">": lambda c: c > 0,
+    ">=": lambda c: c >= 0
+}
+
+
+class Comparison(object):
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def select(self, context):
+        test = Comparisons[self.op]
+        return context.features_with_field_value(self.field, lambda v: test(compare(v, self.value)))
+
+    def __repr__(self):
+        return "Comparison(%r, %r, %r)" % (self.field, self.op, self.value)
+
+
+class Membership(object):
+    def __init__(self, field, values):
+        self.field = field
+        self.values = values
+
+    def select(self, context):
+        return context.features_with_field_value(
+            self.field, lambda v: any(compare(v, value) == 0 for value in self.values))
+
+    def __repr__(self):
+        return "Membership(%r, %r)" % (self.field, self.values)
+
+
+class Not(object):
+    def __init__(self, operand):
+        self.operand = operand
+
+    def select(self, context):
+        return context.all_features - self.operand.select(context)
+
+    def __repr__(self):
+        return "Not(%r)" % (self.operand,)
+
+
+class And(object):
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def select(self, context):
+        return self.left.select(context) & self.right.select(context)
+
+    def __repr__(self):
+        return "And(%r, %r)" % (self.left, self.right)
+
+
+class Or(object):
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def select(self, context):
+        return self.left.select(context) | self.right.select(context)
+
+    def __repr__(self):
+        return "Or(%r, %r)" % (self.left, self.right)
+
+
+class QueryParser(object):
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise UserError("invalid query: query is empty")
+
+        query = self.parse_or()
+        if self.pos < len(self.tokens):
+            self.fail("unexpected " + repr(self.tokens[self.pos][1]))
+        return query
+
+    def parse_or(self):
+        query = self.parse_and()
+        while self.accept("keyword", "or"):
+            query = Or(query, self.parse_and())
+        return query
+
+    def parse_and(self):
+        query = self.parse_not()
+        while self.accept("keyword", "and"):
+            query = And(query, self.parse_not())
+        return query
+
+    def parse_not(self):
+        if self.accept("keyword", "not"):
+            return Not(self.parse_not())
+        elif self.accept("op", "("):
+            query = self.parse_or()
+            self.expect("op", ")")
+            return query
+        else:
+            return self.parse_comparison()
+
+    def parse_comparison(self):
+        field = self.expect_value("field name")
+
+        if self.accept("keyword", "in"):
+            return Membership(field, self.parse_value_list())
+        elif self.accept("keyword", "not"):
+            self.expect("keyword", "in")
+            return Not(Membership(field, self.parse_value_list()))
+        elif self.accept("op", "!="):
+            return Not(Comparison(field, "=", self.expect_value("value")))
+        else:
+            op = self.expect_comparison_operator()
+            return Comparison(field, op, self.expect_value("value"))
+
+    def parse_value_list(self):
+        self.expect("op", "(")
+        values = [self.expect_value("value")]
+        while self.accept("op", ","):
+            values.append(self.expect_value("value"))
+        self.expect("op", ")")
+        return values
+
+    def accept(self, kind, text):
+        if self.pos < len(self.tokens) and self.tokens[self.pos] == (kind, text):
+            self.pos += 1
+            return True
+        else:
+            return False
+
+    def expect(self, kind, text):
+        if not self.accept(kind, text):
+            self.fail("expected " + repr(text))
+
+    def expect_value(self, description):
+        if self.pos < len(self.tokens) and self.tokens[self.pos][0] == "value":
+            self.pos += 1
+            return self.tokens[self.pos-1][1]
+        else:
+            self.fail("expected " + description)
+
+    def expect_comparison_operator(self):
+        if self.pos < len(self.tokens) and self.tokens[self.pos][1] in Comparisons:
+            self.pos += 1
+            return self.tokens[self.pos-1][1]
+        else:
+            self.fail("expected comparison operator")
+
+    def fail(self, message):
+        if self.pos < len(self.tokens):
+            position = "at " + repr(self.tokens[self.pos][1])
+        else:
+            position = "at end of query"
+        raise UserError("invalid query: " + message + " " + position + " in " + repr(self.text))
+
+
+def parse_query(text):
+    return QueryParser(text).parse()
+
+
+class QueryContext(object):
+    """
+    Evaluates queries against a tracker, using the tracker's property indexes
+    so that only the properties named in the query are examined.
+    """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self._all_features = None
+
+    @property
+    def all_features(self):
+        if self._all_features is None:
+            self._all_features = frozenset(f.name for f in self.tracker.all_features())
+        return self._all_features
+
+    def features_with_field_value(self, field, test):
+        selected = set()
+        for value, names in self._field_index(field):
+            if test(value):
+                selected.update(names)
+        return selected
+
+    def _field_index(self, field):
+        if field == "status":
+            for status in self.tracker.statuses():
+                yield status, [f.name for f in self.tracker.features_with_status(status)]
+        elif field == "priority":
+            priorities = {}
+            for status in self.tracker.statuses():
+                for priority, feature in enumerate(self.tracker.features_with_status(status), 1):
+                    priorities.setdefault(priority, []).append(feature.name)
+            for priority, names in priorities.items():
+                yield str(priority), names
+        else:
+            index = self.tracker.property_index(field)
+            for value in index.values():
+                yield value, index.features_with_value(value)
+
+
+def select_features(tracker, query):
+    """
+    Returns the names of the tracker's features that match the query
+    """
+    return query.select(QueryContext(tracker))
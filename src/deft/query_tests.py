@@ -0,0 +1,105 @@
+
+from deft.query import parse_query, select_features, tokenize, compare
+from deft.tracker import FeatureTracker, default_config, UserError
+from deft.storage.memory import MemStorage
+from deft.warn import WarningRaiser
+from hamcrest import *
+from nose.tools import raises
+
+
+class Tokenize_Tests:
+    def test_splits_query_into_values_operators_and_keywords(self):
+        assert_that(tokenize("component=ui AND priority <= 3"), equal_to([
+                    ("value", "component"), ("op", "="), ("value", "ui"),
+                    ("keyword", "and"),
+                    ("value", "priority"), ("op", "<="), ("value", "3")]))
+    
+    def test_quoted_values_can_contain_spaces_punctuation_and_keywords(self):
+        assert_that(tokenize("""x = 'a (b), c' or y = "and" """), equal_to([
+                    ("value", "x"), ("op", "="), ("value", "a (b), c"),
+                    ("keyword", "or"),
+                    ("value", "y"), ("op", "="), ("value", "and")]))
+    
+    @raises(UserError)
+    def test_rejects_unterminated_quotes(self):
+        tokenize("x = 'abc")
+
+
+class Compare_Tests:
+    def test_compares_numbers_numerically(self):
+        assert_that(compare("10", "9"), greater_than(0))
+        assert_that(compare("1.0", "1"), equal_to(0))
+    
+    def test_compares_other_values_as_text(self):
+        assert_that(compare("b", "a"), greater_than(0))
+        assert_that(compare("10", "9x"), less_than(0))
+
+
+class ParseQuery_Tests:
+    def test_and_binds_more_tightly_than_or(self):
+        assert_that(repr(parse_query("a = 1 or b = 2 and c = 3")), equal_to(
+                "Or(Comparison('a', '=', '1'), And(Comparison('b', '=', '2'), Comparison('c', '=', '3')))"))
+    
+    def test_parentheses_group_subqueries(self):
+        assert_that(repr(parse_query("(a = 1 or b = 2) and c = 3")), equal_to(
+                "And(Or(Comparison('a', '=', '1'), Comparison('b', '=', '2')), Comparison('c', '=', '3'))"))
+    
+    def test_parses_membership_and_negation(self):
+        assert_that(repr(parse_query("not a in (1, 2) and b not in (3) and c != 4")), equal_to(
+                "And(And(Not(Membership('a', ['1', '2'])), Not(Membership('b', ['3']))), Not(Comparison('c', '=', '4')))"))
+    
+    def test_reports_syntax_errors(self):
+        for text in ["", "a", "a =", "a = 1 and", "a in 1", "a in (1", "(a = 1", "a = 1 b", "a ~ 1"]:
+            try:
+                parse_query(text)
+                raise AssertionError("should have rejected query " + repr(text))
+            except UserError as e:
+                assert_that(str(e), contains_string("invalid query"))
+
+
+class SelectFeatures_Tests:
+    def setup(self):
+        self.storage = MemStorage()
+        self.tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                      storage=self.storage, 
+                                      warning_listener=WarningRaiser(AssertionError))
+        
+        self.tracker.create(name="alice", status="new", properties={"component": "ui", "milestone": 1.0})
+        self.tracker.create(name="bob", status="new", properties={"component": "db", "milestone": 1.1})
+        self.tracker.create(name="carol", status="new", properties={"component": "ui", "milestone": 2})
+        self.tracker.create(name="dave", status="done", properties={"component": ["ui", "db"]})
+        self.tracker.create(name="eve", status="done", properties={})
+    
+    def select(self, text):
+        return sorted(select_features(self.tracker, parse_query(text)))
+    
+    def test_selects_features_by_property_equality(self):
+        assert_that(self.select("component = ui"), equal_to(["alice", "carol", "dave"]))
+    
+    def test_features_without_property_do_not_match_comparisons(self):
+        assert_that(self.select("milestone < 10"), equal_to(["alice", "bob", "carol"]))
+    
+    def test_not_equal_is_negation_of_equal(self):
+        assert_that(self.select("milestone != 1"), equal_to(["bob", "carol", "dave", "eve"]))
+    
+    def test_selects_features_by_membership(self):
+        assert_that(self.select("milestone in (1, 2)"), equal_to(["alice", "carol"]))
+    
+    def test_selects_features_by_status_and_priority(self):
+        assert_that(self.select("status = done"), equal_to(["dave", "eve"]))
+        assert_that(self.select("priority <= 1"), equal_to(["alice", "dave"]))
+        assert_that(self.select("status = new and priority > 1"), equal_to(["bob", "carol"]))
+    
+    def test_combines_subqueries(self):
+        assert_that(self.select("component = db or (status = new and not milestone >= 2)"), 
+                    equal_to(["alice", "bob", "dave"]))
+    
+    def test_sees_changes_to_properties_made_after_index_is_built(self):
+        self.select("component = ui")
+        
+        self.tracker.feature_named("alice").properties = {"component": "db"}
+        self.tracker.feature_named("bob").name = "robert"
+        self.tracker.purge("carol")
+        
+        assert_that(self.select("component = ui"), equal_to(["dave"]))
+        assert_that(self.select("component = db"), equal_to(["alice", "dave", "robert"]))
@@ -0,0 +1,87 @@
+"""
+Storages are duck-typed.  As well as the operations that every storage
+provides, a storage may provide read_many, read_first_lines and stat_many
+methods, which read or stat many files in fewer round trips than a call per
+file.  The functions
+below use those methods if a storage provides them, and otherwise make a call
+per file.
+"""
+
+import errno
+
+
+def read_many(storage, relpaths):
+    """
+    Returns a dict that maps paths to the contents of the files at those paths.
+    Paths at which there is no file are left out.
+    """
+    if hasattr(storage, "read_many"):
+        return storage.read_many(relpaths)
+    else:
+        return read_each(storage, relpaths)
+
+
+def read_first_lines(storage, relpaths, max_bytes):
+    """
+    Returns a dict that maps paths to the first lines of the files at those
+    paths, including their line ends, reading no more than max_bytes of each.
+    Paths at which there is no file are left out.
+    """
+    if hasattr(storage, "read_first_lines"):
+        return storage.read_first_lines(relpaths, max_bytes)
+    else:
+        return read_first_line_each(storage, relpaths, max_bytes)
+
+
+def stat_many(storage, relpaths):
+    """
+    Returns a dict that maps paths to the modification times and sizes of the
+    files at those paths, as returned by the storage's stat method.  Paths at
+    which there is nothing are left out.
+    """
+    if hasattr(storage, "stat_many"):
+        return storage.stat_many(relpaths)
+    else:
+        return stat_each(storage, relpaths)
+
+
+def read_each(storage, relpaths):
+    return _read_each(storage, relpaths, lambda input: input.read())
+
+
+def read_first_line_each(storage, relpaths, max_bytes):
+    return _read_each(storage, relpaths, lambda input: input.readline(max_bytes))
+
+
+def _read_each(storage, relpaths, read):
+    contents = {}
+    for relpath in relpaths:
+        try:
+            with storage.open(relpath) as input:
+                contents[relpath] = read(input)
+        except IOError as e:
+            if not is_missing(storage, relpath, e):
+                raise
+    return contents
+
+
+def stat_each(storage, relpaths):
+    stats = {}
+    for relpath in relpaths:
+        try:
+            stats[relpath] = storage.stat(relpath)
+        except IOError as e:
+            if not is_missing(storage, relpath, e):
+                raise
+    return stats
+
+
+def is_missing(storage, relpath, error):
+    """
+    Returns whether an error reading a path means only that there is no file
+    at the path, rather than that the file could not be read
+    """
+    if error.errno is not None:
+        return error.errno in (errno.ENOENT, errno.ENOTDIR, errno.EISDIR)
+    else:
+        return not storage.exists(relpath) or storage.isdir(relpath)
@@ -1,6 +1,7 @@
 
 from hamcrest import *
 from nose.tools import raises
+from deft.storage import read_many, read_first_lines, stat_many
 
 
 class ReadOnlyStorageContract:
@@ -78,6 +79,36 @@ class ReadOnlyStorageContract:
     def test_returns_no_results_when_listing_pattern_refers_to_nonexistent_directory(self):
         assert_that(list(self.storage.list("no/where/*.txt")), equal_to([]))
     
+    def test_can_read_many_files_at_once(self):
+        self.given_file("a/x", content="x-content")
+        self.given_file("a/y", content="y-content")
+        self.given_file("z", content="z-content")
+        
+        assert_that(read_many(self.storage, ["a/x", "a/y", "z", "a/nonexistent", "a"]), equal_to(
+                {"a/x": "x-content", "a/y": "y-content", "z": "z-content"}))
+        assert_that(read_many(self.storage, []), equal_to({}))
+    
+    def test_can_read_first_lines_of_many_files_at_once(self):
+        self.given_file("a/x", content="x-first\nx-second\n")
+        self.given_file("a/y", content="a long first line\n")
+        self.given_file("a/z", content="z-only")
+        
+        assert_that(read_first_lines(self.storage, ["a/x", "a/y", "a/z", "a/nonexistent", "a"], 10), equal_to(
+                {"a/x": "x-first\n", "a/y": "a long fir", "a/z": "z-only"}))
+    
+    def test_can_stat_many_files_at_once_if_storage_can_stat_files(self):
+        if not hasattr(self.storage, "stat"):
+            return
+        
+        self.given_file("a/x", content="12345")
+        self.given_file("a/y", content="123")
+        
+        stats = stat_many(self.storage, ["a/x", "a/y", "a/nonexistent"])
+        
+        assert_that(sorted(stats), equal_to(["a/x", "a/y"]))
+        assert_that(stats["a/x"], equal_to(self.storage.stat("a/x")))
+        assert_that(stats["a/y"][1], equal_to(3))
+    
     def test_can_report_real_path_for_relative_path(self):
         assert_that(self.create_storage("/foo/bar").abspath("x/y"), equal_to("/foo/bar/x/y"))
         assert_that(self.create_storage("foo/bar").abspath("x/y"), equal_to("foo/bar/x/y"))
@@ -96,6 +127,24 @@ class StorageContract(ReadOnlyStorageContract):
             
         assert_that(content, equal_to("new-content"))
     
+    def test_can_append_to_existing_files(self):
+        self.given_file("the-file", content="original-content\n")
+        
+        with self.storage.open("the-file", "a") as output:
+            output.write("more-content\n")
+        
+        with self.storage.open("the-file", "r") as input:
+            content = input.read()
+        
+        assert_that(content, equal_to("original-content\nmore-content\n"))
+    
+    def test_appending_creates_file_and_parent_directories_if_they_do_not_exist(self):
+        with self.storage.open("parent/example.txt", "a") as output:
+            output.write("testing")
+        
+        assert_that(self.storage.isdir("parent"))
+        assert_that(self.storage.open("parent/example.txt").read(), equal_to("testing"))
+    
     def test_automagically_makes_parent_directories_when_writing_files(self):
         with self.storage.open("parent/subparent/example.txt", "w") as output:
             output.write("testing")
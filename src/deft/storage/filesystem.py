@@ -1,62 +1,334 @@
 
 import os
+import errno
+import binascii
+from functools import partial
 import shutil
-from glob import iglob
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+from deft.storage import read_each, read_first_line_each, stat_each
+from deft.storage.snapshot import DirectorySnapshot
+
+
+# Durability levels.  Files are always written atomically, by writing a temporary
+# file and renaming it over the original, so a crash never leaves a file partly
+# written.  The durability level controls when changes are forced to disk.
+NoSync = "none"            # when the operating system chooses
+SyncOnCommand = "command"  # when the command finishes, by calling sync()
+SyncEachFile = "file"      # as each file is written
+
+Durabilities = [NoSync, SyncOnCommand, SyncEachFile]
+DefaultDurability = SyncOnCommand
+
+# The number of threads that read files concurrently in read_many and stat_many.
+# Each read of a file on a network file system waits for a round trip to the server.
+ReadThreads = 8
+# Fewer files than this are read one after another, because starting the threads,
+# and stopping them when the process exits, takes longer than reading a few files
+ConcurrentReadMinimum = 16
+
+
+class _OutputFile(object):
+    def __init__(self, file):
+        self._file = file
+    
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+    
+    def __iter__(self):
+        return iter(self._file)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class AtomicFile(_OutputFile):
+    """
+    Written to a temporary file that replaces the target file when closed, so that
+    the target is never seen partly written.  If discarded, or written within a
+    with statement that fails, the target file is left unchanged.
+    """
+    
+    def __init__(self, storage, abspath):
+        dirname, basename = os.path.split(abspath)
+        fd, self._temp_abspath = _create_temp_file(dirname, basename)
+        _OutputFile.__init__(self, os.fdopen(fd, "w"))
+        self._storage = storage
+        self._abspath = abspath
+    
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            _copy_mode(self._abspath, self._temp_abspath)
+            self._storage._file_written(self._file)
+            self._file.close()
+            os.rename(self._temp_abspath, self._abspath)
+            self._storage._file_closed(self._abspath, is_new=True)
+    
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+            os.remove(self._temp_abspath)
+
+
+class AppendedFile(_OutputFile):
+    def __init__(self, storage, abspath):
+        self._is_new = not os.path.exists(abspath)
+        _OutputFile.__init__(self, open(abspath, "a"))
+        self._storage = storage
+        self._abspath = abspath
+    
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            self._storage._file_written(self._file)
+            self._file.close()
+            self._storage._file_closed(self._abspath, is_new=self._is_new)
+    
+    def discard(self):
+        # Whatever has been written cannot be taken back
+        self.close()
+
+
+def _create_temp_file(dirname, basename):
+    # Not tempfile.mkstemp, which creates files readable only by their owner: the kernel
+    # applies the umask to the mode given here, as it would for any other new file
+    while True:
+        abspath = os.path.join(dirname, "." + basename + "." + binascii.hexlify(os.urandom(6)) + ".tmp")
+        try:
+            return os.open(abspath, os.O_WRONLY|os.O_CREAT|os.O_EXCL, 0666), abspath
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def _copy_mode(from_abspath, to_abspath):
+    try:
+        mode = os.stat(from_abspath).st_mode & 07777
+    except OSError:
+        return
+    os.chmod(to_abspath, mode)
+
+
+def _fsync_path(abspath):
+    try:
+        fd = os.open(abspath, os.O_RDONLY)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return False
+        raise
+    
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        # Some platforms and file systems cannot sync directories
+        if e.errno not in (errno.EINVAL, errno.EBADF, errno.EACCES):
+            raise
+    finally:
+        os.close(fd)
+    
+    return True
 
 
 class FileStorage(object):
-    def __init__(self, basedir):
+    def __init__(self, basedir, durability=DefaultDurability):
         self.basedir = basedir
+        self.durability = durability
+        self._unsynced_files = set()
+        self._unsynced_dirs = set()
+        self._snapshot = DirectorySnapshot()
+        self._read_pool = None
+        self._read_pool_lock = Lock()
+    
+    def __del__(self):
+        if self._read_pool is not None:
+            self._read_pool.close()
     
     def abspath(self, relpath):
+        return self._abspath(relpath)
+    
+    def _abspath(self, relpath):
         return os.path.normpath(os.path.join(self.basedir, relpath))
     
+    def forget(self, relpath):
+        """
+        Forgets what the storage knows about a file or directory and the directory
+        that contains it, because another process may have changed them
+        """
+        self._snapshot.forget(self._abspath(relpath))
+    
+    def refresh(self):
+        """
+        Forgets all that the storage knows about its directories, so that it sees
+        the changes that other processes have made to them
+        """
+        self._snapshot = DirectorySnapshot()
+    
     def exists(self, relpath):
-        return os.path.exists(self.abspath(relpath))
+        return self._snapshot.exists(self._abspath(relpath))
     
     def isdir(self, relpath):
-        return os.path.isdir(self.abspath(relpath))
+        return self._snapshot.isdir(self._abspath(relpath))
+    
+    def stat(self, relpath):
+        try:
+            s = self._snapshot.stat(self._abspath(relpath))
+        except OSError as e:
+            raise IOError(self._abspath(relpath) + ": " + e.strerror)
+        
+        return (s.st_mtime, s.st_size)
+    
+    def read_many(self, relpaths):
+        return self._in_threads(read_each, relpaths)
+    
+    def read_first_lines(self, relpaths, max_bytes):
+        return self._in_threads(partial(read_first_line_each, max_bytes=max_bytes), relpaths)
+    
+    def stat_many(self, relpaths):
+        return self._in_threads(stat_each, relpaths)
+    
+    def _in_threads(self, function, relpaths):
+        relpaths = list(relpaths)
+        if len(relpaths) < ConcurrentReadMinimum:
+            return function(self, relpaths)
+        
+        threads = min(ReadThreads, len(relpaths))
+        # Several chunks per thread, so that threads that finish early can take on more work
+        chunk_size = -(-len(relpaths) // (threads*4))
+        chunks = [relpaths[i:i+chunk_size] for i in range(0, len(relpaths), chunk_size)]
+        
+        with self._read_pool_lock:
+            if self._read_pool is None:
+                self._read_pool = ThreadPool(ReadThreads)
+        results = self._read_pool.map(partial(function, self), chunks, chunksize=1)
+        
+        combined = {}
+        for result in results:
+            combined.update(result)
+        return combined
     
     def open(self, relpath, mode="r"):
-        if mode == "w":
+        if mode in ("w", "a"):
             self._ensure_parent_dir_exists(relpath)
         
-        return open(self.abspath(relpath), mode)
+        if mode == "w":
+            return AtomicFile(self, self._abspath(relpath))
+        elif mode == "a":
+            return AppendedFile(self, self._abspath(relpath))
+        else:
+            return open(self._abspath(relpath), mode)
     
     def rename(self, old_relpath, new_relpath):
-        old_abspath = self.abspath(old_relpath)
-        new_abspath = self.abspath(new_relpath)
+        old_abspath = self._abspath(old_relpath)
+        new_abspath = self._abspath(new_relpath)
+        
+        if not self.exists(old_relpath):
+            raise IOError(old_abspath + " does not exist")
+        if self.isdir(old_relpath):
+            raise IOError(old_abspath + " is a directory")
+        if self.exists(new_relpath):
+            raise IOError(new_abspath + " already exists")
         
         try:
-            if not os.path.exists(old_abspath):
-                raise IOError(old_abspath + " does not exist")
-            if os.path.isdir(old_abspath):
-                raise IOError(old_abspath + " is a directory")
-            if os.path.exists(new_abspath):
-                raise IOError(new_abspath + " already exists")
-            
+            self._ensure_parent_dir_exists(new_relpath)
             os.renames(old_abspath, new_abspath)
         except OSError as e:
             raise IOError(e.strerror)
+        
+        self._snapshot.removed(old_abspath)
+        self._snapshot.added(new_abspath, is_dir=False)
+        
+        # os.renames removes the directories that it leaves empty
+        old_dirpath = os.path.dirname(old_abspath)
+        while old_dirpath and not os.path.isdir(old_dirpath):
+            self._snapshot.removed(old_dirpath)
+            old_dirpath = os.path.dirname(old_dirpath)
+        
+        if old_abspath in self._unsynced_files:
+            self._unsynced_files.remove(old_abspath)
+            self._unsynced_files.add(new_abspath)
+        self._changed(None, os.path.dirname(old_abspath), os.path.dirname(new_abspath))
     
     def _ensure_parent_dir_exists(self, relpath):
         self.makedirs(os.path.dirname(relpath))
     
     def remove(self, relpath):
-        path = self.abspath(relpath)
-        if os.path.isdir(path):
+        path = self._abspath(relpath)
+        if self.isdir(relpath):
             shutil.rmtree(path)
-        elif os.path.exists(path):
+        elif self.exists(relpath):
             os.remove(path)
+        else:
+            return
+        
+        self._snapshot.removed(path)
+        self._changed(None, os.path.dirname(path))
     
     def list(self, relpattern):
-        pattern = self.abspath(relpattern)
-        return (os.path.relpath(match, start=self.basedir) for match in iglob(pattern))
+        pattern_parts = os.path.normpath(relpattern).split(os.sep)
+        return self._snapshot.glob(self._abspath(""), pattern_parts)
     
     def makedirs(self, relpath):
+        dirpath = self._abspath(relpath)
+        if self._snapshot.isdir(dirpath):
+            return
+        
         if relpath != "":
-            dirpath = self.abspath(relpath)
-            if not os.path.exists(dirpath):
-                os.makedirs(dirpath)
+            self.makedirs(os.path.dirname(relpath))
+            mkdir = os.mkdir
+        else:
+            # The base directory, and any of its parents that do not exist
+            mkdir = os.makedirs
+        
+        try:
+            mkdir(dirpath)
+        except OSError as e:
+            raise IOError(dirpath + ": " + e.strerror)
+        
+        self._snapshot.added(dirpath, is_dir=True)
+        self._changed(None, os.path.dirname(dirpath))
+    
+    def sync(self):
+        """
+        Forces the changes made since the last sync to disk, syncing each changed
+        directory once however many files were changed in it.
+        """
+        for abspath in sorted(self._unsynced_files):
+            _fsync_path(abspath)
+        
+        for abspath in sorted(self._unsynced_dirs):
+            # The directory may have been removed since it changed, in which case its parent has changed
+            while not _fsync_path(abspath) and abspath != os.path.dirname(abspath):
+                abspath = os.path.dirname(abspath)
+        
+        self._unsynced_files.clear()
+        self._unsynced_dirs.clear()
+    
+    def _file_written(self, file):
+        if self.durability == SyncEachFile:
+            os.fsync(file.fileno())
+    
+    def _file_closed(self, abspath, is_new):
+        if is_new:
+            self._snapshot.added(abspath, is_dir=False)
+            self._changed(abspath, os.path.dirname(abspath))
+        else:
+            self._snapshot.changed(abspath)
+            self._changed(abspath)
+    
+    def _changed(self, file_abspath, *dir_abspaths):
+        if self.durability == SyncEachFile:
+            for abspath in dir_abspaths:
+                _fsync_path(abspath)
+        elif self.durability == SyncOnCommand:
+            if file_abspath is not None:
+                self._unsynced_files.add(file_abspath)
+            self._unsynced_dirs.update(dir_abspaths)
 
 
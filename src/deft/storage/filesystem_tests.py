@@ -1,12 +1,15 @@
 
 import os
+import stat
+import threading
 from deft.formats import TextFormat, YamlFormat
-from deft.storage.filesystem import FileStorage
+from deft.storage.filesystem import FileStorage, NoSync, SyncOnCommand, SyncEachFile, ConcurrentReadMinimum
 from deft.storage.memory import MemStorage, MemoryIO
 from deft.fileops import *
 from deft.storage.contract import PersistentStorageContract
 from hamcrest import *
 from nose.plugins.attrib import attr
+from nose.tools import raises
 
 
 def path(p):
@@ -44,6 +47,216 @@ class FileStorage_Test(PersistentStorageContract):
         assert_that(os.path.exists(self._abspath("example-dir/example-file")), equal_to(False))
         assert_that(os.path.exists(self._abspath("example-dir")), equal_to(False))
     
+    def test_reports_modification_time_and_size_of_files(self):
+        self.given_file("example-file", content="12345")
+        
+        mtime, size = self.storage.stat("example-file")
+        
+        assert_that(mtime, equal_to(os.stat(self._abspath("example-file")).st_mtime))
+        assert_that(size, equal_to(5))
+    
+    @raises(IOError)
+    def test_cannot_stat_nonexistent_files(self):
+        self.storage.stat("nonexistent-file")
+    
+    def test_leaves_original_file_unchanged_if_writing_fails(self):
+        self.given_file("example-file", content="original-content")
+        
+        try:
+            with self.storage.open("example-file", "w") as output:
+                output.write("partial-")
+                raise ValueError("failed while writing")
+        except ValueError:
+            pass
+        
+        assert_that(open(self._abspath("example-file")).read(), equal_to("original-content"))
+        assert_that(os.listdir(self._abspath(".")), equal_to(["example-file"]))
+    
+    def test_original_file_is_unchanged_until_new_content_is_closed(self):
+        self.given_file("example-file", content="original-content")
+        
+        output = self.storage.open("example-file", "w")
+        output.write("new-content")
+        output.flush()
+        
+        assert_that(open(self._abspath("example-file")).read(), equal_to("original-content"))
+        
+        output.close()
+        
+        assert_that(open(self._abspath("example-file")).read(), equal_to("new-content"))
+        assert_that(os.listdir(self._abspath(".")), equal_to(["example-file"]))
+    
+    def test_preserves_permissions_of_rewritten_files(self):
+        self.given_file("example-file")
+        os.chmod(self._abspath("example-file"), 0640)
+        
+        self.given_file("example-file", content="new-content")
+        
+        assert_that(os.stat(self._abspath("example-file")).st_mode & 0777, equal_to(0640))
+    
+    def test_creates_files_with_permissions_allowed_by_umask(self):
+        umask = os.umask(0)
+        os.umask(umask)
+        
+        self.given_file("example-file")
+        
+        assert_that(os.stat(self._abspath("example-file")).st_mode & 0777, equal_to(0666 & ~umask))
+    
+    def test_creates_files_with_permissions_allowed_by_umask_when_written(self):
+        original_umask = os.umask(027)
+        try:
+            self.given_file("example-file")
+        finally:
+            os.umask(original_umask)
+        
+        assert_that(os.stat(self._abspath("example-file")).st_mode & 0777, equal_to(0640))
+    
+    def test_syncs_nothing_if_durability_is_none(self):
+        synced = self.count_fsyncs(NoSync, self.write_files)
+        
+        assert_that(synced, equal_to([]))
+    
+    def test_syncs_each_file_and_directory_as_it_is_written_if_durability_is_file(self):
+        synced = self.count_fsyncs(SyncEachFile, self.write_files)
+        
+        assert_that(synced.count("file"), equal_to(3))
+        assert_that(synced.count("dir"), equal_to(4))
+    
+    def test_syncs_files_and_each_changed_directory_once_when_synced_if_durability_is_command(self):
+        def write_and_sync(storage):
+            self.write_files(storage)
+            storage.sync()
+        
+        synced = self.count_fsyncs(SyncOnCommand, write_and_sync)
+        
+        assert_that(synced.count("file"), equal_to(3))
+        assert_that(synced.count("dir"), equal_to(2))
+    
+    def test_answers_queries_from_a_snapshot_of_the_directories_taken_when_first_used(self):
+        self.given_file("dir/a")
+        storage = self.create_storage()
+        
+        assert_that(list(storage.list("dir/*")), equal_to([path("dir/a")]))
+        
+        open(self._abspath("dir/b"), "w").close()
+        
+        assert_that(not storage.exists("dir/b"))
+        assert_that(list(storage.list("dir/*")), equal_to([path("dir/a")]))
+    
+    def test_keeps_snapshot_up_to_date_with_its_own_changes(self):
+        self.given_file("dir/a")
+        storage = self.create_storage()
+        storage.list("dir/*")
+        
+        with storage.open("dir/b", "w") as output:
+            output.write("b")
+        storage.rename("dir/a", "other-dir/a")
+        storage.makedirs("dir/subdir")
+        
+        assert_that(sorted(storage.list("*/*")), equal_to([path("dir/b"), path("dir/subdir"), path("other-dir/a")]))
+        assert_that(storage.isdir("dir/subdir"))
+        assert_that(not storage.exists("dir/a"))
+        
+        storage.remove("dir")
+        
+        assert_that(list(storage.list("*/*")), equal_to([path("other-dir/a")]))
+        assert_that(not storage.exists("dir/b"))
+    
+    def test_reports_new_modification_time_and_size_of_files_it_has_changed(self):
+        self.given_file("a", content="1")
+        storage = self.create_storage()
+        storage.stat("a")
+        
+        with storage.open("a", "a") as output:
+            output.write("23")
+        
+        assert_that(storage.stat("a")[1], equal_to(3))
+    
+    def test_sees_changes_made_by_others_to_files_it_has_been_told_to_forget(self):
+        self.given_file("dir/edited-file", content="1")
+        storage = self.create_storage()
+        storage.list("dir/*")
+        storage.stat("dir/edited-file")
+        
+        with open(storage.abspath("dir/edited-file"), "w") as output:
+            output.write("12345")
+        open(storage.abspath("dir/new-file"), "w").close()
+        
+        storage.forget("dir/edited-file")
+        
+        assert_that(storage.stat("dir/edited-file")[1], equal_to(5))
+        assert_that(sorted(storage.list("dir/*")), equal_to([path("dir/edited-file"), path("dir/new-file")]))
+    
+    def test_does_not_forget_what_it_knows_about_files_it_has_given_the_path_of(self):
+        self.given_file("dir/a")
+        storage = self.create_storage()
+        storage.list("dir/*")
+        
+        storage.abspath("dir/a")
+        open(self._abspath("dir/b"), "w").close()
+        
+        assert_that(not storage.exists("dir/b"))
+    
+    def test_sees_all_changes_made_by_others_when_refreshed(self):
+        self.given_file("dir/a", content="1")
+        storage = self.create_storage()
+        storage.list("dir/*")
+        storage.stat("dir/a")
+        
+        with open(self._abspath("dir/a"), "w") as output:
+            output.write("123")
+        open(self._abspath("dir/b"), "w").close()
+        os.mkdir(self._abspath("other-dir"))
+        
+        storage.refresh()
+        
+        assert_that(storage.stat("dir/a")[1], equal_to(3))
+        assert_that(sorted(storage.list("dir/*")), equal_to([path("dir/a"), path("dir/b")]))
+        assert_that(storage.isdir("other-dir"))
+    
+    def test_reads_many_files_on_the_same_threads_each_time(self):
+        names = ["f" + str(i) for i in range(ConcurrentReadMinimum)]
+        for name in names:
+            self.given_file(name)
+        storage = self.create_storage()
+        
+        storage.read_many(names)
+        thread_count = threading.active_count()
+        for i in range(3):
+            storage.read_many(names)
+        
+        assert_that(threading.active_count(), equal_to(thread_count))
+    
+    def test_glob_wildcards_do_not_match_hidden_files(self):
+        self.given_file(".hidden")
+        self.given_file("visible")
+        
+        assert_that(list(self.storage.list("*")), equal_to(["visible"]))
+        assert_that(list(self.storage.list(".*")), equal_to([".hidden"]))
+    
+    def write_files(self, storage):
+        storage.makedirs("subdir")
+        for name in ["a", "b", "c"]:
+            with storage.open("subdir/" + name, "w") as output:
+                output.write(name)
+    
+    def count_fsyncs(self, durability, action):
+        storage = FileStorage(self.testdir, durability=durability)
+        synced = []
+        original_fsync = os.fsync
+        
+        def recording_fsync(fd):
+            synced.append("dir" if stat.S_ISDIR(os.fstat(fd).st_mode) else "file")
+            original_fsync(fd)
+        
+        os.fsync = recording_fsync
+        try:
+            action(storage)
+        finally:
+            os.fsync = original_fsync
+        
+        return synced
+    
     def _abspath(self, p):
         return os.path.abspath(os.path.join(self.testdir, path(p)))
     
@@ -5,16 +5,28 @@ from datetime import date, time, datetime
 from fnmatch import fnmatch
 import os
 import stat
+from functools import partial
+from heapq import heappush, heappop
+from collections import OrderedDict
 from dulwich.repo import Repo
 from dulwich.objects import Blob, Tree, Commit
 from deft.storage.memory import MemoryIO
 from deft.storage.overlay import OverlayStorage
+from deft.caching import LRUCache
 from deft.tracker import UserError
 from deft.upgrade import create_upgrader
 from deft.cli import CommandLineInterface
 from deft.history import HistoricalBackend
 
 
+# The number of decoded trees cached by a GitStorageHistory, and shared between its snapshots
+TreeCacheSize = 1024
+
+
+# The file, in the repository's control directory, in which a CommitIndex is saved
+CommitIndexFile = "deft-commit-index"
+
+
 def date_of(commit):
     return date.fromtimestamp(commit.commit_time)
 
@@ -22,50 +34,151 @@ def time_of(commit):
     return datetime.fromtimestamp(commit.commit_time).time()
 
 
+class CommitIndex(object):
+    """
+    The commit times and parents of commits, saved in a file so that walking the
+    history again does not need to read and parse every commit object.  Commits
+    never change, so neither do entries in the index.  The file has a line for
+    each commit: its SHA-1, its commit time and the SHA-1s of its parents.  A
+    partly written last line is ignored.
+    """
+    
+    def __init__(self, repo, path):
+        self.repo = repo
+        self.path = path
+        self.misses = 0
+        self._entries = None
+        self._unsaved = []
+    
+    def __getitem__(self, commit_sha):
+        "Returns the commit time and parents of a commit"
+        entries = self._load()
+        if commit_sha not in entries:
+            self.misses += 1
+            commit = self.repo.commit(commit_sha)
+            entries[commit_sha] = (commit.commit_time, commit.parents)
+            self._unsaved.append(commit_sha)
+        
+        return entries[commit_sha]
+    
+    def save(self):
+        if not self._unsaved:
+            return
+        
+        try:
+            with open(self.path, "a") as output:
+                for commit_sha in self._unsaved:
+                    commit_time, parents = self._entries[commit_sha]
+                    output.write(" ".join([commit_sha, str(commit_time)] + parents) + "\n")
+        except IOError:
+            # The index only saves time, so a read-only repository can do without it
+            pass
+        
+        self._unsaved = []
+    
+    def _load(self):
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.path):
+                with open(self.path) as input:
+                    for line in input:
+                        fields = line.split()
+                        if line.endswith("\n") and len(fields) >= 2 and fields[1].isdigit():
+                            self._entries[fields[0]] = (int(fields[1]), fields[2:])
+        
+        return self._entries
+
+
 class GitStorageHistory(object):
     def __init__(self, repodir, storage_root_subdir=os.curdir):
+        self.repodir = repodir
         self.repo = Repo(repodir)
         self.storage_root_subdir = storage_root_subdir
+        self.trees = LRUCache(TreeCacheSize)
+        self.commits = CommitIndex(self.repo, self.control_path(CommitIndexFile))
+    
+    def __getstate__(self):
+        # Passed to other processes by location, so that each opens the repository itself
+        return (self.repodir, self.storage_root_subdir)
+    
+    def __setstate__(self, state):
+        self.__init__(*state)
     
     def __getitem__(self, commit_sha):
         commit = self.repo.commit(commit_sha)
-        tree = self.repo.tree(commit.tree)
-        return GitTreeStorage(self.repo, tree, self.storage_root_subdir)
+        tree = self.trees.get(commit.tree, partial(self.repo.tree, commit.tree))
+        return GitTreeStorage(self.repo, tree, self.storage_root_subdir, self.trees)
+    
+    def control_path(self, name):
+        "Returns the path of a file that deft keeps in the repository's control directory"
+        return os.path.join(self.repo.controldir(), name)
     
     @property
     def latest_revision(self):
         return self.repo.head()
     
-    def eod_revisions(self, max_revision=None):
+    def walk(self, max_revision=None, since=None):
+        """
+        Yields the SHA-1 and commit time of each commit reachable from
+        max_revision once, newest first.  If since is given, stops at the first
+        commit made before that date.
+        """
         if max_revision is None:
             max_revision = self.latest_revision
         
-        results = {}
-        commit_shas = set([max_revision])
+        commit_time, parents = self.commits[max_revision]
+        pending = [(-commit_time, max_revision, parents)]
+        seen = set([max_revision])
         
-        while commit_shas:
-            commit_sha = commit_shas.pop()
-            commit = self.repo.commit(commit_sha)
-            commit_date = date_of(commit)
-            
-            commit_info = (time_of(commit), commit_sha)
-            
-            if commit_date in results:
-                results[commit_date] = max(results[commit_date], commit_info)
-            else:
-                results[commit_date] = commit_info
-            
-            commit_shas.update(commit.parents)
+        try:
+            while pending:
+                negated_commit_time, commit_sha, parents = heappop(pending)
+                if since is not None and date.fromtimestamp(-negated_commit_time) < since:
+                    break
+                
+                yield commit_sha, -negated_commit_time
+                
+                for parent_sha in parents:
+                    if parent_sha not in seen:
+                        seen.add(parent_sha)
+                        parent_time, grandparents = self.commits[parent_sha]
+                        heappush(pending, (-parent_time, parent_sha, grandparents))
+        finally:
+            self.commits.save()
+    
+    def eod_revisions(self, max_revision=None, since=None):
+        """
+        Returns a dict that maps each date on which a commit reachable from
+        max_revision was made, on or after since if given, to the last commit
+        made on that date.
+        """
+        results = {}
+        for commit_sha, commit_time in self.walk(max_revision, since):
+            commit_date = date.fromtimestamp(commit_time)
+            results[commit_date] = max(results.get(commit_date, (commit_time, commit_sha)), 
+                                       (commit_time, commit_sha))
         
         return dict((date, sha) for (date, (time, sha)) in results.iteritems())
 
 
 
 class GitTreeStorage(object):
-    def __init__(self, repo, tree, storage_root_subdir):
+    """
+    A read-only view of the files in a Git tree.
+    
+    Each directory is decoded once, when first used, into a flat map from paths
+    to the modes and SHA-1s of their entries.  Decoded trees are also cached by
+    SHA-1, in a cache that can be shared between the storages of different
+    commits, because most directories do not change from one commit to the next.
+    """
+    
+    def __init__(self, repo, tree, storage_root_subdir, trees=None):
         self.repo = repo
         self.tree = tree
         self.storage_root_subdir = storage_root_subdir
+        self._trees = trees if trees is not None else LRUCache(TreeCacheSize)
+        self._entries = {os.curdir: (stat.S_IFDIR, tree.id)}
+        self._listings = {}
     
     def abspath(self, relpath):
         if self.storage_root_subdir == os.curdir:
@@ -74,57 +187,87 @@ class GitTreeStorage(object):
             return os.path.join(self.storage_root_subdir, relpath)
     
     def exists(self, relpath):
-        return self._resolve_path(relpath) is not None
+        return self._entry(self._repo_path(relpath)) is not None
     
     def isdir(self, relpath):
-        return type(self._resolve_path(relpath)) == Tree
+        entry = self._entry(self._repo_path(relpath))
+        return entry is not None and stat.S_ISDIR(entry[0])
     
     def list(self, relpattern):
         "Note: partial implementation, just enough for the FeatureTracker"
         
         parent_path = os.path.dirname(relpattern)
         file_pattern = os.path.basename(relpattern)
-        parent = self._resolve_path(parent_path)
+        names = self._listing(self._repo_path(parent_path))
         
-        if parent is None:
+        if names is None:
             return []
         else:
-            return [os.path.join(parent_path, name) 
-                    for (name, mode, sha) in parent.iteritems() 
-                    if fnmatch(name, file_pattern)]
+            return [os.path.join(parent_path, name) for name in names if fnmatch(name, file_pattern)]
+    
+    def object_id(self, relpath):
+        """
+        Returns the SHA-1 of the blob or tree at relpath, or None if there is
+        nothing there.  Files or directories with the same ID have the same content.
+        """
+        entry = self._entry(self._repo_path(relpath))
+        return entry[1] if entry is not None else None
     
     def open(self, relpath, mode="r"):
         if mode != "r":
             raise ValueError("Git storage is read-only")
         
-        f = self._resolve_path(relpath)
-        if type(f) == Blob:
-            return MemoryIO(content=f.data)
-        else:
+        entry = self._entry(self._repo_path(relpath))
+        if entry is None:
+            raise IOError(self.abspath(relpath) + " does not exist")
+        elif stat.S_ISDIR(entry[0]):
             raise IOError(self.abspath(relpath) + " is a directory")
+        else:
+            return MemoryIO(content=self.repo.get_blob(entry[1]).data)
     
-    def _resolve_path(self, relpath):
-        f = self.tree
-        f_is_tree = True
+    def read_many(self, relpaths):
+        """
+        Looks up all the paths in the decoded directories before reading any
+        blobs, and reads each distinct blob once, however many paths refer to it
+        """
+        shas = {}
+        for relpath in relpaths:
+            entry = self._entry(self._repo_path(relpath))
+            if entry is not None and not stat.S_ISDIR(entry[0]):
+                shas[relpath] = entry[1]
         
-        for e in self._split_path(self.abspath(relpath)):
-            if not (type(f) is Tree and e in f):
-                return None
-            
-            f = self._resolve(f, e)
+        blobs = dict((sha, self.repo.get_blob(sha).data) for sha in set(shas.itervalues()))
+        return dict((relpath, blobs[sha]) for (relpath, sha) in shas.iteritems())
+    
+    def _repo_path(self, relpath):
+        return os.path.normpath(self.abspath(relpath))
+    
+    def _entry(self, path):
+        "Returns the mode and SHA-1 of the entry at a path in the repository, or None"
+        if path not in self._entries:
+            parent = os.path.dirname(path) or os.curdir
+            if parent != path:
+                self._listing(parent)
+            self._entries.setdefault(path, None)
         
-        return f
+        return self._entries[path]
     
-    def _resolve(self, tree, name):
-        mode, sha = tree[name]
-        is_tree = mode & stat.S_IFDIR
-        if is_tree:
-            return self.repo.tree(sha)
-        else:
-            return self.repo.get_blob(sha)
+    def _listing(self, path):
+        "Returns the names of the entries of the directory at a path in the repository, or None"
+        if path not in self._listings:
+            entry = self._entry(path)
+            if entry is not None and stat.S_ISDIR(entry[0]):
+                listing = self._decode(self._trees.get(entry[1], partial(self.repo.tree, entry[1])))
+                for name, mode_and_sha in listing.iteritems():
+                    self._entries[os.path.join(path, name) if path != os.curdir else name] = mode_and_sha
+                self._listings[path] = listing
+            else:
+                self._listings[path] = None
+        
+        return self._listings[path]
     
-    def _split_path(self, relpath):
-        return self.abspath(relpath).split(os.sep)
+    def _decode(self, tree):
+        return OrderedDict((name, (mode, sha)) for (name, mode, sha) in tree.iteritems())
     
 
 
@@ -1,6 +1,9 @@
 
 import os
 from datetime import date
+from dulwich.repo import Repo
+from dulwich.objects import Blob, Tree, Commit
+from deft.fileops import *
 from deft.formats import YamlFormat
 from deft.storage.git import GitStorageHistory
 from nose.plugins.attrib import attr
@@ -11,6 +14,171 @@ def format_version(storage):
     with storage.open(".deft/config") as input:
         return YamlFormat.load(input)["format"]
 
+def write_tree(repo, files):
+    "files maps paths, separated by slashes, to file contents"
+    tree = Tree()
+    subdirs = {}
+    for path, content in files.items():
+        name, _, subpath = path.partition("/")
+        if subpath:
+            subdirs.setdefault(name, {})[subpath] = content
+        else:
+            blob = Blob.from_string(content)
+            repo.object_store.add_object(blob)
+            tree.add(name, 0100644, blob.id)
+    
+    for name, subdir_files in subdirs.items():
+        tree.add(name, 040000, write_tree(repo, subdir_files).id)
+    
+    repo.object_store.add_object(tree)
+    return tree
+
+def commit_files(repo, files, parents=[], commit_time=1300000000):
+    commit = Commit()
+    commit.tree = write_tree(repo, files).id
+    commit.parents = parents
+    commit.author = commit.committer = "Tester <tester@example.com>"
+    commit.author_time = commit.commit_time = commit_time
+    commit.author_timezone = commit.commit_timezone = 0
+    commit.message = "test commit"
+    repo.object_store.add_object(commit)
+    repo.refs["refs/heads/master"] = commit.id
+    return commit.id
+
+
+@attr("fileio")
+class GitTreeStorage_Tests:
+    def setup(self):
+        self.repodir = os.path.join("output", "testing", self.__class__.__name__.lower(), str(id(self)))
+        ensure_empty_dir_exists(self.repodir)
+        self.repo = Repo.init(self.repodir)
+        self.history = GitStorageHistory(self.repodir)
+    
+    def test_reads_files_and_directories_of_a_commit(self):
+        storage = self.history[commit_files(self.repo, {
+            "a": "a-content",
+            "d/b": "b-content",
+            "d/e/c": "c-content"})]
+        
+        assert_that(storage.open("a").read(), equal_to("a-content"))
+        assert_that(storage.open("d/e/c").read(), equal_to("c-content"))
+        assert_that(storage.exists("d/b"), equal_to(True))
+        assert_that(storage.exists("d/x"), equal_to(False))
+        assert_that(storage.exists("a/x"), equal_to(False))
+        assert_that(storage.isdir("d/e"), equal_to(True))
+        assert_that(storage.isdir("d/b"), equal_to(False))
+        assert_that(storage.list("*"), equal_to(["a", "d"]))
+        assert_that(storage.list("d/*"), equal_to(["d/b", "d/e"]))
+        assert_that(storage.list("x/*"), equal_to([]))
+    
+    def test_raises_ioerror_when_opening_directory_or_nonexistent_file(self):
+        storage = self.history[commit_files(self.repo, {"d/b": "b-content"})]
+        
+        assert_that(calling(storage.open).with_args("d"), raises(IOError))
+        assert_that(calling(storage.open).with_args("d/x"), raises(IOError))
+    
+    def test_can_read_many_files_at_once(self):
+        storage = self.history[commit_files(self.repo, {
+            "d/a": "same-content",
+            "d/b": "same-content",
+            "e/c": "c-content"})]
+        
+        assert_that(storage.read_many(["d/a", "d/b", "e/c", "d/x", "e"]), equal_to(
+                {"d/a": "same-content", "d/b": "same-content", "e/c": "c-content"}))
+    
+    def test_decodes_each_directory_once(self):
+        storage = self.history[commit_files(self.repo, dict(("d/e/f%i" % i, "content") for i in range(10)))]
+        
+        for i in range(10):
+            storage.exists("d/e/f%i" % i)
+            storage.isdir("d/e/f%i" % i)
+            storage.open("d/e/f%i" % i).read()
+            storage.list("d/e/*")
+        
+        # The root tree and the trees of d and d/e
+        assert_that(self.history.trees.misses, equal_to(3))
+    
+    def test_shares_decoded_trees_between_commits(self):
+        files = dict(("d/e/f%i" % i, "content") for i in range(10))
+        first = commit_files(self.repo, files)
+        
+        files["g"] = "new-content"
+        second = commit_files(self.repo, files, parents=[first])
+        
+        self.history[first].list("d/e/*")
+        self.history[second].list("d/e/*")
+        
+        # The root trees of both commits and the unchanged trees of d and d/e
+        assert_that(self.history.trees.misses, equal_to(4))
+
+
+@attr("fileio")
+class GitStorageHistory_Walk_Tests:
+    def setup(self):
+        self.repodir = os.path.join("output", "testing", self.__class__.__name__.lower(), str(id(self)))
+        ensure_empty_dir_exists(self.repodir)
+        self.repo = Repo.init(self.repodir)
+    
+    def commit_diamonds(self, count, start_time=1300000000, interval=3600):
+        """
+        Commits a history in which each commit is merged from two branches off the
+        one before, which is exponentially expensive to walk without remembering
+        which commits have been visited
+        """
+        commit_time = start_time
+        head = commit_files(self.repo, {"f": "0"}, commit_time=commit_time)
+        commit_shas = [head]
+        
+        for i in range(count):
+            left = commit_files(self.repo, {"f": "left %i" % i}, [head], commit_time + interval)
+            right = commit_files(self.repo, {"f": "right %i" % i}, [head], commit_time + interval*2)
+            head = commit_files(self.repo, {"f": "merge %i" % i}, [left, right], commit_time + interval*3)
+            commit_time += interval*3
+            commit_shas.extend([left, right, head])
+        
+        return commit_shas
+    
+    def test_visits_each_commit_once_newest_first(self):
+        commit_shas = self.commit_diamonds(40)
+        history = GitStorageHistory(self.repodir)
+        
+        walked = [commit_sha for (commit_sha, commit_time) in history.walk()]
+        
+        assert_that(walked, equal_to(list(reversed(commit_shas))))
+        assert_that(history.commits.misses, equal_to(len(commit_shas)))
+    
+    def test_maps_dates_to_last_commit_of_the_day(self):
+        day = 24*3600
+        commit_shas = self.commit_diamonds(4, interval=day/4)
+        
+        date_index = GitStorageHistory(self.repodir).eod_revisions()
+        
+        commit_dates = [date.fromtimestamp(self.repo.commit(sha).commit_time) for sha in commit_shas]
+        expected = {}
+        for commit_date, commit_sha in zip(commit_dates, commit_shas):
+            expected[commit_date] = commit_sha
+        assert_that(date_index, equal_to(expected))
+    
+    def test_stops_walking_at_commits_made_before_since_date(self):
+        day = 24*3600
+        commit_shas = self.commit_diamonds(10, interval=day)
+        history = GitStorageHistory(self.repodir)
+        since = date.fromtimestamp(self.repo.commit(commit_shas[-6]).commit_time)
+        
+        date_index = history.eod_revisions(since=since)
+        
+        assert_that(sorted(date_index.values()), equal_to(sorted(commit_shas[-6:])))
+        assert_that(history.commits.misses, less_than(len(commit_shas)))
+    
+    def test_saves_commit_index_for_later_walks(self):
+        self.commit_diamonds(10)
+        expected = GitStorageHistory(self.repodir).eod_revisions()
+        
+        history = GitStorageHistory(self.repodir)
+        assert_that(history.eod_revisions(), equal_to(expected))
+        assert_that(history.commits.misses, equal_to(0))
+
+
 @attr("fileio")
 class GitStorageHistory_Tests:
     """
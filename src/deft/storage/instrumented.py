@@ -0,0 +1,209 @@
+"""
+Counting and timing the operations performed on a storage.
+
+InstrumentedStorage wraps any storage and records in an IOStats the number of
+calls made to each storage operation, their wall-clock time and the bytes
+read and written through the files that they open.  Calls are also recorded
+by path pattern -- the directory and extension of a path, or the pattern
+passed to list -- so that the summary shows which of the tracker's files the
+time is spent on.
+
+The time recorded for opening a file includes the time spent reading,
+writing and closing it, but not the time spent between those calls.
+"""
+
+import os
+from functools import partial
+from bisect import bisect_left
+from timeit import default_timer as now
+
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+LatencyBuckets = [1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0]
+
+# Optional storage operations that are instrumented if the storage supports them
+OptionalOperations = ["stat", "sync"]
+BatchOperations = ["read_many", "read_first_lines", "stat_many"]
+
+
+def path_pattern(relpath):
+    dirpath, name = os.path.split(relpath)
+    return os.path.join(dirpath, "*" + os.path.splitext(name)[1])
+
+
+def batch_pattern(relpaths):
+    return ", ".join(sorted(set(path_pattern(p) for p in relpaths)))
+
+
+def format_latency(seconds):
+    if seconds < 1e-3:
+        return "%ius" % round(seconds*1e6)
+    elif seconds < 1:
+        return "%ims" % round(seconds*1e3)
+    else:
+        return "%is" % round(seconds)
+
+
+class OperationStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.histogram = [0] * (len(LatencyBuckets) + 1)
+
+    def record(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        self.histogram[bisect_left(LatencyBuckets, seconds)] += 1
+
+
+class IOStats(object):
+    def __init__(self):
+        self.operations = {}
+        self.patterns = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def record(self, operation, pattern, seconds):
+        self.operations.setdefault(operation, OperationStats()).record(seconds)
+        self.patterns.setdefault((pattern, operation), OperationStats()).record(seconds)
+
+    def calls(self, operation):
+        return self.operations[operation].calls if operation in self.operations else 0
+
+    def write_summary(self, output):
+        bucket_headers = ["<" + format_latency(b) for b in LatencyBuckets] + [">=" + format_latency(LatencyBuckets[-1])]
+
+        output.write("%-10s %8s %10s %9s" % ("operation", "calls", "total ms", "mean ms"))
+        output.write("".join(" %7s" % h for h in bucket_headers))
+        output.write("\n")
+        for operation, stats in sorted(self.operations.items()):
+            output.write("%-10s %8i %10.2f %9.3f" % (operation, stats.calls, stats.seconds*1e3,
+                                                     stats.seconds*1e3/stats.calls))
+            output.write("".join(" %7i" % n for n in stats.histogram))
+            output.write("\n")
+
+        output.write("\nbytes read: %i, bytes written: %i\n\n" % (self.bytes_read, self.bytes_written))
+
+        output.write("%-50s %-10s %8s %10s\n" % ("path pattern", "operation", "calls", "total ms"))
+        by_time = sorted(self.patterns.items(), key=lambda (key, stats): (-stats.seconds, key))
+        for (pattern, operation), stats in by_time:
+            output.write("%-50s %-10s %8i %10.2f\n" % (pattern, operation, stats.calls, stats.seconds*1e3))
+
+
+class InstrumentedStorage(object):
+    def __init__(self, storage, stats):
+        self.storage = storage
+        self.stats = stats
+
+    def __getattr__(self, name):
+        attribute = getattr(self.storage, name)
+        if name in OptionalOperations:
+            return lambda *args: self._timed(name, path_pattern(args[0]) if args else "", attribute, *args)
+        elif name in BatchOperations:
+            return partial(self._batch, name, attribute)
+        else:
+            return attribute
+
+    def exists(self, relpath):
+        return self._timed("exists", path_pattern(relpath), self.storage.exists, relpath)
+
+    def isdir(self, relpath):
+        return self._timed("isdir", path_pattern(relpath), self.storage.isdir, relpath)
+
+    def list(self, relpattern):
+        return self._timed("list", relpattern, self.storage.list, relpattern)
+
+    def makedirs(self, relpath):
+        return self._timed("makedirs", relpath, self.storage.makedirs, relpath)
+
+    def rename(self, from_relpath, to_relpath):
+        return self._timed("rename", path_pattern(from_relpath), self.storage.rename, from_relpath, to_relpath)
+
+    def remove(self, relpath):
+        return self._timed("remove", path_pattern(relpath), self.storage.remove, relpath)
+
+    def open(self, relpath, mode="r"):
+        pattern = path_pattern(relpath)
+        start = now()
+        try:
+            f = self.storage.open(relpath, mode)
+        except:
+            self.stats.record("open", pattern, now() - start)
+            raise
+
+        return InstrumentedFile(f, self.stats, pattern, now() - start)
+
+    def _batch(self, operation, function, relpaths, *args):
+        relpaths = list(relpaths)
+        results = self._timed(operation, batch_pattern(relpaths), function, relpaths, *args)
+        if operation != "stat_many":
+            self.stats.bytes_read += sum(len(data) for data in results.itervalues())
+        return results
+
+    def _timed(self, operation, pattern, function, *args):
+        start = now()
+        try:
+            return function(*args)
+        finally:
+            self.stats.record(operation, pattern, now() - start)
+
+
+class InstrumentedFile(object):
+    def __init__(self, file, stats, pattern, seconds):
+        self.file = file
+        self.stats = stats
+        self.pattern = pattern
+        self.seconds = seconds
+        self.closed = False
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._read(self.file.next)
+
+    def read(self, *args):
+        return self._read(self.file.read, *args)
+
+    def readline(self, *args):
+        return self._read(self.file.readline, *args)
+
+    def readlines(self, *args):
+        lines = self._timed(self.file.readlines, *args)
+        self.stats.bytes_read += sum(len(l) for l in lines)
+        return lines
+
+    def write(self, data):
+        self._timed(self.file.write, data)
+        self.stats.bytes_written += len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._timed(self.file.close)
+            self.stats.record("open", self.pattern, self.seconds)
+
+    def _read(self, function, *args):
+        data = self._timed(function, *args)
+        self.stats.bytes_read += len(data)
+        return data
+
+    def _timed(self, function, *args):
+        start = now()
+        try:
+            return function(*args)
+        finally:
+            self.seconds += now() - start
@@ -0,0 +1,105 @@
+
+import os
+from StringIO import StringIO
+from deft.storage import read_first_line_each
+from deft.storage.instrumented import InstrumentedStorage, IOStats, path_pattern
+from deft.storage.memory import MemStorage
+from deft.storage.contract import TransientStorageContract
+from hamcrest import *
+
+
+def test_path_pattern_is_directory_and_extension_of_path():
+    assert_that(path_pattern("a/b/feature.description"), equal_to("a/b/*.description"))
+    assert_that(path_pattern("a/b/feature.properties.yaml"), equal_to("a/b/*.yaml"))
+    assert_that(path_pattern("config"), equal_to("*"))
+
+
+class InstrumentedStorage_Test(TransientStorageContract):
+    def setup(self):
+        self.testdir = "testdir"
+        self.stats = IOStats()
+        self.storage = self.create_storage()
+    
+    def create_storage(self, basedir=None):
+        return InstrumentedStorage(MemStorage(self.testdir if basedir is None else basedir), self.stats)
+    
+    # InstrumentedStorage-specific behaviour
+    
+    def test_counts_calls_to_each_operation(self):
+        self.given_file("a/x")
+        self.storage.exists("a/x")
+        self.storage.exists("a/y")
+        self.storage.isdir("a")
+        self.storage.list("a/*")
+        self.storage.rename("a/x", "a/z")
+        self.storage.remove("a/z")
+        
+        assert_that(self.stats.calls("open"), equal_to(1))
+        assert_that(self.stats.calls("exists"), equal_to(2))
+        assert_that(self.stats.calls("isdir"), equal_to(1))
+        assert_that(self.stats.calls("list"), equal_to(1))
+        assert_that(self.stats.calls("rename"), equal_to(1))
+        assert_that(self.stats.calls("remove"), equal_to(1))
+    
+    def test_counts_bytes_read_and_written(self):
+        self.given_file("x", content="0123456789")
+        
+        with self.storage.open("x") as input:
+            input.read(4)
+        with self.storage.open("x") as input:
+            list(input)
+        
+        assert_that(self.stats.bytes_written, equal_to(10))
+        assert_that(self.stats.bytes_read, equal_to(14))
+    
+    def test_times_batch_reads_if_underlying_storage_can_make_them(self):
+        storage = InstrumentedStorage(FirstLineReadingStorage(self.testdir), self.stats)
+        for name in ["x", "y"]:
+            with storage.open(name, "w") as output:
+                output.write(name + "-first\n" + name + "-second\n")
+        
+        first_lines = storage.read_first_lines(["x", "y"], 100)
+        
+        assert_that(first_lines, equal_to({"x": "x-first\n", "y": "y-first\n"}))
+        assert_that(self.stats.calls("read_first_lines"), equal_to(1))
+        assert_that(self.stats.bytes_read, equal_to(16))
+    
+    def test_records_calls_by_path_pattern(self):
+        for name in ["a", "b", "c"]:
+            self.given_file(os.path.join("features", name + ".description"))
+        self.storage.exists(os.path.join("features", "a.description"))
+        
+        assert_that(self.stats.patterns[("features/*.description", "open")].calls, equal_to(3))
+        assert_that(self.stats.patterns[("features/*.description", "exists")].calls, equal_to(1))
+    
+    def test_counts_failed_operations(self):
+        try:
+            self.storage.open("nonexistent")
+        except IOError:
+            pass
+        
+        assert_that(self.stats.calls("open"), equal_to(1))
+    
+    def test_only_provides_optional_operations_of_the_underlying_storage(self):
+        self.given_file("x", content="12345")
+        
+        assert_that(self.storage.stat("x")[1], equal_to(5))
+        assert_that(self.stats.calls("stat"), equal_to(1))
+        assert_that(hasattr(self.storage, "sync"), equal_to(False))
+    
+    def test_writes_summary_of_operations(self):
+        self.given_file("x")
+        self.storage.exists("x")
+        
+        output = StringIO()
+        self.stats.write_summary(output)
+        
+        summary = output.getvalue()
+        assert_that(summary, contains_string("bytes read: 0, bytes written: 7"))
+        assert_that([line.split()[:2] for line in summary.splitlines()[1:3]],
+                    equal_to([["exists", "1"], ["open", "1"]]))
+
+
+class FirstLineReadingStorage(MemStorage):
+    def read_first_lines(self, relpaths, max_bytes):
+        return read_first_line_each(self, relpaths, max_bytes)
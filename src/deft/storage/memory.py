@@ -4,6 +4,7 @@ from StringIO import StringIO
 import os
 from fnmatch import fnmatch
 from contextlib import contextmanager
+from deft.storage.snapshot import has_magic
 
 
 def read_only_save_callback(data):
@@ -11,9 +12,11 @@ def read_only_save_callback(data):
 
 
 class MemoryIO(StringIO):
-    def __init__(self, content="", save_callback=read_only_save_callback):
+    def __init__(self, content="", save_callback=read_only_save_callback, append=False):
         StringIO.__init__(self, content)
         self._save_callback = save_callback
+        if append:
+            self.seek(0, os.SEEK_END)
     
     def close(self):
         self._save_callback(self.getvalue())
@@ -34,7 +37,11 @@ class MemStorage(object):
         self.basedir = basedir
         self.readonly = readonly
         self.files = {}
+        self._children = {}
         self.read_counts = {}
+        self.write_counts = {}
+        self.mtimes = {}
+        self._clock = 0
     
     def abspath(self, relpath):
         return os.path.normpath(os.path.join(self.basedir, relpath))
@@ -45,15 +52,23 @@ class MemStorage(object):
         return os.path.relpath(norm_abspath, norm_basedir)
     
     def isdir(self, relpath):
-        # A hack-job: should model directories properly
-        return len(self.list(os.path.join(relpath, "*"))) != 0
+        return relpath in self.files and self.files[relpath] is None
     
     def read_count(self, relpath):
         return self.read_counts.get(relpath, 0)
     
+    def write_count(self, relpath):
+        return self.write_counts.get(relpath, 0)
+    
     def exists(self, relpath):
         return relpath in self.files 
     
+    def stat(self, relpath):
+        if not self.exists(relpath):
+            raise IOError(relpath + " does not exist")
+        
+        return (self.mtimes.get(relpath, 0), len(self.files[relpath] or ""))
+    
     def open(self, relpath, mode="r"):
         if relpath in self.files and self.files[relpath] is None:
             raise IOError(relpath + " is a directory")
@@ -62,8 +77,10 @@ class MemStorage(object):
             return self._open_read(relpath)
         elif mode == "w":
             return self._open_write(relpath)
+        elif mode == "a":
+            return self._open_write(relpath, initial_content=self.files.get(relpath) or "")
         else:
-            raise ValueError("mode must be 'r' or 'w', was: " + mode)
+            raise ValueError("mode must be 'r', 'w' or 'a', was: " + mode)
     
     def _open_read(self, relpath):
         if not self.exists(relpath):
@@ -76,17 +93,25 @@ class MemStorage(object):
         
         return MemoryIO(content=self.files[relpath])
     
-    def _open_write(self, relpath):
+    def _open_write(self, relpath, initial_content=None):
         self._check_can_write("write", relpath)
         
         def store_data(data):
-            self.files[relpath] = data
+            is_new = relpath not in self.files
+            self._add(relpath, data)
+            self.write_counts[relpath] = self.write_counts.get(relpath, 0) + 1
+            self._touch(relpath, parent=is_new)
         
         self.makedirs(os.path.dirname(relpath))
         
-        return MemoryIO(save_callback=store_data)
+        if initial_content is None:
+            return MemoryIO(save_callback=store_data)
+        else:
+            return MemoryIO(initial_content, save_callback=store_data, append=True)
     
     def rename(self, relpath, newpath):
+        self._check_can_write("rename", relpath)
+        
         if not relpath in self.files:
             raise IOError(relpath + " does not exist")
         
@@ -96,35 +121,72 @@ class MemStorage(object):
         if self.isdir(relpath):
             raise IOError(relpath + " is a directory")
         
-        data = self.files.pop(relpath)
+        data = self.files[relpath]
+        mtime = self.mtimes.get(relpath, 0)
+        self._discard(relpath)
         self.makedirs(os.path.dirname(newpath))
-        self.files[newpath] = data
+        self._add(newpath, data)
+        self.mtimes[newpath] = mtime
+        self._touch(os.path.dirname(relpath))
+        self._touch(os.path.dirname(newpath))
         
     def remove(self, relpath):
         self._check_can_write("remove", relpath)
         
-        for subpath in self.list(os.path.join(relpath, "*")):
-            self.files.pop(subpath, None)
-        self.files.pop(relpath, None)
+        if relpath in self.files:
+            self._discard(relpath)
+            self._touch(os.path.dirname(relpath))
     
     def list(self, relpattern):
-        part_patterns = relpattern.split(os.path.sep)
-        
-        def parts_match(parts):
-            return len(parts) == len(part_patterns) \
-                and all([fnmatch(*pair) for pair in zip(parts, part_patterns)])
-        
-        def relpath_matches(relpath):
-            return parts_match(relpath.split(os.path.sep))
-        
-        return sorted(filter(relpath_matches, self.files.keys()))
+        matches = [""]
+        for part in relpattern.split(os.path.sep):
+            next_matches = []
+            for match in matches:
+                names = self._children.get(match, ())
+                if has_magic(part):
+                    names = [n for n in names if fnmatch(n, part)]
+                elif part in names:
+                    names = [part]
+                else:
+                    names = []
+                next_matches.extend(os.path.join(match, n) for n in names)
+            matches = next_matches
+        
+        return sorted(matches)
     
     def makedirs(self, relpath):
         self._check_can_write("make directory", relpath)
         
         if relpath != "":
             self.makedirs(os.path.dirname(relpath))
-            self.files[relpath] = None
+            is_new = relpath not in self.files
+            self._add(relpath, None)
+            if is_new:
+                self._touch(relpath, parent=True)
+    
+    def _add(self, relpath, data):
+        if relpath not in self.files:
+            dirpath, name = os.path.split(relpath)
+            self._children.setdefault(dirpath, set()).add(name)
+        self.files[relpath] = data
+    
+    def _discard(self, relpath):
+        dirpath, name = os.path.split(relpath)
+        self._children[dirpath].discard(name)
+        self._discard_tree(relpath)
+    
+    def _discard_tree(self, relpath):
+        for name in self._children.pop(relpath, ()):
+            self._discard_tree(os.path.join(relpath, name))
+        del self.files[relpath]
+        self.mtimes.pop(relpath, None)
+    
+    def _touch(self, relpath, parent=False):
+        # Mimics the file system: adding or removing an entry modifies its directory
+        self._clock += 1
+        self.mtimes[relpath] = self._clock
+        if parent:
+            self._touch(os.path.dirname(relpath))
     
     def _check_can_write(self, action, relpath):
         if self.readonly:
@@ -1,6 +1,8 @@
 
 
 import os
+import errno
+from deft.storage import read_many
 from deft.storage.memory import MemStorage, MemoryIO
 from deft.storage.contract import TransientStorageContract, ReadOnlyStorageContract
 from hamcrest import *
@@ -42,6 +44,56 @@ class MemStorage_Test(TransientStorageContract):
         assert_that(MemStorage("").relpath("x/y"), equal_to("x/y"))
         assert_that(MemStorage(".").relpath("x/y"), equal_to("x/y"))
     
+    def test_reports_size_of_files(self):
+        self.given_file("example-file", content="12345")
+        
+        assert_that(self.storage.stat("example-file")[1], equal_to(5))
+    
+    def test_modification_time_changes_when_file_is_written(self):
+        self.given_file("example-file", content="original")
+        original_mtime = self.storage.stat("example-file")[0]
+        
+        self.given_file("example-file", content="replacement")
+        
+        assert_that(self.storage.stat("example-file")[0], greater_than(original_mtime))
+    
+    def test_modification_time_of_directory_changes_when_entries_are_added_or_removed(self):
+        self.given_file("dir/a")
+        
+        mtime_before_adding = self.storage.stat("dir")[0]
+        self.given_file("dir/b")
+        assert_that(self.storage.stat("dir")[0], greater_than(mtime_before_adding))
+        
+        mtime_before_rewriting = self.storage.stat("dir")[0]
+        self.given_file("dir/b", content="changed")
+        assert_that(self.storage.stat("dir")[0], equal_to(mtime_before_rewriting))
+        
+        mtime_before_removing = self.storage.stat("dir")[0]
+        self.storage.remove("dir/a")
+        assert_that(self.storage.stat("dir")[0], greater_than(mtime_before_removing))
+        
+        mtime_before_renaming = self.storage.stat("dir")[0]
+        self.storage.rename("dir/b", "dir/c")
+        assert_that(self.storage.stat("dir")[0], greater_than(mtime_before_renaming))
+    
+    @raises(IOError)
+    def test_cannot_stat_nonexistent_files(self):
+        self.storage.stat("nonexistent-file")
+    
+    def test_reports_empty_directory_as_directory(self):
+        self.storage.makedirs("a/b")
+        
+        assert_that(self.storage.isdir("a/b"))
+        assert_that(self.storage.list("a/*"), equal_to(["a/b"]))
+    
+    def test_forgets_files_in_removed_directory_when_directory_is_made_again(self):
+        self.given_file("a/b/c")
+        self.storage.remove("a")
+        self.storage.makedirs("a")
+        
+        assert_that(self.storage.list("a/*"), equal_to([]))
+        assert_that(self.storage.exists("a/b/c"), equal_to(False))
+    
     
 class MemStorage_ReadOnly_Test(ReadOnlyStorageContract):
     def __init__(self):
@@ -85,3 +137,24 @@ class MemStorage_ReadOnly_Test(ReadOnlyStorageContract):
     @raises(IOError)
     def test_will_not_rename_nonexistent_files_when_in_read_only_mode(self):
         self.storage.rename("a/nonexistent/file", "another/name")
+
+
+class UnreadableFileStorage(MemStorage):
+    def open(self, relpath, mode="r"):
+        if relpath == "unreadable" and mode == "r":
+            raise IOError(errno.EACCES, "Permission denied", relpath)
+        return MemStorage.open(self, relpath, mode)
+
+
+class ReadMany_Test:
+    def test_reports_errors_reading_files_that_exist(self):
+        storage = UnreadableFileStorage()
+        for name in ["readable", "unreadable"]:
+            with storage.open(name, "w") as output:
+                output.write(name)
+        
+        try:
+            read_many(storage, ["readable", "unreadable", "missing"])
+            raise AssertionError("should have raised IOError")
+        except IOError as e:
+            assert_that(e.errno, equal_to(errno.EACCES))
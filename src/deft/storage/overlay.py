@@ -2,7 +2,9 @@
 import os
 from functools import partial
 from fnmatch import fnmatch
+from deft.storage import read_many
 from deft.storage.memory import MemoryIO
+from deft.storage.snapshot import has_magic
 
 
 def path_to_elts(relpath):
@@ -28,28 +30,22 @@ class Removal(object):
     
     exists = False
     isdir = False
+    replaces_underlay = False
     
-    def open(self, mode):
-        self.fail()
-    
-    def fail(self):
+    def open(self):
         raise IOError(self.relpath + " does not exist")
 
 
 class Addition(object):
-    def __init__(self, overlay, relpath, data):
-        self.overlay = overlay
-        self.relpath = relpath
+    def __init__(self, data):
         self.data = data
     
     exists = True
     isdir = False
+    replaces_underlay = False
     
-    def open(self, mode):
-        if mode == "r":
-            return MemoryIO(self.data)
-        else:
-            return MemoryIO(save_callback=partial(self.overlay._store, self.relpath))
+    def open(self):
+        return MemoryIO(self.data)
 
 
 class DirectoryAddition(object):
@@ -58,18 +54,20 @@ class DirectoryAddition(object):
     
     exists = True
     isdir = True
+    replaces_underlay = False
     
-    def open(self, mode):
-        raise IOError(relpath + " is a directory")
+    def open(self):
+        raise IOError(self.relpath + " is a directory")
 
 
 
 class UnderlyingFile(object):
     def __init__(self, overlay, relpath):
-        self.overlay = overlay
         self.underlay = overlay.underlay
         self.relpath = relpath
     
+    replaces_underlay = False
+    
     @property
     def exists(self):
         return self.underlay.exists(self.relpath)
@@ -78,17 +76,30 @@ class UnderlyingFile(object):
     def isdir(self):
         return self.underlay.isdir(self.relpath)
     
-    def open(self, mode):
-        if mode == "r":
-            return self.underlay.open(self.relpath, mode)
-        else:
-            return MemoryIO(save_callback=partial(self.overlay._store, self.relpath))
+    def open(self):
+        return self.underlay.open(self.relpath, "r")
+
+
+class DeltaNode(object):
+    """
+    The delta of a path, if it has been changed, and the nodes of the paths
+    below it, indexed by path element
+    """
+    
+    def __init__(self):
+        self.delta = None
+        self.children = {}
 
 
 class OverlayStorage(object):
+    """
+    Records changes to an underlying storage in memory, without changing it.
+    The changes can later be written to the underlying storage with flush.
+    """
+    
     def __init__(self, underlay):
         self.underlay = underlay
-        self._deltas = {}
+        self._root = DeltaNode()
     
     def abspath(self, relpath):
         return self.underlay.abspath(relpath)
@@ -97,67 +108,213 @@ class OverlayStorage(object):
         return self._ref(relpath).exists
     
     def isdir(self, relpath):
-        return self._delta_for(relpath).isdir
+        return self._ref(relpath).isdir
     
     def remove(self, relpath):
-        self._deltas[relpath] = Removal(relpath)
-        
-        subdirs_pattern = os.path.join(relpath, "*")
-        for deltapath in self._deltas:
-            if fnmatch(deltapath, subdirs_pattern):
-                del self._deltas[deltapath]
+        node = self._node(relpath, create=True)
+        node.delta = Removal(relpath)
+        node.children = {}
     
     def rename(self, from_relpath, to_relpath):
-        if not self.exists(from_relpath):
+        delta = self._ref(from_relpath)
+        
+        if not delta.exists:
             raise IOError(from_relpath + " does not exist")
         
-        if self.isdir(from_relpath):
+        if delta.isdir:
             raise IOError(from_relpath + " is a directory")
         
         if self.exists(to_relpath):
             raise IOError(to_relpath + " already exists")
         
         self._ensure_parent_dir_exists(to_relpath)
-        self._deltas[to_relpath] = self._delta_for(from_relpath)
+        if isinstance(delta, Addition):
+            self._set_delta(to_relpath, Addition(delta.data))
+        else:
+            self._set_delta(to_relpath, UnderlyingFile(self, delta.relpath))
         self.remove(from_relpath)
         
     def open(self, relpath, mode="r"):
-        if mode == "w":
+        if mode == "r":
+            return self._ref(relpath).open()
+        elif mode in ("w", "a"):
+            delta = self._ref(relpath)
             self._ensure_parent_dir_exists(relpath)
-        return self._delta_for(relpath).open(mode)
+            save = partial(self._store, relpath)
+            
+            if mode == "a" and delta.exists:
+                with delta.open() as input:
+                    return MemoryIO(input.read(), save_callback=save, append=True)
+            else:
+                return MemoryIO(save_callback=save)
+        else:
+            raise ValueError("mode must be 'r', 'w' or 'a', was: " + mode)
+    
+    def read_many(self, relpaths):
+        """
+        Reads files that have been written through the overlay from memory and
+        the rest from the underlying storage, in one batch
+        """
+        contents = {}
+        underlying = []
+        for relpath in relpaths:
+            delta = self._ref(relpath)
+            if isinstance(delta, Addition):
+                contents[relpath] = delta.data
+            elif isinstance(delta, UnderlyingFile):
+                underlying.append((relpath, delta.relpath))
+        
+        underlying_contents = read_many(self.underlay, [u for (relpath, u) in underlying])
+        for relpath, underlying_relpath in underlying:
+            if underlying_relpath in underlying_contents:
+                contents[relpath] = underlying_contents[underlying_relpath]
+        
+        return contents
     
     def _ensure_parent_dir_exists(self, relpath):
         self.makedirs(os.path.dirname(relpath))
     
     def list(self, relpattern):
         underlay_matches = self.underlay.list(relpattern)
-        overlay_matches = [relpath for relpath in self._deltas if fnmatch(relpath, relpattern)]
+        overlay_matches = self._matching_deltas(relpattern)
         
         all_matches = set(underlay_matches).union(set(overlay_matches))
         
         return [path for path in all_matches if self._ref(path).exists]
     
     def makedirs(self, relpath):
+        if relpath == "":
+            return
+        
         for subpath in walk(relpath):
-            d = self._delta_for(subpath)
+            d = self._ref(subpath)
             if not d.exists:
-                self._deltas[subpath] = DirectoryAddition(subpath)
+                self._set_delta(subpath, DirectoryAddition(subpath))
             elif not d.isdir:
                 raise IOError("cannot create directory " + relpath + ", " + subpath + " is a file")
     
-    def _ref(self, relpath):
-        for subpath in walk(relpath):
-            if not self._delta_for(subpath).exists:
-                return Removal(subpath)
-        return self._delta_for(relpath)
+    def flush(self):
+        """
+        Writes the changes recorded by the overlay to the underlying storage and
+        forgets them.  Only the net changes are written: a file that was written
+        several times through the overlay is written once.
+        
+        The changes are applied in the order: renamed files that would be
+        overwritten are moved aside, removed paths that have been replaced are
+        cleared, directories are made, files are written, files are renamed and
+        finally removed paths are removed.  If the underlying storage fails
+        part way through, it is left partly changed.
+        """
+        changes = list(self._changes())
+        
+        replaced = set(path for (path, delta) in changes if not isinstance(delta, Removal))
+        moves = []
+        for to_relpath, delta in changes:
+            if isinstance(delta, UnderlyingFile) and delta.relpath != to_relpath:
+                if any(subpath in replaced for subpath in walk(delta.relpath)):
+                    # Renamed from a path that is written to before renames are applied
+                    aside_relpath = ".overlay-flush-%i-%s" % (len(moves), os.path.basename(delta.relpath))
+                    self.underlay.rename(delta.relpath, aside_relpath)
+                    moves.append((aside_relpath, to_relpath))
+                else:
+                    moves.append((delta.relpath, to_relpath))
+        
+        for relpath, delta in changes:
+            if delta.replaces_underlay:
+                self.underlay.remove(relpath)
+        
+        for relpath, delta in changes:
+            if isinstance(delta, DirectoryAddition):
+                self.underlay.makedirs(relpath)
+        
+        for relpath, delta in changes:
+            if isinstance(delta, Addition):
+                with self.underlay.open(relpath, "w") as output:
+                    output.write(delta.data)
+        
+        for from_relpath, to_relpath in moves:
+            self.underlay.rename(from_relpath, to_relpath)
+        
+        for relpath, delta in changes:
+            if isinstance(delta, Removal):
+                self.underlay.remove(relpath)
+        
+        self._root = DeltaNode()
+        
+        if hasattr(self.underlay, "sync"):
+            self.underlay.sync()
+    
+    def _changes(self):
+        """
+        Yields the paths and deltas of the changes, parents before children
+        """
+        nodes = [("", self._root)]
+        while nodes:
+            path, node = nodes.pop()
+            if node.delta is not None:
+                yield path, node.delta
+            nodes.extend((os.path.join(path, name), child) for (name, child) in sorted(node.children.iteritems(), reverse=True))
     
-    def _delta_for(self, relpath):
-        if relpath in self._deltas:
-            return self._deltas[relpath]
+    def _ref(self, relpath):
+        """
+        Returns the delta that describes what is at a path
+        """
+        node = self._root
+        underlay_replaced = False
+        for elt in path_to_elts(relpath):
+            if node.delta is not None:
+                if not node.delta.isdir:
+                    return Removal(relpath)
+                underlay_replaced = underlay_replaced or node.delta.replaces_underlay
+            
+            node = node.children.get(elt)
+            if node is None:
+                break
+        
+        if node is not None and node.delta is not None:
+            return node.delta
+        elif underlay_replaced:
+            return Removal(relpath)
         else:
             return UnderlyingFile(self, relpath)
     
-    def _store(self, relpath, data):
-        self._deltas[relpath] = Addition(self, relpath, data)
+    def _matching_deltas(self, relpattern):
+        """
+        Returns the paths of the deltas that match a glob pattern, visiting
+        only the directories that the pattern can match
+        """
+        matches = [("", self._root)]
+        for elt in path_to_elts(relpattern):
+            if has_magic(elt):
+                matches = [(os.path.join(path, name), child)
+                           for (path, node) in matches
+                           for (name, child) in node.children.iteritems()
+                           if fnmatch(name, elt)]
+            else:
+                matches = [(os.path.join(path, elt), node.children[elt])
+                           for (path, node) in matches
+                           if elt in node.children]
+        
+        return [path for (path, node) in matches if node.delta is not None]
+    
+    def _node(self, relpath, create=False):
+        node = self._root
+        for elt in path_to_elts(relpath):
+            child = node.children.get(elt)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[elt] = DeltaNode()
+            node = child
+        return node
+    
+    def _set_delta(self, relpath, delta):
+        node = self._node(relpath, create=True)
+        if isinstance(node.delta, Removal) or (node.delta is not None and node.delta.replaces_underlay):
+            # What was removed from the underlying storage must be cleared before the delta is written to it
+            delta.replaces_underlay = True
+        node.delta = delta
     
-       
+    def _store(self, relpath, data):
+        self._set_delta(relpath, Addition(data))
+
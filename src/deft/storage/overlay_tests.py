@@ -3,6 +3,8 @@ import os
 from deft.storage.overlay import OverlayStorage, walk
 from deft.storage.memory import MemStorage
 from deft.storage.contract import TransientStorageContract
+from deft.tracker import init_with_storage, load_with_storage
+from deft.warn import IgnoreWarnings
 from hamcrest import *
 from nose.tools import raises
 
@@ -27,3 +29,154 @@ class OverlayStorage_Tests(TransientStorageContract):
             with underlay.open(relpath, "w") as output:
                 output.write(content)
     
+    def write(self, relpath, content):
+        with self.storage.open(relpath, "w") as output:
+            output.write(content)
+    
+    
+    # OverlayStorage-specific behaviour
+    
+    def test_lists_changed_files_only_in_directories_matched_by_pattern(self):
+        self.given_file("a/x", content="underlying")
+        self.storage.makedirs("a/b")
+        for name in ["y", "z.txt"]:
+            with self.storage.open(os.path.join("a", name), "w") as output:
+                output.write(name)
+        with self.storage.open(os.path.join("a", "b", "w"), "w") as output:
+            output.write("w")
+        
+        assert_that(sorted(self.storage.list("a/*")), equal_to(["a/b", "a/x", "a/y", "a/z.txt"]))
+        assert_that(sorted(self.storage.list("a/*.txt")), equal_to(["a/z.txt"]))
+        assert_that(sorted(self.storage.list("*/b/*")), equal_to(["a/b/w"]))
+    
+    def test_forgets_changes_within_removed_directory(self):
+        self.given_file("a/x", content="underlying")
+        with self.storage.open(os.path.join("a", "b", "y"), "w") as output:
+            output.write("y")
+        
+        self.storage.remove("a")
+        
+        assert_that(self.storage.exists("a/b/y"), equal_to(False))
+        assert_that(self.storage.exists("a/x"), equal_to(False))
+        assert_that(list(self.storage.list("a/*")), equal_to([]))
+        assert_that(list(self.storage.list("a/b/*")), equal_to([]))
+    
+    def test_reads_many_files_from_overlay_and_underlying_storage(self):
+        self.given_file("a/x", content="underlying-x")
+        self.given_file("a/y", content="underlying-y")
+        self.given_file("a/z", content="underlying-z")
+        
+        self.write("a/x", "changed-x")
+        self.storage.rename("a/y", "b/y")
+        self.storage.remove("a/z")
+        
+        assert_that(self.storage.read_many(["a/x", "a/y", "b/y", "a/z"]), equal_to(
+                {"a/x": "changed-x", "b/y": "underlying-y"}))
+    
+    def test_does_not_show_underlying_files_in_removed_directory_that_is_made_again(self):
+        self.given_file("a/x", content="underlying")
+        
+        self.storage.remove("a")
+        with self.storage.open(os.path.join("a", "z"), "w") as output:
+            output.write("z")
+        
+        assert_that(self.storage.list("a/*"), equal_to(["a/z"]))
+        assert_that(self.storage.exists("a/x"), equal_to(False))
+
+
+class OverlayStorageFlush_Tests:
+    def setup(self):
+        self.underlay = MemStorage()
+        self.storage = OverlayStorage(self.underlay)
+    
+    def given_file(self, relpath, content="testing"):
+        with self.underlay.open(relpath, "w") as output:
+            output.write(content)
+    
+    def write(self, relpath, content):
+        with self.storage.open(relpath, "w") as output:
+            output.write(content)
+    
+    def flushed_files(self):
+        self.storage.flush()
+        return dict((relpath, data) for (relpath, data) in self.underlay.files.items() if data is not None)
+    
+    def test_does_not_change_underlying_storage_until_flushed(self):
+        self.given_file("a/x", "x")
+        self.write("a/b/y", "y")
+        self.storage.remove("a/x")
+        
+        assert_that(self.underlay.files, equal_to({"a": None, "a/x": "x"}))
+        assert_that(self.flushed_files(), equal_to({"a/b/y": "y"}))
+        assert_that(self.underlay.isdir("a/b"))
+    
+    def test_writes_each_changed_file_once(self):
+        self.write("x", "1")
+        self.write("x", "2")
+        with self.storage.open("x", "a") as output:
+            output.write("3")
+        
+        assert_that(self.flushed_files(), equal_to({"x": "23"}))
+        assert_that(self.underlay.write_count("x"), equal_to(1))
+    
+    def test_forgets_changes_once_flushed(self):
+        self.write("x", "1")
+        self.storage.flush()
+        
+        self.underlay.remove("x")
+        
+        assert_that(self.storage.exists("x"), equal_to(False))
+    
+    def test_renames_underlying_files(self):
+        self.given_file("a/x", "x")
+        self.storage.rename("a/x", "b/y")
+        
+        assert_that(self.flushed_files(), equal_to({"b/y": "x"}))
+    
+    def test_renames_underlying_file_before_writing_new_file_in_its_place(self):
+        self.given_file("x", "old")
+        self.storage.rename("x", "y")
+        self.write("x", "new")
+        
+        assert_that(self.flushed_files(), equal_to({"x": "new", "y": "old"}))
+    
+    def test_can_swap_underlying_files(self):
+        self.given_file("a", "a")
+        self.given_file("b", "b")
+        self.storage.rename("a", "t")
+        self.storage.rename("b", "a")
+        self.storage.rename("t", "b")
+        
+        assert_that(self.flushed_files(), equal_to({"a": "b", "b": "a"}))
+    
+    def test_clears_removed_directory_that_is_made_again(self):
+        self.given_file("d/x", "x")
+        self.given_file("d/y", "y")
+        self.storage.remove("d")
+        self.write("d/z", "z")
+        
+        assert_that(self.flushed_files(), equal_to({"d/z": "z"}))
+    
+    def test_replaces_removed_file_with_directory(self):
+        self.given_file("d", "file")
+        self.storage.remove("d")
+        self.write("d/z", "z")
+        
+        assert_that(self.flushed_files(), equal_to({"d/z": "z"}))
+    
+    def test_writes_each_file_of_a_tracker_once_after_several_changes(self):
+        init_with_storage(self.underlay, IgnoreWarnings(), {})
+        
+        tracker = load_with_storage(self.storage, IgnoreWarnings())
+        for name in ["a", "b", "c"]:
+            tracker.create(name=name, status="new", description=name + " description")
+        tracker.feature_named("c").priority = 1
+        tracker.feature_named("a").status = "started"
+        tracker.save()
+        
+        self.storage.flush()
+        
+        assert_that(max(self.underlay.write_counts.values()), equal_to(1))
+        reloaded = load_with_storage(self.underlay, IgnoreWarnings())
+        assert_that([f.name for f in reloaded.features_with_status("new")], equal_to(["c", "b"]))
+        assert_that([f.name for f in reloaded.features_with_status("started")], equal_to(["a"]))
@@ -0,0 +1,550 @@
+"""
+Storage that keeps a whole directory tree in a single pack file.
+
+A tracker with tens of thousands of features has two files per feature, which
+makes the file system and version control slow.  A PackStorage stores the
+files in one pack file instead.
+
+The pack file starts with a header that holds the offset of the pack's offset
+table, followed by a sequence of records.  Each record is a type byte, the
+lengths of its two fields and the fields themselves:
+
+    F  path, content   a file was written
+    D  path            a directory was made
+    X  path            a file or directory tree was removed
+    M  old, new        a file was renamed
+    T  table           the offset table, mapping every file to the offset and
+                       length of its content and listing every directory
+
+Changes are appended to the end of the pack, so writing a file costs the same
+however large the pack is.  Opening a pack reads the offset table and replays
+the records that follow it.  Replay stops at the first incompletely written
+record, left behind if a process was interrupted, and later changes overwrite
+it.
+
+Several processes can use the same pack.  Each change is appended while
+holding an exclusive lock on the pack file, after replaying any records that
+other processes have appended since the storage last looked, so that no
+process overwrites another's changes.  Refreshing the storage replays those
+records without making a change.
+
+The content of files that have been overwritten or removed is left in the pack
+as garbage.  When synced, the storage compacts the pack if the garbage takes up
+too much of it or there are too many records to replay after the table.
+Compacting rewrites the pack with only the live content, followed by a new
+offset table, and then replaces the old pack with the new one.  Other processes
+notice that the pack has been replaced when they next lock it, and reload it.
+
+Files handed out with abspath(), to be edited by another program, are copied
+out to that path in the file system and copied back into the pack, and then
+deleted, when the storage is synced.
+"""
+
+import os
+import json
+import fcntl
+import struct
+from contextlib import contextmanager
+from functools import partial
+from fnmatch import fnmatch
+from deft.storage.memory import MemoryIO
+from deft.storage.snapshot import has_magic
+
+
+Magic = "deft-pack/1\n"
+HeaderFormat = ">%dsQ" % len(Magic)
+HeaderSize = struct.calcsize(HeaderFormat)
+
+RecordHeaderFormat = ">cII"
+RecordHeaderSize = struct.calcsize(RecordHeaderFormat)
+
+FileRecord = "F"
+DirectoryRecord = "D"
+RemovalRecord = "X"
+RenameRecord = "M"
+TableRecord = "T"
+
+# Don't bother compacting packs smaller than this
+CompactionMinimumSize = 1024*1024
+# Compact when more than this fraction of the pack is garbage...
+CompactionGarbageRatio = 0.5
+# ... or when more than this fraction of the pack must be replayed after the offset table
+CompactionReplayRatio = 0.5
+
+
+def record_size(a, b):
+    return RecordHeaderSize + len(a) + len(b)
+
+
+def _matches_parts(path_parts, pattern_parts):
+    # Matched one path element at a time, so that wildcards do not match across directories
+    return len(path_parts) == len(pattern_parts) and \
+        all(fnmatch(p, part) for (p, part) in zip(path_parts, pattern_parts))
+
+
+class PackStorage(object):
+    def __init__(self, basedir, pack_relpath=os.path.join(".deft", "pack")):
+        self.basedir = basedir
+        self.pack_path = os.path.join(basedir, pack_relpath)
+        self._pack = None
+        self._checked_out = {}
+        self._checkout_dirs = []
+        self._lock_depth = 0
+        self._reset()
+
+        if os.path.exists(self.pack_path):
+            self._open()
+
+    def abspath(self, relpath):
+        abspath = os.path.normpath(os.path.join(self.basedir, relpath))
+
+        # The caller wants to use the file directly, so it must exist in the file system
+        if relpath not in self._checked_out:
+            self._checked_out[relpath] = abspath
+            if os.path.dirname(relpath) in self._dirs:
+                self._make_checkout_dirs(os.path.dirname(abspath))
+            if relpath in self._files:
+                self._write_checked_out_file(relpath, self._read_packed(relpath))
+
+        return abspath
+
+    def exists(self, relpath):
+        return relpath in self._files or relpath in self._dirs or self._is_checked_out_file(relpath)
+
+    def isdir(self, relpath):
+        return relpath in self._dirs
+
+    def open(self, relpath, mode="r"):
+        if relpath in self._dirs:
+            raise IOError(relpath + " is a directory")
+
+        if mode == "r":
+            return MemoryIO(self._read(relpath))
+        elif mode == "w":
+            self.makedirs(os.path.dirname(relpath))
+            return MemoryIO(save_callback=partial(self._store, relpath))
+        elif mode == "a":
+            self.makedirs(os.path.dirname(relpath))
+            content = self._read(relpath) if self.exists(relpath) else ""
+            return MemoryIO(content, save_callback=partial(self._store, relpath), append=True)
+        else:
+            raise ValueError("mode must be 'r', 'w' or 'a', was: " + mode)
+
+    def rename(self, old_relpath, new_relpath):
+        with self._locked():
+            if old_relpath in self._dirs:
+                raise IOError(old_relpath + " is a directory")
+            if old_relpath in self._checked_out:
+                self._check_in(old_relpath)
+            if old_relpath not in self._files:
+                raise IOError(old_relpath + " does not exist")
+            if self.exists(new_relpath):
+                raise IOError(new_relpath + " already exists")
+
+            self.makedirs(os.path.dirname(new_relpath))
+            self._append(RenameRecord, old_relpath, new_relpath)
+            self._renamed(old_relpath, new_relpath)
+
+    def remove(self, relpath):
+        for p in [p for p in self._checked_out if p == relpath or p.startswith(os.path.join(relpath, ""))]:
+            abspath = self._checked_out.pop(p)
+            if os.path.isfile(abspath):
+                os.remove(abspath)
+
+        with self._locked():
+            if relpath in self._files or relpath in self._dirs:
+                self._append(RemovalRecord, relpath, "")
+                self._removed(relpath)
+
+    def list(self, relpattern):
+        matches = [""]
+        pattern_parts = relpattern.split(os.sep)
+        for i, part in enumerate(pattern_parts):
+            is_last_part = (i == len(pattern_parts) - 1)
+            next_matches = []
+            for match in matches:
+                names = self._children.get(match, ())
+                if has_magic(part):
+                    names = [n for n in names if fnmatch(n, part)]
+                elif part in names:
+                    names = [part]
+                else:
+                    names = []
+
+                next_matches.extend(os.path.join(match, n) for n in names
+                                    if is_last_part or os.path.join(match, n) in self._dirs)
+            matches = next_matches
+
+        # Files created by other programs that have not yet been copied into the pack
+        matches.extend(p for p in self._checked_out
+                       if p not in self._files and self._is_checked_out_file(p)
+                       and _matches_parts(p.split(os.sep), pattern_parts))
+
+        return sorted(matches)
+
+    def makedirs(self, relpath):
+        if relpath == "":
+            return
+
+        with self._locked():
+            if relpath in self._dirs:
+                return
+            if relpath in self._files:
+                raise IOError("cannot create directory " + relpath + ", it is a file")
+
+            self.makedirs(os.path.dirname(relpath))
+            self._append(DirectoryRecord, relpath, "")
+            self._dir_made(relpath)
+
+    def refresh(self):
+        """
+        Replays the changes that other processes have made to the pack since
+        it was opened or last changed or refreshed
+        """
+        if self._pack is not None or os.path.exists(self.pack_path):
+            with self._locked():
+                pass
+
+    def sync(self):
+        """
+        Copies files that have been edited in the file system back into the pack
+        and makes sure that the changes to the pack are on disk, compacting the
+        pack if it needs it.
+        """
+        for relpath in sorted(self._checked_out):
+            self._check_in(relpath)
+        self._remove_checkout_dirs()
+
+        if self._pack is None:
+            return
+
+        if self._needs_compaction():
+            self.compact()
+        else:
+            self._pack.flush()
+            os.fsync(self._pack.fileno())
+
+    def compact(self):
+        """
+        Rewrites the pack file with only the live content, followed by an
+        offset table
+        """
+        with self._locked():
+            temp_path = self.pack_path + ".compacting"
+            with open(temp_path, "wb") as output:
+                compacted = PackWriter(output)
+                for relpath in sorted(self._dirs):
+                    compacted.append(DirectoryRecord, relpath, "")
+                for relpath in sorted(self._files):
+                    compacted.append(FileRecord, relpath, self._read_packed(relpath))
+                compacted.finish()
+                output.flush()
+                os.fsync(output.fileno())
+
+            # Replaced while still locked, so that no other process can append to the old pack
+            os.rename(temp_path, self.pack_path)
+            self.close()
+            self._open()
+
+    def close(self):
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+
+    def _needs_compaction(self):
+        return self._end > CompactionMinimumSize and (
+            self._end - self._live_size > self._end * CompactionGarbageRatio or
+            self._end - self._replay_start > self._end * CompactionReplayRatio)
+
+    def _read(self, relpath):
+        if self._is_checked_out_file(relpath):
+            with open(self._checked_out[relpath], "rb") as input:
+                return input.read()
+        elif relpath in self._files:
+            return self._read_packed(relpath)
+        else:
+            raise IOError(relpath + " does not exist")
+
+    def _read_packed(self, relpath):
+        offset, length = self._files[relpath]
+        self._pack.seek(offset)
+        return self._pack.read(length)
+
+    def _store(self, relpath, content):
+        self._pack_content(relpath, content)
+        if relpath in self._checked_out:
+            self._write_checked_out_file(relpath, content)
+
+    def _pack_content(self, relpath, content):
+        self._append(FileRecord, relpath, content)
+        self._file_written(relpath, self._end - len(content), len(content))
+
+    # Copying files out to the file system and back in again
+
+    def _is_checked_out_file(self, relpath):
+        return relpath in self._checked_out and os.path.isfile(self._checked_out[relpath])
+
+    def _check_in(self, relpath):
+        if self._is_checked_out_file(relpath):
+            abspath = self._checked_out[relpath]
+            with open(abspath, "rb") as input:
+                content = input.read()
+            if relpath not in self._files or content != self._read_packed(relpath):
+                self._pack_content(relpath, content)
+            os.remove(abspath)
+
+        del self._checked_out[relpath]
+
+    def _write_checked_out_file(self, relpath, content):
+        with open(self._checked_out[relpath], "wb") as output:
+            output.write(content)
+
+    def _make_checkout_dirs(self, dirpath):
+        if dirpath and not os.path.isdir(dirpath):
+            self._make_checkout_dirs(os.path.dirname(dirpath))
+            os.mkdir(dirpath)
+            self._checkout_dirs.append(dirpath)
+
+    def _remove_checkout_dirs(self):
+        # Deepest first, leaving any in which other programs have put files
+        for dirpath in reversed(self._checkout_dirs):
+            if os.path.isdir(dirpath) and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        self._checkout_dirs = []
+
+    # Reading and writing the pack file
+
+    def _append(self, record_type, a, b):
+        with self._locked():
+            self._pack.seek(self._end)
+            self._pack.write(struct.pack(RecordHeaderFormat, record_type, len(a), len(b)))
+            self._pack.write(a)
+            self._pack.write(b)
+            self._end += record_size(a, b)
+
+    @contextmanager
+    def _locked(self):
+        if self._lock_depth == 0:
+            self._lock()
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                self._unlock()
+
+    def _lock(self):
+        while True:
+            if self._pack is None:
+                self._open()
+            fcntl.flock(self._pack.fileno(), fcntl.LOCK_EX)
+            if self._is_current():
+                break
+            # Another process has compacted the pack, replacing the file this storage has open
+            self.close()
+
+        self._catch_up()
+
+    def _unlock(self):
+        if self._pack is not None:
+            # Other processes must see the appended records once they can lock the pack
+            self._pack.flush()
+            fcntl.flock(self._pack.fileno(), fcntl.LOCK_UN)
+
+    def _is_current(self):
+        try:
+            pack_stat = os.stat(self.pack_path)
+        except OSError:
+            return False
+        open_stat = os.fstat(self._pack.fileno())
+        return (pack_stat.st_dev, pack_stat.st_ino) == (open_stat.st_dev, open_stat.st_ino)
+
+    def _catch_up(self):
+        """
+        Replays the records appended by other processes.  Must be called with
+        the pack locked.
+        """
+        size = os.fstat(self._pack.fileno()).st_size
+        if size < HeaderSize:
+            # A new pack, created by this process or one that was interrupted before writing the header
+            self._pack.seek(0)
+            self._pack.write(struct.pack(HeaderFormat, Magic, 0))
+            self._pack.truncate(HeaderSize)
+        elif size != self._end:
+            self._end = self._replay(self._end, size)
+            if self._end < size:
+                # Remove the remains of an incompletely written record, so that they cannot be
+                # mistaken for records if the next change does not completely overwrite them
+                self._pack.truncate(self._end)
+
+    def _open(self):
+        pack_dir = os.path.dirname(self.pack_path)
+        if pack_dir and not os.path.isdir(pack_dir):
+            os.makedirs(pack_dir)
+
+        self._pack = os.fdopen(os.open(self.pack_path, os.O_RDWR|os.O_CREAT, 0666), "r+b")
+        self._load()
+
+    def _load(self):
+        self._reset()
+
+        header = self._pack.read(HeaderSize)
+        if len(header) < HeaderSize:
+            # Just created, and the header is written when the pack is first locked
+            return
+
+        magic, table_offset = struct.unpack(HeaderFormat, header)
+        if magic != Magic:
+            raise IOError(self.pack_path + " is not a deft pack file")
+
+        # Any incompletely written record is left alone, because another process may be writing it
+        self._end = self._replay(table_offset or HeaderSize, os.fstat(self._pack.fileno()).st_size)
+
+    def _replay(self, offset, size):
+        """
+        Applies the records from offset to the end of the pack.  Returns the
+        end of the last complete record.
+        """
+        while offset + RecordHeaderSize <= size:
+            self._pack.seek(offset)
+            record_type, a_length, b_length = struct.unpack(RecordHeaderFormat, self._pack.read(RecordHeaderSize))
+            end = offset + RecordHeaderSize + a_length + b_length
+            if end > size:
+                break
+
+            a = self._pack.read(a_length)
+            if record_type == FileRecord:
+                self._file_written(a, end - b_length, b_length)
+            elif record_type == DirectoryRecord:
+                self._dir_made(a)
+            elif record_type == RemovalRecord:
+                self._removed(a)
+            elif record_type == RenameRecord:
+                self._renamed(a, self._pack.read(b_length))
+            elif record_type == TableRecord:
+                self._load_table(json.loads(self._pack.read(b_length)))
+                self._replay_start = end
+            else:
+                break
+
+            offset = end
+
+        return offset
+
+    def _load_table(self, table):
+        self._reset()
+        for relpath in table["dirs"]:
+            self._dir_made(str(relpath))
+        for relpath, (offset, length) in table["files"].items():
+            self._file_written(str(relpath), offset, length)
+
+    # The directory tree held in the pack
+
+    def _reset(self):
+        self._files = {}
+        self._dirs = set()
+        self._children = {}
+        self._end = self._replay_start = HeaderSize
+        self._live_size = HeaderSize
+
+    def _file_written(self, relpath, offset, length):
+        if relpath in self._files:
+            self._live_size -= record_size(relpath, "") + self._files[relpath][1]
+        else:
+            self._add_child(relpath)
+        self._files[relpath] = (offset, length)
+        self._live_size += record_size(relpath, "") + length
+
+    def _dir_made(self, relpath):
+        self._dirs.add(relpath)
+        self._add_child(relpath)
+        self._live_size += record_size(relpath, "")
+
+    def _renamed(self, old_relpath, new_relpath):
+        offset, length = self._files.pop(old_relpath)
+        self._remove_child(old_relpath)
+        self._live_size -= record_size(old_relpath, "") + length
+        self._file_written(new_relpath, offset, length)
+
+    def _removed(self, relpath):
+        for name in list(self._children.get(relpath, ())):
+            self._removed(os.path.join(relpath, name))
+
+        if relpath in self._files:
+            self._live_size -= record_size(relpath, "") + self._files.pop(relpath)[1]
+        elif relpath in self._dirs:
+            self._live_size -= record_size(relpath, "")
+            self._dirs.remove(relpath)
+            self._children.pop(relpath, None)
+        else:
+            return
+
+        self._remove_child(relpath)
+
+    def _add_child(self, relpath):
+        dirpath, name = os.path.split(relpath)
+        self._children.setdefault(dirpath, set()).add(name)
+
+    def _remove_child(self, relpath):
+        dirpath, name = os.path.split(relpath)
+        self._children[dirpath].discard(name)
+
+    def __del__(self):
+        self.close()
+
+
+class PackWriter(object):
+    """
+    Writes a new pack file from start to finish
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.output.write(struct.pack(HeaderFormat, Magic, 0))
+        self.offset = HeaderSize
+        self.files = {}
+        self.dirs = []
+
+    def append(self, record_type, a, b):
+        self.output.write(struct.pack(RecordHeaderFormat, record_type, len(a), len(b)))
+        self.output.write(a)
+        self.output.write(b)
+        self.offset += record_size(a, b)
+
+        if record_type == FileRecord:
+            self.files[a] = (self.offset - len(b), len(b))
+        elif record_type == DirectoryRecord:
+            self.dirs.append(a)
+
+    def finish(self):
+        table_offset = self.offset
+        self.append(TableRecord, "", json.dumps({"files": self.files, "dirs": self.dirs}, separators=(",", ":")))
+        self.output.seek(0)
+        self.output.write(struct.pack(HeaderFormat, Magic, table_offset))
+
+
+def walk_files(storage, relpath):
+    """
+    Yields the paths of the files in a storage at or beneath relpath
+    """
+    if storage.isdir(relpath):
+        # Some storages match hidden files with "*", others only with ".*"
+        subpaths = set(storage.list(os.path.join(relpath, "*"))).union(storage.list(os.path.join(relpath, ".*")))
+        for subpath in sorted(subpaths):
+            for f in walk_files(storage, subpath):
+                yield f
+    elif storage.exists(relpath):
+        yield relpath
+
+
+def copy_files(source, target, relpaths):
+    """
+    Copies the files at or beneath relpaths from one storage to another
+    """
+    for relpath in relpaths:
+        for f in walk_files(source, relpath):
+            with source.open(f) as input:
+                content = input.read()
+            with target.open(f, "w") as output:
+                output.write(content)
@@ -0,0 +1,203 @@
+
+import os
+from deft.storage.pack import PackStorage, copy_files
+from deft.storage.filesystem import FileStorage
+from deft.storage.memory import MemStorage
+from deft.fileops import *
+from deft.storage.contract import StorageContract
+from hamcrest import *
+from nose.plugins.attrib import attr
+
+
+def path(p):
+    return os.path.join(*p.split("/"))
+
+
+@attr("fileio")
+class PackStorage_Test(StorageContract):
+    def setup(self):
+        self.testdir = os.path.join("output", "testing", self.__class__.__name__.lower(), str(id(self)))
+        ensure_empty_dir_exists(self.testdir)
+        self.storage = self.create_storage()
+
+    def create_storage(self, basedir=None):
+        return PackStorage(self.testdir if basedir is None else basedir)
+
+    def given_file(self, relpath, content="testing"):
+        self.storage.sync()
+        self.storage.close()
+
+        storage = self.create_storage()
+        with storage.open(relpath, "w") as output:
+            output.write(content)
+        storage.sync()
+        storage.close()
+
+        self.storage = self.create_storage()
+
+    # PackStorage-specific behaviour
+
+    def test_stores_files_in_a_single_pack_file(self):
+        self.given_file("foo/bar", content="example-content")
+
+        assert_that(os.listdir(self.testdir), equal_to([".deft"]))
+        assert_that(os.listdir(os.path.join(self.testdir, ".deft")), equal_to(["pack"]))
+
+    def test_reads_changes_that_were_not_synced_by_replaying_the_pack(self):
+        self.storage.makedirs("d")
+        with self.storage.open(path("d/x"), "w") as output:
+            output.write("x-content")
+        with self.storage.open(path("d/y"), "w") as output:
+            output.write("y-content")
+        self.storage.rename(path("d/x"), path("e/x"))
+        self.storage.remove(path("d/y"))
+        self.storage.close()
+
+        reopened = self.create_storage()
+
+        assert_that(reopened.list("*"), equal_to(["d", "e"]))
+        assert_that(reopened.list(path("*/*")), equal_to([path("e/x")]))
+        assert_that(reopened.open(path("e/x")).read(), equal_to("x-content"))
+
+    def test_ignores_incompletely_written_last_record(self):
+        self.given_file("x", content="x-content")
+        with self.storage.open("y", "w") as output:
+            output.write("y-content")
+        self.storage.close()
+
+        pack_path = os.path.join(self.testdir, ".deft", "pack")
+        with open(pack_path, "r+b") as pack:
+            pack.truncate(os.path.getsize(pack_path) - 4)
+
+        reopened = self.create_storage()
+
+        assert_that(reopened.exists("x"))
+        assert_that(not reopened.exists("y"))
+
+        with reopened.open("z", "w") as output:
+            output.write("z-content")
+        reopened.sync()
+        reopened.close()
+
+        assert_that(self.create_storage().list("*"), equal_to(["x", "z"]))
+
+    def test_appends_changes_until_compacted(self):
+        for i in range(10):
+            self.given_file("x", content="x"*1000)
+
+        pack_path = os.path.join(self.testdir, ".deft", "pack")
+        assert_that(os.path.getsize(pack_path), greater_than(10000))
+
+        self.storage.compact()
+
+        assert_that(os.path.getsize(pack_path), less_than(2000))
+        assert_that(self.storage.open("x").read(), equal_to("x"*1000))
+        assert_that(self.create_storage().open("x").read(), equal_to("x"*1000))
+
+    def test_copies_files_out_for_editing_and_back_in_when_synced(self):
+        self.given_file(path("d/x"), content="original-content")
+
+        abspath = self.storage.abspath(path("d/x"))
+        assert_that(open(abspath).read(), equal_to("original-content"))
+
+        with open(abspath, "w") as output:
+            output.write("edited-content")
+
+        assert_that(self.storage.open(path("d/x")).read(), equal_to("edited-content"))
+
+        self.storage.sync()
+
+        assert_that(os.path.exists(abspath), equal_to(False))
+        assert_that(self.create_storage().open(path("d/x")).read(), equal_to("edited-content"))
+
+    def test_copies_in_new_files_created_by_editor(self):
+        abspath = self.storage.abspath("new-file")
+        assert_that(self.storage.exists("new-file"), equal_to(False))
+
+        with open(abspath, "w") as output:
+            output.write("new-content")
+        self.storage.sync()
+
+        assert_that(self.create_storage().open("new-file").read(), equal_to("new-content"))
+
+
+    def test_lists_new_files_created_by_editor_one_path_element_at_a_time(self):
+        self.given_file("d/x")
+        with open(self.storage.abspath("d/new-file"), "w") as output:
+            output.write("new-content")
+
+        assert_that(self.storage.list("*"), equal_to(["d"]))
+        assert_that(self.storage.list("d/*"), equal_to([path("d/new-file"), path("d/x")]))
+        assert_that(self.storage.list("*/new-*"), equal_to([path("d/new-file")]))
+
+    def test_keeps_changes_made_through_other_storages_on_the_same_pack(self):
+        other = self.create_storage()
+
+        with self.storage.open("x", "w") as output:
+            output.write("x-content")
+        with other.open("y", "w") as output:
+            output.write("y-content")
+        with self.storage.open("z", "w") as output:
+            output.write("z-content")
+        self.storage.sync()
+        other.sync()
+
+        reopened = self.create_storage()
+        assert_that(reopened.list("*"), equal_to(["x", "y", "z"]))
+        assert_that([reopened.open(f).read() for f in ["x", "y", "z"]],
+                    equal_to(["x-content", "y-content", "z-content"]))
+
+    def test_refresh_replays_changes_made_through_other_storages(self):
+        self.given_file("x", content="x-content")
+        other = self.create_storage()
+        with other.open("x", "w") as output:
+            output.write("changed-content")
+        with other.open("y", "w") as output:
+            output.write("y-content")
+        other.sync()
+
+        assert_that(self.storage.exists("y"), equal_to(False))
+
+        self.storage.refresh()
+
+        assert_that(self.storage.list("*"), equal_to(["x", "y"]))
+        assert_that(self.storage.open("x").read(), equal_to("changed-content"))
+
+    def test_reloads_a_pack_compacted_by_another_storage(self):
+        self.given_file("x", content="x-content")
+        other = self.create_storage()
+        with other.open("y", "w") as output:
+            output.write("y-content")
+        other.compact()
+
+        with self.storage.open("z", "w") as output:
+            output.write("z-content")
+        self.storage.sync()
+
+        assert_that(self.storage.list("*"), equal_to(["x", "y", "z"]))
+        assert_that(self.create_storage().list("*"), equal_to(["x", "y", "z"]))
+        assert_that(self.create_storage().open("y").read(), equal_to("y-content"))
+
+@attr("fileio")
+class PackExport_Test:
+    def setup(self):
+        self.testdir = os.path.join("output", "testing", self.__class__.__name__.lower(), str(id(self)))
+        ensure_empty_dir_exists(self.testdir)
+
+    def test_round_trips_files_between_pack_and_plain_layout(self):
+        original = MemStorage()
+        for relpath, content in [(".deft/config", "c"), (".deft/data/a", "a"), (".deft/data/d/b", "b")]:
+            with original.open(path(relpath), "w") as output:
+                output.write(content)
+
+        pack = PackStorage(self.testdir)
+        copy_files(original, pack, [".deft"])
+        pack.sync()
+        pack.close()
+
+        plain = FileStorage(os.path.join(self.testdir, "plain"))
+        copy_files(PackStorage(self.testdir), plain, [path(".deft/config"), path(".deft/data")])
+
+        assert_that(open(plain.abspath(path(".deft/config"))).read(), equal_to("c"))
+        assert_that(open(plain.abspath(path(".deft/data/a"))).read(), equal_to("a"))
+        assert_that(open(plain.abspath(path(".deft/data/d/b"))).read(), equal_to("b"))
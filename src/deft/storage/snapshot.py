@@ -0,0 +1,150 @@
+"""
+An in-memory snapshot of the directories of a file system.
+
+Loading a tracker looks up the same few directories many times.  A snapshot
+reads each directory once, when it is first used, and then answers questions
+about the existence and type of its entries, and about the modification times
+and sizes of files, from memory.  The FileStorage that owns the snapshot keeps
+it up to date with the changes it makes itself.  Changes made by other
+processes are not seen until the snapshot is told to forget what it knows
+about the paths they changed, or is replaced by a new one, so a snapshot
+should only be trusted for as long as a single command or request.
+"""
+
+import os
+from fnmatch import fnmatch
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def read_directory(dirpath):
+    """
+    Returns a dict that maps the names of the entries of a directory to whether
+    they are directories, or to None if that is not yet known.  Returns None if
+    dirpath does not refer to a directory.
+    """
+    try:
+        if scandir is not None:
+            return dict((entry.name, entry.is_dir()) for entry in scandir(dirpath or os.curdir))
+        else:
+            # Finding out the type of each entry would need a stat call per entry, so leave it until asked
+            return dict.fromkeys(os.listdir(dirpath or os.curdir))
+    except OSError:
+        return None
+
+
+def has_magic(pattern):
+    return any(c in pattern for c in "*?[")
+
+
+class DirectorySnapshot(object):
+    def __init__(self):
+        self._listings = {}
+        self._stats = {}
+
+    def entries(self, dirpath):
+        if dirpath not in self._listings:
+            self._listings[dirpath] = read_directory(dirpath)
+        return self._listings[dirpath]
+
+    def exists(self, path):
+        dirpath, name = os.path.split(path)
+        if name in ("", os.curdir, os.pardir):
+            return os.path.exists(path)
+
+        entries = self.entries(dirpath)
+        return entries is not None and name in entries
+
+    def isdir(self, path):
+        dirpath, name = os.path.split(path)
+        if name in ("", os.curdir, os.pardir):
+            return os.path.isdir(path)
+
+        entries = self.entries(dirpath)
+        return entries is not None and name in entries and self._is_dir_entry(dirpath, entries, name)
+
+    def stat(self, path):
+        if path not in self._stats:
+            self._stats[path] = os.stat(path)
+        return self._stats[path]
+
+    def glob(self, dirpath, pattern_parts):
+        """
+        Returns the paths, relative to dirpath, that match a glob pattern that has
+        been split into path components.  Like glob.glob, wildcards do not match
+        names that start with a dot.
+        """
+        matches = [""]
+        for i, part in enumerate(pattern_parts):
+            is_last_part = (i == len(pattern_parts) - 1)
+            next_matches = []
+
+            for match in matches:
+                match_path = os.path.join(dirpath, match) if match else dirpath
+                entries = self.entries(match_path)
+                if entries is None:
+                    continue
+
+                if has_magic(part):
+                    names = [n for n in entries if fnmatch(n, part) and (part[0] == "." or n[0] != ".")]
+                elif part in entries:
+                    names = [part]
+                else:
+                    names = []
+
+                next_matches.extend(os.path.join(match, n) for n in names
+                                    if is_last_part or self._is_dir_entry(match_path, entries, n))
+
+            matches = next_matches
+
+        return matches
+
+    def added(self, path, is_dir):
+        dirpath, name = os.path.split(path)
+        entries = self._listings.get(dirpath)
+        if entries is not None:
+            entries[name] = is_dir
+        if is_dir:
+            self._listings[path] = {}
+        self.changed(path)
+
+    def removed(self, path):
+        dirpath, name = os.path.split(path)
+        entries = self._listings.get(dirpath)
+        if entries is not None:
+            entries.pop(name, None)
+
+        subpath_prefix = os.path.join(path, "")
+        for cache in (self._listings, self._stats):
+            for p in [p for p in cache if p == path or p.startswith(subpath_prefix)]:
+                del cache[p]
+
+        self.changed(path)
+
+    def changed(self, path):
+        self._stats.pop(path, None)
+        # Adding or removing a directory entry changes the modification time of the directory
+        self._stats.pop(os.path.dirname(path), None)
+
+    def forget(self, path):
+        """
+        Forgets what is known about a path, anything below it and the directory
+        that contains it, which another process may have changed, so that they
+        are read afresh when next used
+        """
+        dirpath = os.path.dirname(path)
+        subpath_prefix = os.path.join(path, "")
+        for cache in (self._listings, self._stats):
+            for p in [p for p in cache if p in (path, dirpath) or p.startswith(subpath_prefix)]:
+                del cache[p]
+
+    def _is_dir_entry(self, dirpath, entries, name):
+        if entries[name] is None:
+            entries[name] = os.path.isdir(os.path.join(dirpath, name))
+        return entries[name]
@@ -173,6 +173,26 @@ def can_change_status_of_all_features_with_given_status(env):
     assert_that(env.deft("status", "z").value, equal_to("tested"))
 
 
+@systest
+def can_choose_priority_at_which_features_with_changed_status_are_inserted(env):
+    env.deft("init")
+    env.deft("create", "x", "--status", "testing")
+    env.deft("create", "y", "--status", "testing")
+    env.deft("create", "a", "--status", "tested")
+    env.deft("create", "b", "--status", "tested")
+    env.deft("create", "c", "--status", "new")
+    
+    env.deft("status", "--all-with-status", "testing", "tested", "--at-priority", "2")
+    env.deft("status", "c", "tested", "--at-priority", "1")
+    
+    assert_that(env.deft("list", "--status", "tested").rows, equal_to([
+                ["tested", "1", "c"],
+                ["tested", "2", "a"],
+                ["tested", "3", "x"],
+                ["tested", "4", "y"],
+                ["tested", "5", "b"]]))
+
+
 @systest
 def can_query_priority_of_feature(env):
     env.deft("init")
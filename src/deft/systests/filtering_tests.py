@@ -0,0 +1,30 @@
+
+from deft.systests.support import systest, ProcessError, fail
+from hamcrest import *
+
+
+@systest
+def can_list_features_that_match_a_query(env):
+    env.deft("init")
+    env.deft("create", "a", "--status", "new", "--description", "", "--set", "component", "ui")
+    env.deft("create", "b", "--status", "new", "--description", "", "--set", "component", "db")
+    env.deft("create", "c", "--status", "new", "--description", "", "--set", "component", "ui")
+    env.deft("create", "d", "--status", "done", "--description", "", "--set", "component", "ui")
+    
+    assert_that(env.deft("list", "--where", "component = ui and status = new").rows, equal_to([
+                ["new", "1", "a"],
+                ["new", "3", "c"]]))
+    
+    assert_that(env.deft("list", "--status", "done", "--where", "component in (ui, db)").rows, equal_to([
+                ["done", "1", "d"]]))
+
+
+@systest
+def reports_invalid_queries(env):
+    env.deft("init")
+    
+    try:
+        env.deft("list", "--where", "component =")
+        fail("deft should have rejected the query")
+    except ProcessError as e:
+        assert_that(e.stderr, contains_string("invalid query"))
@@ -0,0 +1,15 @@
+
+from deft.systests.support import systest
+from hamcrest import *
+
+
+@systest
+def can_report_operations_performed_on_tracker_files(env):
+    env.deft("init", "-d", "data")
+    env.deft("create", "x", "--description", "description of x")
+    
+    result = env.deft("--io-stats", "list")
+    
+    assert_that(result.rows, equal_to([["new", "1", "x"]]))
+    assert_that(result.stderr, contains_string("bytes read:"))
+    assert_that(result.stderr, contains_string("data/status/*"))
@@ -0,0 +1,31 @@
+
+import os
+from deft.systests.support import systest_in, DevEnvironment
+from hamcrest import *
+
+
+@systest_in(DevEnvironment)
+def test_can_pack_tracker_into_a_single_file_and_unpack_it_again(env):
+    env.deft("init")
+    env.deft("create", "feature-a", "--description", "a-description")
+    env.deft("create", "feature-b")
+    
+    env.deft("pack")
+    
+    assert_that(os.listdir(env.abspath(".deft")), equal_to(["pack"]))
+    
+    env.deft("create", "feature-c", "--status", "started")
+    env.deft("priority", "feature-b", "1")
+    env.deft("description", "feature-a", "--edit", editor_input="edited-description")
+    
+    assert_that(os.listdir(env.abspath(".deft")), equal_to(["pack"]))
+    assert_that(env.deft("list", "--status", "new").rows.cols(2), equal_to([["feature-b"], ["feature-a"]]))
+    assert_that(env.deft("description", "feature-a").value, equal_to("edited-description"))
+    
+    env.deft("unpack")
+    
+    assert_that(os.path.exists(env.abspath(".deft/pack")), equal_to(False))
+    assert_that(os.path.isdir(env.abspath(".deft/data")))
+    assert_that(env.deft("list", "--status", "new").rows.cols(2), equal_to([["feature-b"], ["feature-a"]]))
+    assert_that(env.deft("list", "--status", "started").rows.cols(2), equal_to([["feature-c"]]))
+    assert_that(env.deft("description", "feature-a").value, equal_to("edited-description"))
@@ -184,6 +184,9 @@ class InMemoryEnvironment(object):
     def load_tracker(self, warning_listener):
         return load_with_storage(self.storage, warning_listener)
     
+    def tracker_storage(self):
+        return self.storage
+    
     def abspath(self, subpath):
         return self.storage.abspath(subpath)
     
@@ -18,3 +18,19 @@ def test_can_configure_tracker_with_default_status_for_new_features(env):
     env.deft("create", "new-feature")
     
     assert_that(env.deft("status", "new-feature").stdout.strip(), equal_to("initial"))
+
+
+@systest
+def test_can_journal_changes_to_status_indices_and_compact_them(env):
+    env.deft("init", "--journal")
+    env.deft("create", "a", "--status", "new")
+    env.deft("create", "b", "--status", "new")
+    env.deft("create", "c", "--status", "new")
+    env.deft("priority", "c", "1")
+    env.deft("status", "a", "done")
+    
+    assert_that(env.deft("list", "--status", "new").rows, equal_to([["new", "1", "c"], ["new", "2", "b"]]))
+    
+    env.deft("compact")
+    
+    assert_that(env.deft("list").rows, equal_to([["done", "1", "a"], ["new", "1", "c"], ["new", "2", "b"]]))
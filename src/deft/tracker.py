@@ -4,31 +4,59 @@ from warnings import warn
 from functools import partial
 import itertools
 import os
+from collections import OrderedDict, deque
+from copy import deepcopy
 from glob import iglob
-from deft.indexing import PriorityIndex
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from deft.indexing import PriorityIndex, PropertyIndex, index_keys, priority_index
 from deft.formats import TextFormat, YamlFormat, LinesFormat
-from deft.storage.filesystem import FileStorage
+from deft.loadcache import LoadCache, PropertyValuesCache
+from deft.journal import JournalSuffix, encode_record, replay, count_records
+from deft.caching import LRUCache
+from deft.storage import read_many, read_first_lines
+from deft.storage.filesystem import FileStorage, DefaultDurability
+from deft.storage.pack import PackStorage, copy_files
 
 FormatVersion = '3.0'
 
 ConfigDir = ".deft"
 ConfigFile = os.path.join(ConfigDir, "config")
 DefaultDataDir = os.path.join(ConfigDir, "data")
+CacheDir = os.path.join(ConfigDir, "cache")
+LoadCacheFile = os.path.join(CacheDir, "load-cache")
+PropertyValuesCacheFile = os.path.join(CacheDir, "property-values")
+PackFile = os.path.join(ConfigDir, "pack")
 
 StatusIndexSuffix = ".index"
 DescriptionSuffix = ".description"
 PropertiesSuffix = ".properties.yaml"
+MovingSuffix = ".moving"
+
+PropertiesCacheSize = 4096
+
+# The number of features whose files are read together when prefetching
+PrefetchBatchSize = 256
+
+# The most of a description that is read to find its first line
+DescriptionExcerptSize = 1024
+
+# The number of records a status index journal may hold before it is compacted
+DefaultJournalCompactionThreshold = 1000
 
 # Used to report user errors that have been explicitly detected
 class UserError(Exception):
     pass
 
 
-def default_config(datadir=DefaultDataDir, initial_status="new"):
+def default_config(datadir=DefaultDataDir, initial_status="new", journal_status_indices=False,
+                   durability=DefaultDurability):
     return {
         'format': FormatVersion,
         'datadir': datadir,
-        'initial_status': initial_status}
+        'initial_status': initial_status,
+        'journal_status_indices': journal_status_indices,
+        'durability': durability}
 
 def init_tracker(warning_listener, **config_overrides):
     return init_with_storage(FileStorage(os.getcwd()), warning_listener, config_overrides)
@@ -44,18 +72,49 @@ def tracker_storage():
         else:
             basedir = parent
 
-    return FileStorage(basedir)
+    if os.path.exists(os.path.join(basedir, PackFile)):
+        return PackStorage(basedir, PackFile)
+    else:
+        return FileStorage(basedir)
 
 def load_tracker(warning_listener):
     return load_with_storage(tracker_storage(), warning_listener)
 
 
+def pack_tracker():
+    storage = tracker_storage()
+    if isinstance(storage, PackStorage):
+        raise UserError("tracker is already packed")
+    
+    tracker_files = [ConfigFile, load_config_from_storage(storage)["datadir"]]
+    pack = PackStorage(storage.basedir, PackFile)
+    copy_files(storage, pack, tracker_files)
+    pack.sync()
+    pack.close()
+    
+    # Only remove the plain files once the pack is complete, so that the tracker is never lost
+    for relpath in tracker_files + [CacheDir]:
+        storage.remove(relpath)
+
+def unpack_tracker():
+    pack = tracker_storage()
+    if not isinstance(pack, PackStorage):
+        raise UserError("tracker is not packed")
+    
+    storage = FileStorage(pack.basedir)
+    copy_files(pack, storage, [ConfigFile, load_config_from_storage(pack)["datadir"]])
+    storage.sync()
+    pack.close()
+    os.remove(pack.pack_path)
+
+
 def init_with_storage(storage, warning_listener, config_overrides):
     if storage.exists(ConfigDir):
         raise UserError("tracker already initialised in directory " + ConfigDir)
     
     tracker = FeatureTracker(default_config(**config_overrides), storage, warning_listener)
     tracker.save_config()
+    tracker.save()
     
     return tracker
 
@@ -95,27 +154,104 @@ class FeatureTracker(object):
         self.config = config
         self.storage = storage
         self.warning_listener = warning_listener
+        self._configure_storage()
+        self.properties_cache = LRUCache(PropertiesCacheSize)
+        self._prefetches = []
+        self._prefetched = {}
+        self._prefetched_excerpts = {}
+        self._pending_files = None
+        self._pending_moves = None
+        self._pending_statuses = None
+        self._property_indexes = {}
+        self._property_values_cache = PropertyValuesCache(storage, PropertyValuesCacheFile)
+        self._load_cache = LoadCache(storage, LoadCacheFile,
+                                     watched_pattern=os.path.join(self._status_dir(), "*"),
+                                     watched_dirs=[self._features_dir()])
+        self._load_indices()
+    
+    def _load_indices(self):
         self._name_index = {}
         self._status_index = {}
+        self._journal_records = {}
+        self._journal_lengths = {}
+        
+        cached_indices = self._load_cache.load()
+        if cached_indices is None:
+            self._index_features()
+        else:
+            self._restore_indices(cached_indices)
+    
+    def refresh(self):
+        """
+        Forgets what the tracker has read from storage, so that it sees the changes
+        made by other processes since it was loaded.  A long-running process, such
+        as the web server, refreshes the tracker before handling each request.
+        Features obtained before the refresh must not be used after it.  Must not
+        be called while writes are buffered.
+        """
+        if hasattr(self.storage, "refresh"):
+            self.storage.refresh()
         
-        self._index_features()
+        self.properties_cache.clear()
+        self._prefetched.clear()
+        self._prefetched_excerpts.clear()
+        self._property_indexes.clear()
+        self._property_values_cache.clear()
+        
+        if self._load_cache.has_changed():
+            self._load_indices()
+    
+    def _restore_indices(self, indices):
+        for status_name, names in indices:
+            self._status_index[status_name] = priority_index(names)
+            for name in names:
+                self._name_index[name] = Feature(tracker=self, name=name, status=status_name)
     
     def _index_features(self):
         repaired_statuses = set()
         
-        for f in self.storage.list(self._status_path("*")):
-            with self.storage.open(f) as input:
-                indexed_names = LinesFormat(list).load(input)
+        # List the features directory once rather than probing storage for each indexed feature
+        feature_files = list(self.storage.list(self._feature_path("*", "")))
+        if any(f.endswith(MovingSuffix) for f in feature_files):
+            feature_files = self._complete_interrupted_moves(feature_files)
+        
+        described_features = set(rootname(f, DescriptionSuffix) 
+                                  for f in feature_files if f.endswith(DescriptionSuffix))
+        existing_features = described_features.union(rootname(f, PropertiesSuffix) 
+                                                      for f in feature_files if f.endswith(PropertiesSuffix))
+        
+        indexed_statuses = set(rootname(f, StatusIndexSuffix) for f in self.storage.list(self._status_path("*")))
+        journaled_statuses = set(rootname(f, JournalSuffix) for f in self.storage.list(self._journal_path("*")))
+        
+        status_files = read_many(self.storage, [self._status_path(s) for s in indexed_statuses] +
+                                               [self._journal_path(s) for s in journaled_statuses])
+        
+        def status_file(path):
+            if path not in status_files:
+                raise IOError(path + " does not exist")
+            return status_files[path]
+        
+        for status_name in sorted(indexed_statuses | journaled_statuses):
+            if status_name in indexed_statuses:
+                indexed_names = status_file(self._status_path(status_name)).splitlines()
+            else:
+                indexed_names = []
+            
+            if status_name in journaled_statuses:
+                indexed_names, is_consistent = self._replay_journal(
+                    status_name, indexed_names, status_file(self._journal_path(status_name)))
+                if not is_consistent:
+                    repaired_statuses.add(status_name)
+            else:
+                self._journal_lengths[status_name] = 0
             
-            status_name = rootname(f, StatusIndexSuffix)
-            status_index = self._status(status_name)
+            valid_names = []
             
             for name in indexed_names:
                 if name not in self._name_index:
-                    feature = Feature(tracker=self, name=name, status=status_name)
-                    if feature.is_valid:
-                        status_index.append(name)
-                        self._name_index[name] = feature
+                    if name in existing_features:
+                        valid_names.append(name)
+                        self._name_index[name] = Feature(tracker=self, name=name, status=status_name)
                     else:
                         repaired_statuses.add(status_name)
                         self.warning_listener.unknown_feature(name=name, status=status_name)
@@ -123,10 +259,10 @@ class FeatureTracker(object):
                     feature = self._name_index[name]
                     repaired_statuses.add(status_name)
                     self.warning_listener.duplicate_entries(feature=feature, removed_from_status=status_name)
+            
+            self._status_index[status_name] = priority_index(valid_names)
         
-        all_features = set(rootname(f, DescriptionSuffix)
-                           for f in self.storage.list(self._feature_path("*", DescriptionSuffix)))
-        unindexed_features = all_features - set(self._name_index)
+        unindexed_features = described_features - set(self._name_index)
         
         for name in sorted(unindexed_features):
             self._status(LostAndFoundStatus).append(name)
@@ -136,21 +272,103 @@ class FeatureTracker(object):
             self.warning_listener.unindexed_feature(feature=feature)
         
         for status_name in repaired_statuses:
-            self._save_status_index(status_name)
+            self._rewrite_status_index(status_name)
+    
+    def _complete_interrupted_moves(self, feature_files):
+        """
+        Moves into place the feature files that were moved aside by a save() that
+        was interrupted before it moved them to their new names.  The status
+        indices are written after the files are moved, so they still refer to the
+        old names, and loading repairs them as for any other renamed feature.
+        Returns the feature files after the moves.
+        """
+        moved_files = []
+        for moving_path in sorted(f for f in feature_files if f.endswith(MovingSuffix)):
+            path = moving_path[:-len(MovingSuffix)]
+            if self.storage.exists(path):
+                self.storage.remove(path)
+            self.storage.rename(moving_path, path)
+            moved_files.append(path)
+            self.warning_listener.interrupted_move(path=path)
+        
+        return sorted(set(f for f in feature_files if not f.endswith(MovingSuffix)).union(moved_files))
+    
+    def _replay_journal(self, status, names, journal):
+        index = priority_index(names)
+        length, failures = replay(index, journal)
+        
+        self._journal_lengths[status] = length
+        for record in failures:
+            self.warning_listener.inconsistent_journal_record(status=status, record=record)
+        
+        return list(index), not failures
     
     def configure(self, **config):
         self.config.update(config)
+        self._configure_storage()
         self.save_config()
+        
+        if not self.is_journaling:
+            self.compact_status_indices()
     
     @property
     def initial_status(self):
         return self.config['initial_status']
     
+    @property
+    def is_journaling(self):
+        return self.config.get('journal_status_indices', False)
+    
+    @property
+    def journal_compaction_threshold(self):
+        return self.config.get('journal_compaction_threshold', DefaultJournalCompactionThreshold)
+    
+    def compact_status_indices(self):
+        """
+        Writes the changes recorded in the journals of the status indices to the
+        indices themselves, and deletes the journals.
+        """
+        journaled_statuses = set(rootname(f, JournalSuffix) for f in self.storage.list(self._journal_path("*")))
+        for status in sorted(journaled_statuses | set(self._journal_records)):
+            self._rewrite_status_index(status)
+    
     def save_config(self):
         save_config_to_storage(self.storage, self.config)
     
+    def _configure_storage(self):
+        if hasattr(self.storage, "durability"):
+            self.storage.durability = self.config.get('durability', DefaultDurability)
+    
+    @property
+    def is_buffering_writes(self):
+        return self._pending_files is not None
+    
+    def buffer_writes(self):
+        """
+        Starts a unit of work: changes to status indices and feature files, and the
+        renaming and removal of feature files, are held in memory until save() is
+        called, so that each changed file is written once and a command that fails
+        part way changes nothing in storage.
+        """
+        if not self.is_buffering_writes:
+            self._pending_files = OrderedDict()
+            self._pending_moves = OrderedDict()
+            self._pending_statuses = set()
+    
     def save(self):
-        pass
+        if self.is_buffering_writes:
+            self._move_pending_files()
+            for path in list(self._pending_files):
+                self._flush_file(path)
+            for status in sorted(self._pending_statuses):
+                self._write_status_index(status)
+            self._pending_statuses.clear()
+        
+        self._load_cache.save((s, self._status(s)) for s in self.statuses())
+        self._property_values_cache.save()
+        
+        if hasattr(self.storage, "sync"):
+            self.storage.sync()
     
     def create(self, name, status=None, description="", properties=None):
         if self._has_feature_named(name):
@@ -170,9 +388,7 @@ class FeatureTracker(object):
         return feature
     
     def _add_to_status_index(self, status, name):
-        status_index = self._status(status)
-        status_index.append(name)
-        self._save_status_index(status)
+        self._update_status_index(status, "append", name)
     
     def statuses(self, include_empty=False):
         return sorted([k for k in self._status_index.keys() if include_empty or not self._status_index[k].is_empty])
@@ -186,23 +402,195 @@ class FeatureTracker(object):
     def features_with_status(self, status):
         return [self.feature_named(n) for n in self._status(status)]
     
+    def count_features_with_status(self, status):
+        return len(self._status_index.get(status, ()))
+    
     def all_features(self):
         return (self.feature_named(n) for n in itertools.chain.from_iterable(
                 self._status(s) for s in sorted(self._status_index)))
 
-    def bulk_change_status(self, from_status, to_status):
-        # dumb implementation: can be optimised
-        for f in self.features_with_status(from_status):
-            f.status = to_status
+    def prefetching(self, features, properties=True, descriptions=False, excerpts=False, 
+                    excerpt_bytes=DescriptionExcerptSize, batch_size=PrefetchBatchSize, depth=1):
+        """
+        Yields the features in the order given, having read the properties,
+        descriptions and/or description excerpts of each batch of them before
+        yielding the first of the batch.  Excerpts are read as description_excerpt
+        reads them, given excerpt_bytes as max_bytes.  While the caller works through one batch, the next depth
+        batches are read on a pool of depth background threads, so no more than
+        depth + 1 batches of files are held in memory at once.  Each background
+        thread reads its batch with the storage's read_many, which may use more
+        threads of its own: FileStorage reads on a pool of ReadThreads threads.
+        Descriptions and excerpts that the caller does not use are dropped when
+        it moves on to the next batch.
+        """
+        suffixes = [suffix for (suffix, wanted) in [(PropertiesSuffix, properties), 
+                                                   (DescriptionSuffix, descriptions)] if wanted]
+        # Whole descriptions include their excerpts
+        excerpt_suffixes = [DescriptionSuffix] if excerpts and not descriptions else []
+        features = iter(features)
+        batches = iter(lambda: list(itertools.islice(features, batch_size)), [])
+        
+        def read_files(paths, excerpt_paths):
+            return (read_many(self.storage, paths) if paths else {},
+                    read_first_lines(self.storage, excerpt_paths, excerpt_bytes) if excerpt_paths else {})
+        
+        pool = ThreadPool(depth)
+        ahead = deque()
+        def read_ahead():
+            for batch in itertools.islice(batches, depth - len(ahead)):
+                paths, live_paths = self._start_prefetch(batch, suffixes)
+                excerpt_paths, live_excerpt_paths = self._start_prefetch(batch, excerpt_suffixes)
+                reading = pool.apply_async(read_files, (paths, excerpt_paths))
+                ahead.append((batch, live_paths, live_excerpt_paths, reading))
+        
+        try:
+            read_ahead()
+            while ahead:
+                batch, live_paths, live_excerpt_paths, reading = ahead.popleft()
+                try:
+                    contents, excerpt_contents = reading.get()
+                    read_ahead()
+                    self._finish_prefetch(live_paths, contents)
+                    self._finish_prefetch(live_excerpt_paths, excerpt_contents, excerpt_bytes)
+                finally:
+                    self._end_prefetch(live_paths)
+                    self._end_prefetch(live_excerpt_paths)
+                
+                try:
+                    for feature in batch:
+                        yield feature
+                finally:
+                    for path in contents:
+                        self._prefetched.pop(path, None)
+                    for path in excerpt_contents:
+                        self._prefetched_excerpts.pop(path, None)
+        finally:
+            pool.terminate()
+            for batch, live_paths, live_excerpt_paths, reading in ahead:
+                self._end_prefetch(live_paths)
+                self._end_prefetch(live_excerpt_paths)
+    
+    def _start_prefetch(self, features, suffixes):
+        """
+        Returns the paths of the features' files that need to be read, and a set
+        of them from which paths are discarded if their files are changed before
+        the content read ahead is used
+        """
+        paths = [path for path in (f._path(suffix) for f in features for suffix in suffixes)
+                 if path not in self.properties_cache 
+                 and not (self.is_buffering_writes and (path in self._pending_files or path in self._pending_moves))]
+        live_paths = set(paths)
+        self._prefetches.append(live_paths)
+        return paths, live_paths
+    
+    def _finish_prefetch(self, live_paths, contents, excerpt_bytes=None):
+        for path in live_paths:
+            if path in contents:
+                if excerpt_bytes is not None:
+                    self._prefetched_excerpts[path] = (excerpt_bytes, contents[path])
+                elif path.endswith(PropertiesSuffix):
+                    self.properties_cache.get(path, partial(YamlFormat.load, contents[path]))
+                else:
+                    self._prefetched[path] = contents[path]
+    
+    def _end_prefetch(self, live_paths):
+        self._prefetches = [p for p in self._prefetches if p is not live_paths]
+    
+    def _forget_prefetched(self, path):
+        # Content that was read ahead must not hide changes made after it was read
+        for live_paths in self._prefetches:
+            live_paths.discard(path)
+        self._prefetched.pop(path, None)
+        self._prefetched_excerpts.pop(path, None)
+    
+    def property_index(self, property_name):
+        """
+        Returns an index of the features by the values of the named property,
+        building it the first time it is requested.
+        """
+        if property_name not in self._property_indexes:
+            index = PropertyIndex()
+            for name, values in self._indexed_property_values(list(self._name_index)).items():
+                index.update(name, values.get(property_name, []))
+            self._property_indexes[property_name] = index
+        
+        return self._property_indexes[property_name]
+    
+    def _indexed_property_values(self, names):
+        """
+        Returns a dict that maps the names of features to the indexable values of
+        their properties
+        """
+        def load_indexed_values(name):
+            path = self._feature_path(name, PropertiesSuffix)
+            try:
+                properties = self.properties_cache.get(path, partial(self._load, path, YamlFormat))
+            except IOError:
+                properties = None
+            if properties is not None and not isinstance(properties, dict):
+                raise UserError("properties of feature " + name + " are not a mapping: " + 
+                                self.storage.abspath(path))
+            return dict((k, index_keys(v)) for (k, v) in (properties or {}).items())
+        
+        def is_pending(path):
+            return self.is_buffering_writes and (path in self._pending_files or path in self._pending_moves)
+        
+        paths = [(name, self._feature_path(name, PropertiesSuffix)) for name in names]
+        
+        # The file on disk of a feature with pending changes is out of date, so its stamp
+        # must not be associated with the new values
+        values = self._property_values_cache.get_many([(name, path) for (name, path) in paths if not is_pending(path)],
+                                                      load_indexed_values)
+        values.update((name, load_indexed_values(name)) for (name, path) in paths if is_pending(path))
+        return values
+    
+    def feature_files_changed(self, feature):
+        """
+        Tells the tracker that the files of a feature have been changed by another
+        process, such as an editor given their filenames, so that it reads them
+        afresh instead of using what it read of them before
+        """
+        for suffix in [DescriptionSuffix, PropertiesSuffix]:
+            path = self._feature_path(feature.name, suffix)
+            self.properties_cache.invalidate(path)
+            self._forget_prefetched(path)
+            if hasattr(self.storage, "forget"):
+                self.storage.forget(path)
+        self._property_values_cache.invalidate(feature.name)
+        self._load_cache.touched(self._features_dir())
+    
+    def _properties_changed(self, feature, new_properties):
+        self._property_values_cache.invalidate(feature.name)
+        for property_name, index in self._property_indexes.items():
+            index.update(feature.name, index_keys(new_properties.get(property_name)))
+    
+    def bulk_change_status(self, from_status, to_status, priority=None):
+        """
+        Moves all the features with one status to another, keeping their relative
+        priority.  They are inserted as a block at the given priority of the new
+        status, or after its existing features if no priority is given.
+        """
+        if from_status == to_status or self._status(from_status).is_empty:
+            return
+        
+        names = self._update_status_index(from_status, "remove_all")
+        self._update_status_index(to_status, "insert_all", names, priority)
+        for name in names:
+            self._name_index[name]._status = to_status
     
     def purge(self, name):
         feature = self.feature_named(name)
-        self._status(feature.status).remove(name)
+        self._update_status_index(feature.status, "remove", name)
         del self._name_index[name]
         
-        self._save_status_index(feature.status)
-        self.storage.remove(self._feature_path(name, DescriptionSuffix))
-        self.storage.remove(self._feature_path(name, PropertiesSuffix))
+        for suffix in [DescriptionSuffix, PropertiesSuffix]:
+            self._forget_prefetched(self._feature_path(name, suffix))
+            self._remove_file(self._feature_path(name, suffix))
+        self.properties_cache.invalidate(self._feature_path(name, PropertiesSuffix))
+        self._property_values_cache.invalidate(name)
+        for index in self._property_indexes.values():
+            index.remove(name)
+        self._load_cache.touched(self._features_dir())
     
     def _change_name(self, feature, new_name):
         old_name = feature.name
@@ -213,41 +601,65 @@ class FeatureTracker(object):
         if new_name in self._name_index:
             raise UserError("a feature named " + repr(new_name) + " already exists")
         
-        self._status(feature.status).rename(old_name, new_name)
+        self._update_status_index(feature.status, "rename", old_name, new_name)
         del self._name_index[old_name]
         self._name_index[new_name] = feature
         
-        self._save_status_index(feature.status)
-        
         for suffix in [DescriptionSuffix, PropertiesSuffix]:
-            self.storage.rename(self._feature_path(old_name, suffix),
-                                self._feature_path(new_name, suffix))
+            self._forget_prefetched(self._feature_path(old_name, suffix))
+            self._move_file(self._feature_path(old_name, suffix), self._feature_path(new_name, suffix))
+        self.properties_cache.invalidate(self._feature_path(old_name, PropertiesSuffix))
+        self._property_values_cache.invalidate(old_name)
+        for index in self._property_indexes.values():
+            index.rename(old_name, new_name)
+        self._load_cache.touched(self._features_dir())
         
     def _change_status(self, feature, new_status):
-        old_status = feature.status
-        
-        old_index = self._status(old_status)
-        new_index = self._status(new_status)
-        
-        old_index.remove(feature.name)
-        new_index.append(feature.name)
-        
-        self._save_status_index(old_status)
-        self._save_status_index(new_status)
+        self._update_status_index(feature.status, "remove", feature.name)
+        self._update_status_index(new_status, "append", feature.name)
 
 
     def _priority_of(self, feature):
         return self._status(feature.status).priority_of_feature(feature.name)
         
     def _change_priority(self, feature, new_priority):
-        index = self._status(feature.status)
-        index.change_priority(feature.name, new_priority)
-        self._save_status_index(feature.status)
+        self._update_status_index(feature.status, "change_priority", feature.name, new_priority)
     
     def _status(self, status):
         return self._status_index.setdefault(status, PriorityIndex([]))
     
+    def _update_status_index(self, status, operation, *args):
+        result = getattr(self._status(status), operation)(*args)
+        
+        if self.is_journaling:
+            records = self._journal_records.setdefault(status, [])
+            if records is not None:
+                records.append([operation] + list(args))
+        
+        self._save_status_index(status)
+        return result
+    
+    def _rewrite_status_index(self, status):
+        # None records that the whole index must be written rather than journaled
+        self._journal_records[status] = None
+        self._save_status_index(status)
+    
     def _save_status_index(self, status):
+        if self.is_buffering_writes:
+            self._pending_statuses.add(status)
+        else:
+            self._write_status_index(status)
+    
+    def _write_status_index(self, status):
+        records = self._journal_records.pop(status, None)
+        
+        if records is not None and \
+                self._journal_length(status) + len(records) <= self.journal_compaction_threshold:
+            self._append_to_journal(status, records)
+        else:
+            self._compact_status_index(status)
+    
+    def _compact_status_index(self, status):
         index = self._status(status)
         path = self._status_path(status)
         
@@ -256,43 +668,178 @@ class FeatureTracker(object):
         else:
             with self.storage.open(self._status_path(status), "w") as output:
                 PriorityIndexFormat.save(index, output)
+        
+        self._load_cache.touched(path)
+        
+        journal_path = self._journal_path(status)
+        if self._journal_lengths.get(status) != 0 and self.storage.exists(journal_path):
+            self.storage.remove(journal_path)
+            self._load_cache.touched(journal_path)
+        self._journal_lengths[status] = 0
+    
+    def _append_to_journal(self, status, records):
+        path = self._journal_path(status)
+        with self.storage.open(path, "a") as output:
+            for record in records:
+                output.write(encode_record(record) + "\n")
+        
+        self._journal_lengths[status] = self._journal_length(status) + len(records)
+        self._load_cache.touched(path)
+    
+    def _journal_length(self, status):
+        if status not in self._journal_lengths:
+            path = self._journal_path(status)
+            if self.storage.exists(path):
+                with self.storage.open(path) as input:
+                    self._journal_lengths[status] = count_records(input)
+            else:
+                self._journal_lengths[status] = 0
+        
+        return self._journal_lengths[status]
     
     def _has_feature_named(self, name):
         return name in self._name_index
     
     def _load(self, path, format):
-        with self.storage.open(path) as input:
+        if self.is_buffering_writes and path in self._pending_files:
+            return deepcopy(self._pending_files[path][0])
+        
+        if path in self._prefetched:
+            return format.load(StringIO(self._prefetched.pop(path)))
+        
+        with self.storage.open(self._stored_path(path)) as input:
             return format.load(input)
     
+    def _load_excerpt(self, path, max_bytes):
+        if self.is_buffering_writes and path in self._pending_files:
+            text = self._pending_files[path][0][:max_bytes]
+        elif path in self._prefetched:
+            text = self._prefetched[path][:max_bytes]
+        elif self._prefetched_excerpts.get(path, (None,))[0] == max_bytes:
+            text = self._prefetched_excerpts.pop(path)[1]
+        else:
+            with self.storage.open(self._stored_path(path)) as input:
+                text = input.readline(max_bytes)
+        
+        return text.splitlines()[0] if text else ""
+    
+    def _load_cached(self, path, format):
+        # Callers may modify the result, so must not be given the cached object itself
+        return deepcopy(self.properties_cache.get(path, partial(self._load, path, format)))
+    
     def _save(self, path, data, format):
+        self.properties_cache.invalidate(path)
+        self._forget_prefetched(path)
+        
+        if self.is_buffering_writes:
+            # Copied so that later changes made by the caller are not written when flushed
+            self._pending_files[path] = (deepcopy(data), format)
+        else:
+            self._write_file(path, data, format)
+    
+    def _write_file(self, path, data, format):
+        self._load_cache.touched(os.path.dirname(path))
         with self.storage.open(path, "w") as output:
             return format.save(data, output)
-        
+    
+    def _flush_file(self, path):
+        if self.is_buffering_writes and path in self._pending_files:
+            data, format = self._pending_files.pop(path)
+            self._write_file(path, data, format)
+    
+    def _remove_file(self, path):
+        if self.is_buffering_writes:
+            self._pending_files.pop(path, None)
+            self._pending_moves[path] = None
+        else:
+            self.storage.remove(path)
+    
+    def _move_file(self, old_path, new_path):
+        if self.is_buffering_writes:
+            if old_path in self._pending_files:
+                self._pending_files[new_path] = self._pending_files.pop(old_path)
+            self._pending_moves[new_path] = self._pending_moves.get(old_path, old_path)
+            self._pending_moves[old_path] = None
+        else:
+            self.storage.rename(old_path, new_path)
+    
+    def _stored_path(self, path):
+        """
+        Returns the path at which the content of a feature file is in storage
+        until pending moves are applied
+        """
+        stored_path = self._pending_moves.get(path, path) if self.is_buffering_writes else path
+        if stored_path is None:
+            raise IOError(self.storage.abspath(path) + " does not exist")
+        return stored_path
+    
+    def _move_pending_files(self):
+        # Files are moved aside before any are moved into place, so that files can swap names.
+        # They are moved aside to their new names with MovingSuffix appended, so that a move
+        # that is interrupted can be completed when the tracker is next loaded.
+        moves = [(path, stored_path) for (path, stored_path) in self._pending_moves.items()
+                 if stored_path not in (None, path) and self.storage.exists(stored_path)]
+        for path, stored_path in moves:
+            self.storage.rename(stored_path, path + MovingSuffix)
+        for path, stored_path in self._pending_moves.items():
+            if stored_path != path:
+                self.storage.remove(path)
+        for path, stored_path in moves:
+            self.storage.rename(path + MovingSuffix, path)
+        self._pending_moves.clear()
+    
+
+    def _status_dir(self):
+        return os.path.join(self.config["datadir"], "status")
+    
     def _status_path(self, status):
-        return os.path.join(self.config["datadir"], "status", status+ StatusIndexSuffix)
+        return os.path.join(self._status_dir(), status + StatusIndexSuffix)
+    
+    def _journal_path(self, status):
+        return os.path.join(self._status_dir(), status + JournalSuffix)
         
+    def _features_dir(self):
+        return os.path.join(self.config["datadir"], "features")
+    
     def _feature_path(self, name, suffix):
-        return os.path.join(self.config["datadir"], "features", name + suffix)
+        return os.path.join(self._features_dir(), name + suffix)
     
     def _feature_abspath(self, name, suffix):
-        return self.storage.abspath(self._feature_path(name, suffix))
+        # The caller is going to use the file directly, so it must be up to date on disk
+        # and must be reread after the caller has finished with it
+        path = self._feature_path(name, suffix)
+        if self.is_buffering_writes:
+            self._move_pending_files()
+        self._flush_file(path)
+        self.properties_cache.invalidate(path)
+        self._forget_prefetched(path)
+        return self.storage.abspath(path)
 
 
 class FeatureFileProperty(object):
     def _no_validation(value):
         pass
     
-    def __init__(self, suffix, format, validate=_no_validation):
+    def _no_notification(tracker, feature, new_value):
+        pass
+    
+    def __init__(self, suffix, format, validate=_no_validation, cached=False, change_notification_fn=_no_notification):
         self._suffix = suffix
         self._format = format
         self._validate = validate
+        self._cached = cached
+        self._change_notification_fn = change_notification_fn
     
     def __get__(self, feature, owner):
-        return feature._tracker._load(feature._path(self._suffix), self._format)
+        if self._cached:
+            return feature._tracker._load_cached(feature._path(self._suffix), self._format)
+        else:
+            return feature._tracker._load(feature._path(self._suffix), self._format)
     
     def __set__(self, feature, new_value):
         self._validate(new_value)
         feature._tracker._save(feature._path(self._suffix), new_value, self._format)
+        self._change_notification_fn(feature._tracker, feature, new_value)
     
 
 ReservedPropertyNames = frozenset(["status", "priority", "description"])
@@ -329,7 +876,15 @@ class Feature(object):
         lambda self: self._tracker._priority_of(self),
         lambda self, new_priority: self._tracker._change_priority(self, new_priority))
     description = FeatureFileProperty(DescriptionSuffix, TextFormat)
-    properties = FeatureFileProperty(PropertiesSuffix, YamlFormat, validate_properties)
+    properties = FeatureFileProperty(PropertiesSuffix, YamlFormat, validate_properties, cached=True,
+                                     change_notification_fn=FeatureTracker._properties_changed)
+    
+    def description_excerpt(self, max_bytes=DescriptionExcerptSize):
+        """
+        Returns the first line of the description, reading no further into the
+        description than the end of that line or max_bytes, whichever comes first
+        """
+        return self._tracker._load_excerpt(self._path(DescriptionSuffix), max_bytes)
     
     @property
     def description_file(self):
@@ -1,10 +1,12 @@
 
 from collections import Counter
+from StringIO import StringIO
 from functools import wraps
 from deft.formats import LinesFormat
 from deft.tracker import (FeatureTracker, default_config, PropertiesSuffix, 
-                          UserError, LostAndFoundStatus)
+                          UserError, LostAndFoundStatus, LoadCacheFile, MovingSuffix)
 from deft.storage.memory import MemStorage
+from deft.storage.instrumented import InstrumentedStorage, IOStats
 from deft.storage.filesystem_tests import path
 from deft.warn import IgnoreWarnings, WarningRecorder, WarningRaiser
 from hamcrest import *
@@ -180,6 +182,15 @@ class FeatureTracker_HappyPath_Tests:
     def test_an_unused_status_is_reported_as_empty(self):
         assert_status("never used status", self.tracker, {"unused_status": []})
     
+    def test_counts_features_with_status(self):
+        self.tracker.create(name="alice", status="S")
+        self.tracker.create(name="bob", status="S")
+        self.tracker.create(name="carol", status="T")
+        
+        assert_that(self.tracker.count_features_with_status("S"), equal_to(2))
+        assert_that(self.tracker.count_features_with_status("T"), equal_to(1))
+        assert_that(self.tracker.count_features_with_status("unused_status"), equal_to(0))
+    
     def test_lists_names_of_all_features_in_order_of_status_then_priority(self):
         alice = self.tracker.create(name="alice", status="S")
         bob = self.tracker.create(name="bob", status="U")
@@ -245,6 +256,292 @@ class FeatureTracker_HappyPath_Tests:
         
         assert_that(new_feature.properties, equal_to({"a": "10", "b": "22"}))
     
+    def test_parses_properties_of_a_feature_only_once(self):
+        self.tracker.create(name="alice", properties={"a":"1"})
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=self.storage, 
+                                 warning_listener=WarningRaiser(AssertionError))
+        alice = tracker.feature_named("alice")
+        
+        for i in range(3):
+            assert_that(alice.properties, equal_to({"a":"1"}))
+        
+        assert_that(self.storage.read_count("tracker/features/alice.properties.yaml"), equal_to(1))
+        assert_that(tracker.properties_cache.misses, equal_to(1))
+        assert_that(tracker.properties_cache.hits, equal_to(2))
+    
+    def test_reads_properties_of_features_in_batches_when_prefetching(self):
+        for name in ["alice", "bob", "carol"]:
+            self.tracker.create(name=name, properties={"name": name})
+        storage = BatchReadCountingStorage(self.storage)
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=storage, 
+                                 warning_listener=WarningRaiser(AssertionError))
+        
+        features = list(tracker.prefetching(tracker.all_features()))
+        
+        assert_that([f.properties["name"] for f in features], equal_to(["alice", "bob", "carol"]))
+        assert_that(storage.batches[-1], equal_to([path("tracker/features/" + name + ".properties.yaml") 
+                                                for name in ["alice", "bob", "carol"]]))
+        assert_that(storage.read_count("tracker/features/alice.properties.yaml"), equal_to(0))
+    
+    def test_prefetches_descriptions_in_batches_of_features_in_the_order_given(self):
+        names = ["alice", "bob", "carol", "dave", "eve"]
+        for name in names:
+            self.tracker.create(name=name, description=name + " description")
+        storage = BatchReadCountingStorage(self.storage)
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=storage, 
+                                 warning_listener=WarningRaiser(AssertionError))
+        
+        descriptions = [(f.name, f.description) 
+                        for f in tracker.prefetching(tracker.all_features(), properties=False, descriptions=True,
+                                                     batch_size=2)]
+        
+        assert_that(descriptions, equal_to([(name, name + " description") for name in names]))
+        assert_that(storage.batches[-3:], equal_to([
+                    [path("tracker/features/" + name + ".description") for name in batch]
+                    for batch in [["alice", "bob"], ["carol", "dave"], ["eve"]]]))
+        assert_that(sum(storage.read_count(path("tracker/features/" + name + ".description")) for name in names),
+                    equal_to(0))
+    
+    def test_reads_several_batches_ahead_if_asked(self):
+        names = ["alice", "bob", "carol", "dave", "eve"]
+        for name in names:
+            self.tracker.create(name=name, properties={"name": name})
+        storage = BatchReadCountingStorage(self.storage)
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=storage, 
+                                 warning_listener=WarningRaiser(AssertionError))
+        
+        properties = [f.properties["name"] for f in tracker.prefetching(tracker.all_features(), batch_size=1, depth=3)]
+        
+        assert_that(properties, equal_to(names))
+        assert_that(sum(storage.read_count(path("tracker/features/" + name + ".properties.yaml")) for name in names),
+                    equal_to(0))
+    
+    def test_closing_one_prefetching_iterator_does_not_cancel_the_reads_of_another(self):
+        for name in ["alice", "bob", "carol"]:
+            self.tracker.create(name=name, properties={"name": name})
+        storage = BatchReadCountingStorage(self.storage)
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=storage, 
+                                 warning_listener=WarningRaiser(AssertionError))
+        
+        outer = tracker.prefetching(tracker.all_features(), batch_size=1)
+        next(outer)
+        inner = tracker.prefetching([tracker.feature_named("carol")])
+        next(inner)
+        inner.close()
+        bob = next(outer)
+        
+        assert_that(bob.properties, equal_to({"name": "bob"}))
+        assert_that(storage.read_count(path("tracker/features/bob.properties.yaml")), equal_to(0))
+    
+    def test_prefetches_excerpts_of_descriptions_in_batches(self):
+        names = ["alice", "bob", "carol"]
+        for name in names:
+            self.tracker.create(name=name, description=name + " excerpt\n" + "a long log\n"*1000)
+        storage = BatchReadCountingStorage(self.storage)
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=storage, 
+                                 warning_listener=WarningRaiser(AssertionError))
+        
+        excerpts = [f.description_excerpt() 
+                    for f in tracker.prefetching(tracker.all_features(), properties=False, excerpts=True, batch_size=2)]
+        
+        assert_that(excerpts, equal_to([name + " excerpt" for name in names]))
+        assert_that(storage.batches[-2:], equal_to([
+                    [path("tracker/features/" + name + ".description") for name in batch]
+                    for batch in [["alice", "bob"], ["carol"]]]))
+        assert_that(sum(storage.read_count(path("tracker/features/" + name + ".description")) for name in names),
+                    equal_to(0))
+    
+    def test_changes_made_while_prefetching_excerpts_are_not_hidden(self):
+        for name in ["alice", "bob"]:
+            self.tracker.create(name=name, description=name + " description")
+        
+        seen = []
+        for feature in self.tracker.prefetching(self.tracker.all_features(), properties=False, excerpts=True, 
+                                                batch_size=1):
+            if feature.name == "alice":
+                self.tracker.feature_named("bob").description = "new description"
+            seen.append(feature.description_excerpt())
+        
+        assert_that(seen, equal_to(["alice description", "new description"]))
+    
+    def test_drops_prefetched_descriptions_that_are_not_used_by_the_end_of_their_batch(self):
+        for name in ["alice", "bob", "carol"]:
+            self.tracker.create(name=name, description=name + " description")
+        
+        for feature in self.tracker.prefetching(self.tracker.all_features(), properties=False, descriptions=True,
+                                                batch_size=2):
+            pass
+        reads_when_prefetching = self.storage.read_count(path("tracker/features/alice.description"))
+        
+        assert_that(self.tracker.feature_named("alice").description, equal_to("alice description"))
+        assert_that(self.storage.read_count(path("tracker/features/alice.description")), 
+                    equal_to(reads_when_prefetching + 1))
+    
+    def test_changes_made_while_prefetching_are_not_hidden_by_prefetched_files(self):
+        for name in ["alice", "bob", "carol"]:
+            self.tracker.create(name=name, description=name + " description", properties={"name": name})
+        
+        seen = []
+        for feature in self.tracker.prefetching(self.tracker.all_features(), descriptions=True, batch_size=1):
+            if feature.name == "alice":
+                bob = self.tracker.feature_named("bob")
+                bob.description = "new description"
+                bob.properties = {"name": "robert"}
+            seen.append((feature.description, feature.properties["name"]))
+        
+        assert_that(seen, equal_to([("alice description", "alice"),
+                                    ("new description", "robert"),
+                                    ("carol description", "carol")]))
+    
+    def test_does_not_prefetch_properties_that_have_not_been_saved(self):
+        alice = self.tracker.create(name="alice", properties={"a":"1"})
+        self.tracker.save()
+        self.tracker.buffer_writes()
+        alice.properties = {"a":"2"}
+        
+        features = list(self.tracker.prefetching([alice]))
+        
+        assert_that(features[0].properties, equal_to({"a":"2"}))
+    
+    def test_excerpt_of_description_is_its_first_line(self):
+        alice = self.tracker.create(name="alice", description="the first line\nthe second line\n")
+        bob = self.tracker.create(name="bob", description="only one line")
+        carol = self.tracker.create(name="carol", description="")
+        
+        assert_that(alice.description_excerpt(), equal_to("the first line"))
+        assert_that(bob.description_excerpt(), equal_to("only one line"))
+        assert_that(carol.description_excerpt(), equal_to(""))
+    
+    def test_excerpt_of_description_is_no_longer_than_max_bytes(self):
+        alice = self.tracker.create(name="alice", description="the first line\nthe second line\n")
+        
+        assert_that(alice.description_excerpt(max_bytes=9), equal_to("the first"))
+    
+    def test_reads_description_only_as_far_as_the_end_of_the_excerpt(self):
+        self.tracker.create(name="alice", description="the first line\n" + "a long log\n"*10000)
+        stats = IOStats()
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=InstrumentedStorage(self.storage, stats), 
+                                 warning_listener=WarningRaiser(AssertionError))
+        
+        alice = tracker.feature_named("alice")
+        bytes_read_by_load = stats.bytes_read
+        
+        assert_that(alice.description_excerpt(), equal_to("the first line"))
+        assert_that(stats.bytes_read - bytes_read_by_load, equal_to(len("the first line\n")))
+    
+    def test_reads_files_changed_by_other_processes_afresh_when_told_of_the_change(self):
+        alice = self.tracker.create(name="alice", description="old description", properties={"a": "1"})
+        alice.properties
+        
+        with self.storage.open("tracker/features/alice.properties.yaml", "w") as output:
+            output.write("a: '2'\n")
+        self.tracker.feature_files_changed(alice)
+        
+        assert_that(alice.properties, equal_to({"a": "2"}))
+    
+    def test_changes_to_properties_are_not_hidden_by_cache(self):
+        alice = self.tracker.create(name="alice", properties={"a":"1"})
+        alice.properties
+        
+        alice.properties = {"a":"2"}
+        
+        assert_that(alice.properties, equal_to({"a":"2"}))
+    
+    def test_cached_properties_are_not_affected_by_modifying_returned_properties(self):
+        alice = self.tracker.create(name="alice", properties={"a":"1"})
+        
+        alice.properties["a"] = "2"
+        
+        assert_that(alice.properties, equal_to({"a":"1"}))
+    
+    def test_renamed_and_recreated_features_do_not_see_stale_properties(self):
+        alice = self.tracker.create(name="alice", properties={"a":"1"})
+        alice.properties
+        alice.name = "bob"
+        
+        new_alice = self.tracker.create(name="alice", properties={"a":"2"})
+        
+        assert_that(alice.properties, equal_to({"a":"1"}))
+        assert_that(new_alice.properties, equal_to({"a":"2"}))
+    
+    def test_purged_and_recreated_features_do_not_see_stale_properties(self):
+        alice = self.tracker.create(name="alice", properties={"a":"1"})
+        alice.properties
+        self.tracker.purge("alice")
+        
+        new_alice = self.tracker.create(name="alice", properties={"a":"2"})
+        
+        assert_that(new_alice.properties, equal_to({"a":"2"}))
+    
+    def test_indexes_features_by_property_value(self):
+        self.tracker.create(name="alice", properties={"component": "ui", "milestone": 1})
+        self.tracker.create(name="bob", properties={"component": ["db", "ui"]})
+        self.tracker.create(name="carol", properties={})
+        
+        index = self.tracker.property_index("component")
+        
+        assert_that(sorted(index.values()), equal_to(["db", "ui"]))
+        assert_that(index.features_with_value("ui"), equal_to(set(["alice", "bob"])))
+        assert_that(self.tracker.property_index("milestone").features_with_value("1"), equal_to(set(["alice"])))
+    
+    def test_reports_properties_file_that_is_not_a_mapping_when_indexing(self):
+        self.tracker.create(name="alice", properties={"component": "ui"})
+        with self.storage.open("tracker/features/alice.properties.yaml", "w") as output:
+            output.write("- a\n- list\n")
+        
+        try:
+            self.tracker.property_index("component")
+            raise AssertionError("should have raised UserError")
+        except UserError as e:
+            assert_that(str(e), contains_string("alice.properties.yaml"))
+    
+    def test_keeps_property_index_up_to_date_when_properties_change(self):
+        alice = self.tracker.create(name="alice", properties={"component": "ui"})
+        index = self.tracker.property_index("component")
+        
+        alice.properties = {"component": "db"}
+        
+        assert_that(index.features_with_value("ui"), equal_to(set()))
+        assert_that(index.features_with_value("db"), equal_to(set(["alice"])))
+    
+    def test_builds_property_index_without_parsing_unchanged_properties_files(self):
+        self.tracker.create(name="alice", properties={"component": "ui"})
+        self.tracker.create(name="bob", properties={"component": "db"})
+        self.tracker.property_index("component")
+        self.tracker.save()
+        
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=self.storage, 
+                                 warning_listener=WarningRaiser(AssertionError))
+        tracker.feature_named("bob").properties = {"component": "ui"}
+        
+        index = tracker.property_index("component")
+        
+        assert_that(index.features_with_value("ui"), equal_to(set(["alice", "bob"])))
+        assert_that(self.storage.read_count("tracker/features/alice.properties.yaml"), equal_to(1))
+    
+    def test_checks_whether_properties_files_have_changed_in_one_batch_when_building_property_index(self):
+        for name in ["alice", "bob", "carol"]:
+            self.tracker.create(name=name, properties={"component": "ui"})
+        self.tracker.save()
+        storage = StatCountingStorage(self.storage)
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=storage, 
+                                 warning_listener=WarningRaiser(AssertionError))
+        
+        tracker.property_index("component")
+        
+        assert_that(sorted(storage.batches[-1]), equal_to([path("tracker/features/" + name + ".properties.yaml")
+                                                           for name in ["alice", "bob", "carol"]]))
+        assert_that([p for p in storage.stats if p.endswith(PropertiesSuffix)], equal_to([]))
+    
     def returns_a_copy_of_its_properties(self):
         new_feature = self.tracker.create(name="new-feature", properties={"a":"1", "b":"2"})
         
@@ -337,6 +634,31 @@ class FeatureTracker_HappyPath_Tests:
                        "T": [carol, alice, bob],
                        "U": [dave]})
 
+    def test_can_bulk_change_status_to_a_given_priority(self):
+        alice = self.tracker.create(name="alice", status="S")
+        bob = self.tracker.create(name="bob", status="S")
+        carol = self.tracker.create(name="carol", status="T")
+        dave = self.tracker.create(name="dave", status="T")
+        
+        self.tracker.bulk_change_status(from_status="S", to_status="T", priority=2)
+        
+        assert_status("after bulk change", self.tracker,
+                      {"S": [],
+                       "T": [carol, alice, bob, dave]})
+        assert_that(alice.status, equal_to("T"))
+        assert_that(bob.status, equal_to("T"))
+    
+    def test_bulk_change_of_status_writes_each_index_once(self):
+        for name in ["alice", "bob", "carol"]:
+            self.tracker.create(name=name, status="S")
+        self.tracker.create(name="dave", status="T")
+        
+        writes_before = self.storage.write_count("tracker/status/T.index")
+        self.tracker.bulk_change_status(from_status="S", to_status="T")
+        
+        assert_that(self.storage.write_count("tracker/status/T.index"), equal_to(writes_before+1))
+        assert_that(not self.storage.exists("tracker/status/S.index"))
+    
     def test_can_bulk_change_to_same_status(self):
         alice = self.tracker.create(name="alice", status="S")
         bob = self.tracker.create(name="bob", status="S")
@@ -407,6 +729,352 @@ class FeatureTracker_HappyPath_Tests:
         assert_that(not self.storage.exists("tracker/status/testing.index"),
                     "should not have created an empty index file")
 
+class FeatureTracker_LoadCache_Tests:
+    def setup(self):
+        self.storage = MemStorage()
+        
+        tracker = self.create_tracker()
+        tracker.create(name="alice", status="S")
+        tracker.create(name="bob", status="S")
+        tracker.create(name="carol", status="T")
+        tracker.save()
+    
+    def test_loads_indices_from_cache_without_reading_index_files(self):
+        tracker = self.create_tracker()
+        
+        assert_that(self.storage.read_count("tracker/status/S.index"), equal_to(0))
+        assert_that(self.storage.read_count("tracker/status/T.index"), equal_to(0))
+        
+        assert_status("loaded from cache", tracker,
+                      {"S": [tracker.feature_named("alice"), tracker.feature_named("bob")],
+                       "T": [tracker.feature_named("carol")]})
+    
+    def test_brings_cache_up_to_date_with_changes_made_by_tracker(self):
+        tracker = self.create_tracker()
+        tracker.feature_named("bob").priority = 1
+        tracker.feature_named("carol").status = "S"
+        tracker.create(name="dave", status="U")
+        tracker.save()
+        
+        tracker = self.create_tracker()
+        
+        assert_that(self.storage.read_count("tracker/status/S.index"), equal_to(0))
+        assert_status("after changes", tracker,
+                      {"S": [tracker.feature_named("bob"), 
+                             tracker.feature_named("alice"), 
+                             tracker.feature_named("carol")],
+                       "T": [],
+                       "U": [tracker.feature_named("dave")]})
+    
+    def test_ignores_cache_when_index_file_changed_by_something_else(self):
+        with self.storage.open("tracker/status/S.index", "w") as output:
+            output.write("bob\nalice\n")
+        
+        tracker = self.create_tracker()
+        
+        assert_status("after external change", tracker,
+                      {"S": [tracker.feature_named("bob"), tracker.feature_named("alice")]})
+    
+    def test_ignores_cache_when_feature_files_removed_by_something_else(self):
+        self.storage.remove("tracker/features/bob.description")
+        self.storage.remove("tracker/features/bob.properties.yaml")
+        
+        warnings = WarningRecorder()
+        tracker = self.create_tracker(warning_listener=warnings)
+        
+        assert_that(list(warnings), equal_to([("unknown_feature", {"name": "bob", "status": "S"})]))
+    
+    def test_does_not_cache_state_if_files_changed_by_something_else_while_tracker_loaded(self):
+        tracker = self.create_tracker()
+        tracker.feature_named("alice").priority = 2
+        
+        with self.storage.open("tracker/status/T.index", "w") as output:
+            output.write("")
+        
+        tracker.save()
+        
+        tracker = self.create_tracker(warning_listener=IgnoreWarnings())
+        
+        assert_that(self.storage.read_count("tracker/status/S.index"), equal_to(1))
+    
+    def test_checks_whether_indices_have_changed_in_one_batch(self):
+        storage = StatCountingStorage(self.storage)
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=storage, 
+                                 warning_listener=WarningRaiser(AssertionError))
+        
+        assert_that(storage.batches, equal_to([["tracker/status/S.index", "tracker/status/T.index", "tracker/features"]]))
+        assert_that(storage.stats, equal_to([LoadCacheFile]))
+    
+    def test_sees_changes_made_through_another_tracker_when_refreshed(self):
+        tracker = self.create_tracker()
+        alice = tracker.feature_named("alice")
+        alice.properties = {"a": "1"}
+        tracker.save()
+        assert_that(alice.properties, equal_to({"a": "1"}))
+        assert_that(tracker.property_index("a").features_with_value("1"), equal_to(set(["alice"])))
+        
+        other = self.create_tracker()
+        other_alice = other.feature_named("alice")
+        other_alice.properties = {"a": "2"}
+        other_alice.status = "T"
+        other.feature_named("bob").description = "changed description"
+        other.save()
+        
+        tracker.refresh()
+        
+        alice = tracker.feature_named("alice")
+        assert_that(alice.status, equal_to("T"))
+        assert_that(alice.properties, equal_to({"a": "2"}))
+        assert_that(tracker.property_index("a").features_with_value("2"), equal_to(set(["alice"])))
+        assert_that(tracker.feature_named("bob").description, equal_to("changed description"))
+        assert_status("after refresh", tracker,
+                      {"S": [tracker.feature_named("bob")],
+                       "T": [tracker.feature_named("carol"), alice]})
+    
+    def test_does_not_reload_indices_when_refreshed_if_nothing_has_changed(self):
+        tracker = self.create_tracker()
+        alice = tracker.feature_named("alice")
+        
+        tracker.refresh()
+        
+        assert_that(tracker.feature_named("alice"), same_instance(alice))
+    
+    def test_ignores_corrupt_cache(self):
+        with self.storage.open(LoadCacheFile, "w") as output:
+            output.write("garbage")
+        
+        tracker = self.create_tracker()
+        
+        assert_status("after ignoring corrupt cache", tracker,
+                      {"S": [tracker.feature_named("alice"), tracker.feature_named("bob")],
+                       "T": [tracker.feature_named("carol")]})
+    
+    def create_tracker(self, warning_listener=None):
+        return FeatureTracker(config=default_config(datadir="tracker"), 
+                              storage=self.storage, 
+                              warning_listener=warning_listener if warning_listener is not None else WarningRaiser(AssertionError))
+
+
+class FeatureTracker_BufferedWrites_Tests:
+    def setup(self):
+        self.storage = MemStorage()
+        self.tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                      storage=self.storage, 
+                                      warning_listener=WarningRaiser(AssertionError))
+        self.tracker.buffer_writes()
+    
+    def test_does_not_write_changes_until_saved(self):
+        self.tracker.create(name="alice", description="alice-description")
+        
+        assert_that(not self.storage.exists("tracker/status/new.index"))
+        assert_that(not self.storage.exists("tracker/features/alice.description"))
+        
+        self.tracker.save()
+        
+        assert_that(self.storage.open("tracker/status/new.index").read(), equal_to("alice\n"))
+        assert_that(self.storage.open("tracker/features/alice.description").read(), equal_to("alice-description"))
+    
+    def test_does_not_remove_files_of_purged_feature_until_saved(self):
+        self.tracker.create(name="alice", description="alice-description")
+        self.tracker.save()
+        
+        self.tracker.purge("alice")
+        
+        assert_that(self.storage.exists("tracker/features/alice.description"))
+        
+        self.tracker.save()
+        
+        assert_that(not self.storage.exists("tracker/features/alice.description"))
+    
+    def test_does_not_rename_files_of_renamed_feature_until_saved(self):
+        self.tracker.create(name="alice", description="alice-description", properties={"a": "1"})
+        self.tracker.save()
+        
+        feature = self.tracker.feature_named("alice")
+        feature.name = "bob"
+        
+        assert_that(self.storage.exists("tracker/features/alice.description"))
+        assert_that(not self.storage.exists("tracker/features/bob.description"))
+        assert_that(feature.description, equal_to("alice-description"))
+        assert_that(feature.description_excerpt(), equal_to("alice-description"))
+        assert_that(feature.properties, equal_to({"a": "1"}))
+        
+        self.tracker.save()
+        
+        assert_that(not self.storage.exists("tracker/features/alice.description"))
+        assert_that(self.storage.open("tracker/features/bob.description").read(), equal_to("alice-description"))
+    
+    def test_completes_renames_interrupted_after_moving_files_aside_when_next_loaded(self):
+        self.tracker.create(name="alice", description="alice-description", properties={"a": "1"})
+        self.tracker.create(name="carol", description="carol-description")
+        self.tracker.save()
+        
+        storage = RenameInterruptingStorage(self.storage)
+        tracker = FeatureTracker(config=default_config(datadir="tracker"), 
+                                 storage=storage, 
+                                 warning_listener=WarningRaiser(AssertionError))
+        tracker.buffer_writes()
+        tracker.feature_named("alice").name = "bob"
+        try:
+            tracker.save()
+        except IOError:
+            pass
+        assert_that(self.storage.exists("tracker/features/bob.description.moving"))
+        
+        warnings = WarningRecorder()
+        reloaded = FeatureTracker(config=default_config(datadir="tracker"), 
+                                  storage=self.storage, 
+                                  warning_listener=warnings)
+        
+        assert_that(sorted(self.storage.list("tracker/features/*")), equal_to([
+                    "tracker/features/bob.description", "tracker/features/bob.properties.yaml",
+                    "tracker/features/carol.description", "tracker/features/carol.properties.yaml"]))
+        bob = reloaded.feature_named("bob")
+        assert_that(bob.status, equal_to(LostAndFoundStatus))
+        assert_that(bob.description, equal_to("alice-description"))
+        assert_that(bob.properties, equal_to({"a": "1"}))
+        assert_that(list(warnings)[:2], equal_to([
+                    ("interrupted_move", {"path": "tracker/features/bob.description"}),
+                    ("interrupted_move", {"path": "tracker/features/bob.properties.yaml"})]))
+        assert_that(("unknown_feature", {"name": "alice", "status": "new"}), is_in(list(warnings)))
+    
+    def test_can_swap_the_names_of_features_before_saving(self):
+        self.tracker.create(name="alice", description="alice-description")
+        self.tracker.create(name="bob", description="bob-description")
+        self.tracker.save()
+        
+        self.tracker.feature_named("alice").name = "temp"
+        self.tracker.feature_named("bob").name = "alice"
+        self.tracker.feature_named("temp").name = "bob"
+        self.tracker.save()
+        
+        assert_that(self.storage.open("tracker/features/alice.description").read(), equal_to("bob-description"))
+        assert_that(self.storage.open("tracker/features/bob.description").read(), equal_to("alice-description"))
+        assert_that(not self.storage.exists("tracker/features/temp.description"))
+        assert_that(self.storage.list("tracker/features/*.moving"), equal_to([]))
+    
+    def test_can_rename_feature_to_the_name_of_a_purged_feature_before_saving(self):
+        self.tracker.create(name="alice", description="alice-description")
+        self.tracker.create(name="bob", description="bob-description")
+        self.tracker.save()
+        
+        self.tracker.purge("alice")
+        self.tracker.feature_named("bob").name = "alice"
+        
+        assert_that(self.tracker.feature_named("alice").description, equal_to("bob-description"))
+        
+        self.tracker.save()
+        
+        assert_that(self.storage.open("tracker/features/alice.description").read(), equal_to("bob-description"))
+        assert_that(not self.storage.exists("tracker/features/bob.description"))
+    
+    def test_can_rename_a_feature_that_has_not_been_saved(self):
+        self.tracker.create(name="alice", description="alice-description")
+        self.tracker.feature_named("alice").name = "bob"
+        self.tracker.save()
+        
+        assert_that(not self.storage.exists("tracker/features/alice.description"))
+        assert_that(self.storage.open("tracker/features/bob.description").read(), equal_to("alice-description"))
+    
+    def test_applies_pending_renames_before_reporting_the_filename_of_a_feature_file(self):
+        self.tracker.create(name="alice", description="alice-description")
+        self.tracker.save()
+        
+        self.tracker.feature_named("alice").name = "bob"
+        filename = self.tracker.feature_named("bob").description_file
+        
+        assert_that(filename, equal_to(self.storage.abspath("tracker/features/bob.description")))
+        assert_that(self.storage.open("tracker/features/bob.description").read(), equal_to("alice-description"))
+    
+    def test_excerpt_of_description_shows_unsaved_changes(self):
+        alice = self.tracker.create(name="alice", description="alice-description")
+        
+        assert_that(alice.description_excerpt(), equal_to("alice-description"))
+    
+    def test_syncs_storage_after_writing_changes(self):
+        syncs = []
+        self.storage.sync = lambda: syncs.append(self.storage.exists("tracker/status/new.index"))
+        self.tracker.create(name="alice")
+        
+        self.tracker.save()
+        
+        assert_that(syncs, equal_to([True]))
+    
+    def test_configures_durability_of_storage(self):
+        self.storage.durability = None
+        
+        self.tracker.configure(durability="file")
+        
+        assert_that(self.storage.durability, equal_to("file"))
+    
+    def test_writes_each_changed_file_once_when_saved(self):
+        alice = self.tracker.create(name="alice", status="S")
+        bob = self.tracker.create(name="bob", status="S", properties={"x": "1"})
+        bob.priority = 1
+        bob.properties = {"x": "2"}
+        alice.status = "T"
+        
+        self.tracker.save()
+        
+        for path in ["tracker/status/S.index", "tracker/status/T.index", 
+                     "tracker/features/bob.properties.yaml"]:
+            assert_that(self.storage.write_count(path), equal_to(1), path)
+    
+    def test_reads_see_unsaved_changes(self):
+        alice = self.tracker.create(name="alice", description="first", properties={"x": "1"})
+        alice.description = "second"
+        alice.properties = {"x": "2"}
+        
+        assert_that(alice.description, equal_to("second"))
+        assert_that(alice.properties, equal_to({"x": "2"}))
+    
+    def test_changes_made_to_properties_after_setting_them_are_not_saved(self):
+        properties = {"x": "1"}
+        alice = self.tracker.create(name="alice", properties=properties)
+        properties["x"] = "2"
+        
+        self.tracker.save()
+        
+        assert_that(alice.properties, equal_to({"x": "1"}))
+    
+    def test_writes_feature_file_before_reporting_its_location(self):
+        alice = self.tracker.create(name="alice", description="alice-description")
+        
+        self.storage.relpath(alice.description_file)
+        
+        assert_that(self.storage.open("tracker/features/alice.description").read(), equal_to("alice-description"))
+    
+    def test_can_rename_unsaved_feature(self):
+        alice = self.tracker.create(name="alice", description="alice-description")
+        alice.name = "carol"
+        
+        self.tracker.save()
+        
+        assert_that(self.storage.exists("tracker/features/alice.description"), equal_to(False))
+        assert_that(self.storage.open("tracker/features/carol.description").read(), equal_to("alice-description"))
+        assert_that(self.storage.open("tracker/status/new.index").read(), equal_to("carol\n"))
+    
+    def test_can_purge_unsaved_feature(self):
+        self.tracker.create(name="alice", description="alice-description")
+        self.tracker.create(name="bob")
+        self.tracker.purge("alice")
+        
+        self.tracker.save()
+        
+        assert_that(list(self.storage.list("tracker/features/alice.*")), equal_to([]))
+        assert_that(self.storage.open("tracker/status/new.index").read(), equal_to("bob\n"))
+    
+    def test_deletes_index_files_that_become_empty_when_saved(self):
+        alice = self.tracker.create(name="alice", status="S")
+        self.tracker.save()
+        
+        alice.status = "T"
+        self.tracker.save()
+        
+        assert_that(not self.storage.exists("tracker/status/S.index"))
+
+
 def ignoring_warnings(fn):
     @wraps(fn)
     def apply_context(*args, **kwargs):
@@ -539,6 +1207,16 @@ class FeatureTracker_StorageRepair_Tests:
                        "s2": [tracker.feature_named("carol"),
                               tracker.feature_named("dave")]})
     
+    def test_does_not_probe_storage_for_each_indexed_feature(self):
+        self.create_features({"s1": ["alice", "bob", "carol"],
+                              "s2": ["dave", "eve"]})
+        
+        self.storage = ExistenceCountingStorage(self.storage)
+        self.create_tracker()
+        
+        assert_that([p for p in self.storage.existence_checks if p.startswith("tracker/features/")], 
+                    equal_to([]))
+    
     def test_warns_if_index_contains_nonexistent_feature(self):
         self.create_features({"s1": ["alice", "bob"],
                               "s2": ["carol", "dave"]})
@@ -581,6 +1259,174 @@ class FeatureTracker_StorageRepair_Tests:
             LinesFormat(list).save(index_entries, output)
 
 
+class FeatureTracker_Journal_Tests:
+    def setup(self):
+        self.storage = MemStorage("basedir")
+        self.tracker = self.create_tracker()
+        for name in ["alice", "bob", "carol"]:
+            self.tracker.create(name=name, status="S")
+        self.tracker.compact_status_indices()
+    
+    def create_tracker(self, warning_listener=None, **config):
+        return FeatureTracker(config=dict(default_config(datadir="tracker", journal_status_indices=True), **config),
+                              storage=self.storage,
+                              warning_listener=warning_listener if warning_listener is not None else WarningRaiser(AssertionError))
+    
+    def test_appends_changes_to_journal_instead_of_rewriting_index(self):
+        index_writes = self.storage.write_count("tracker/status/S.index")
+        
+        self.tracker.feature_named("carol").priority = 1
+        self.tracker.feature_named("alice").status = "T"
+        
+        assert_that(self.storage.write_count("tracker/status/S.index"), equal_to(index_writes))
+        assert_that(self.storage.exists("tracker/status/S.journal"))
+        assert_that(self.storage.exists("tracker/status/T.journal"))
+    
+    def test_replays_journals_when_loaded(self):
+        self.tracker.feature_named("carol").priority = 1
+        self.tracker.feature_named("alice").status = "T"
+        self.tracker.feature_named("bob").name = "robert"
+        self.tracker.create(name="dave", status="U")
+        self.tracker.purge("dave")
+        
+        reloaded = self.create_tracker()
+        
+        assert_that([f.name for f in reloaded.features_with_status("S")], equal_to(["carol", "robert"]))
+        assert_that([f.name for f in reloaded.features_with_status("T")], equal_to(["alice"]))
+        assert_that(reloaded.statuses(), equal_to(["S", "T"]))
+    
+    def test_compaction_writes_indices_in_plain_format_and_removes_journals(self):
+        self.tracker.feature_named("carol").priority = 1
+        self.tracker.feature_named("alice").status = "T"
+        
+        self.tracker.compact_status_indices()
+        
+        assert_that(self.storage.list("tracker/status/*"),
+                    equal_to(["tracker/status/S.index", "tracker/status/T.index"]))
+        assert_that(self.index_entries("S"), equal_to(["carol", "bob"]))
+        assert_that(self.index_entries("T"), equal_to(["alice"]))
+    
+    def test_compacts_journal_when_it_reaches_threshold(self):
+        tracker = self.create_tracker(journal_compaction_threshold=3)
+        
+        tracker.feature_named("carol").priority = 1
+        tracker.feature_named("bob").priority = 1
+        tracker.feature_named("alice").priority = 1
+        assert_that(self.storage.exists("tracker/status/S.journal"))
+        
+        tracker.feature_named("carol").priority = 1
+        assert_that(not self.storage.exists("tracker/status/S.journal"))
+        assert_that(self.index_entries("S"), equal_to(["carol", "alice", "bob"]))
+    
+    def test_buffered_changes_are_appended_to_journal_when_saved(self):
+        self.tracker.buffer_writes()
+        self.tracker.feature_named("carol").priority = 1
+        self.tracker.feature_named("bob").priority = 1
+        
+        assert_that(not self.storage.exists("tracker/status/S.journal"))
+        
+        self.tracker.save()
+        
+        with self.storage.open("tracker/status/S.journal") as input:
+            assert_that(len(input.read().splitlines()), equal_to(2))
+        assert_that([f.name for f in self.create_tracker().features_with_status("S")],
+                    equal_to(["bob", "carol", "alice"]))
+    
+    def test_turning_off_journaling_compacts_journals(self):
+        self.tracker.feature_named("carol").priority = 1
+        
+        self.tracker.configure(journal_status_indices=False)
+        self.tracker.feature_named("bob").priority = 1
+        
+        assert_that(not self.storage.exists("tracker/status/S.journal"))
+        assert_that(self.index_entries("S"), equal_to(["bob", "carol", "alice"]))
+    
+    def test_ignores_and_repairs_journal_records_that_do_not_apply_to_index(self):
+        self.tracker.feature_named("carol").priority = 1
+        with self.storage.open("tracker/status/S.journal", "a") as output:
+            output.write('["remove","eve"]\n')
+        
+        warnings = WarningRecorder()
+        reloaded = self.create_tracker(warning_listener=warnings)
+        
+        assert_that(list(warnings), equal_to([
+                    ("inconsistent_journal_record", {"status": "S", "record": '["remove","eve"]'})]))
+        assert_that([f.name for f in reloaded.features_with_status("S")], equal_to(["carol", "alice", "bob"]))
+        assert_that(not self.storage.exists("tracker/status/S.journal"))
+    
+    def index_entries(self, status):
+        with self.storage.open("tracker/status/" + status + ".index") as input:
+            return LinesFormat(list).load(input)
+
+
+class ExistenceCountingStorage(MemStorage):
+    def __init__(self, storage):
+        MemStorage.__init__(self, storage.basedir)
+        self.files = storage.files
+        self._children = storage._children
+        self.existence_checks = []
+    
+    def exists(self, relpath):
+        self.existence_checks.append(relpath)
+        return MemStorage.exists(self, relpath)
+
+
+class BatchReadCountingStorage(MemStorage):
+    def __init__(self, storage):
+        MemStorage.__init__(self, storage.basedir)
+        self.files = storage.files
+        self._children = storage._children
+        self.batches = []
+    
+    def read_many(self, relpaths):
+        relpaths = list(relpaths)
+        self.batches.append(relpaths)
+        return dict((p, self.files[p]) for p in relpaths if self.files.get(p) is not None)
+    
+    def read_first_lines(self, relpaths, max_bytes):
+        relpaths = list(relpaths)
+        self.batches.append(relpaths)
+        return dict((p, StringIO(self.files[p]).readline(max_bytes)) for p in relpaths if self.files.get(p) is not None)
+
+
+class StatCountingStorage(MemStorage):
+    def __init__(self, storage):
+        MemStorage.__init__(self, storage.basedir)
+        self.files = storage.files
+        self.mtimes = storage.mtimes
+        self._children = storage._children
+        self.stats = []
+        self.batches = []
+    
+    def stat(self, relpath):
+        self.stats.append(relpath)
+        return MemStorage.stat(self, relpath)
+    
+    def stat_many(self, relpaths):
+        relpaths = list(relpaths)
+        self.batches.append(relpaths)
+        return dict((p, MemStorage.stat(self, p)) for p in relpaths if self.exists(p))
+
+
+class RenameInterruptingStorage(MemStorage):
+    """
+    Fails to rename files from their MovingSuffix names, as if the process
+    had been interrupted
+    """
+    
+    def __init__(self, storage):
+        MemStorage.__init__(self, storage.basedir)
+        self.files = storage.files
+        self.mtimes = storage.mtimes
+        self._children = storage._children
+        self._clock = storage._clock
+    
+    def rename(self, old_relpath, new_relpath):
+        if old_relpath.endswith(MovingSuffix):
+            raise IOError("interrupted")
+        MemStorage.rename(self, old_relpath, new_relpath)
+
+
 def delete_entry_at(n):
     def modifier(seq):
         del seq[n]
@@ -1,3 +1,6 @@
+from datetime import date, time, datetime
+
+
 
 
 class PrintWarnings(object):
@@ -60,6 +63,48 @@ class WarningRecorder(object):
 
 
 
+class Represented(object):
+    """
+    Stands in for a warning argument that cannot be passed between processes.
+    It has the same repr as the argument, so it is reported in the same way.
+    """
+    
+    def __init__(self, text):
+        self.text = text
+    
+    def __repr__(self):
+        return self.text
+    
+    def __eq__(self, other):
+        return repr(self) == repr(other)
+    
+    def __ne__(self, other):
+        return not self == other
+
+
+def portable_warnings(warnings):
+    """
+    Returns a copy of recorded warnings that can be passed to another process
+    """
+    return [(warning_name, dict((k, _portable(v)) for (k, v) in args.items())) for (warning_name, args) in warnings]
+
+# Values of these types are passed between processes as they are, others are passed by their repr
+PortableTypes = (type(None), bool, int, long, float, str, unicode, date, time, datetime)
+
+def _portable(value):
+    if isinstance(value, PortableTypes):
+        return value
+    elif isinstance(value, (list, tuple)):
+        return type(value)(_portable(v) for v in value)
+    else:
+        return Represented(repr(value))
+
+def report_warnings(warnings, warning_listener):
+    for warning_name, args in warnings:
+        getattr(warning_listener, warning_name)(**args)
+
+
+
 class WarningRaiser(object):
     def __init__(self, exception_to_raise=UserWarning):
         self._exception_to_raise = exception_to_raise
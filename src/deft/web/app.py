@@ -13,24 +13,25 @@ import deft.tracker
 
 markdown = Markdown(safe_mode=True, output_format="xhtml1")
 
-# Not efficient!
-def excerpt(description):
-    return markdown.convert(description.splitlines()[0])
+def excerpt(feature):
+    return markdown.convert(feature.description_excerpt())
 
 def titlify(name):
     return " ".join(s.capitalize() for s in name.split("-"))
 
-class TrackerRepresentation(tornado.web.RequestHandler):
+class TrackerRequestHandler(tornado.web.RequestHandler):
     def initialize(self, tracker):
         self.tracker = tracker
     
+    def prepare(self):
+        # The tracker is loaded once but its files may be changed by other processes between requests
+        self.tracker.refresh()
+
+class TrackerRepresentation(TrackerRequestHandler):
     def get(self):
         self.render("tracker.template", tracker=self.tracker, excerpt=excerpt, titlify=titlify)
 
-class FeatureRepresentation(tornado.web.RequestHandler):
-    def initialize(self, tracker):
-        self.tracker = tracker
-    
+class FeatureRepresentation(TrackerRequestHandler):
     def get(self, feature_name):
         feature = self.tracker.feature_named(feature_name)
         self.render("feature.template", tracker=self.tracker, feature=feature, markdown=markdown.convert)